@@ -0,0 +1,75 @@
+# --- CONTROLLO DI AMMISSIONE ---
+# Prima di accodare un nuovo batch (upload dal browser e API JSON), dopo la verifica
+# preliminare: un file che verrà rifiutato non conta e non fa rimuovere altri batch.
+#   - coda: al massimo MAX_BATCH_IN_CODA batch in coda o in generazione; oltre, il batch
+#     viene rifiutato invece di restare in attesa per ore (0 = nessun limite)
+#   - memoria: MemAvailable (/proc/meminfo) almeno MIN_MEMORIA_LIBERA_MB
+#   - disco: spazio libero in BATCH_ROOT almeno MIN_DISCO_LIBERO_MB più la stima del
+#     batch (DISCO_MB_PER_RECORD per studente: diploma, camicia e la loro copia nei cumulativi)
+#   - quota: cartelle dei batch più la stima entro QUOTA_BATCH_MB
+#     (magazzino.libera_spazio ha già rimosso i batch vecchi che si potevano rimuovere)
+# Entro questi limiti il batch entra nella coda dello scheduler, che lo avvia quando
+# gli slot di render si liberano. Un rifiuto solleva Rifiutato: l'app risponde 503 con
+# Retry-After e il motivo.
+import os
+import shutil
+
+import metrics
+
+MOTIVO_CODA = 'coda'
+MOTIVO_MEMORIA = 'memoria'
+MOTIVO_DISCO = 'disco'
+MOTIVO_QUOTA = 'quota'
+
+
+class Rifiutato(Exception):
+    def __init__(self, motivo, messaggio, riprova_tra=60):
+        super().__init__(messaggio)
+        self.motivo = motivo
+        self.messaggio = messaggio
+        self.riprova_tra = riprova_tra
+
+
+def memoria_disponibile_mb(path='/proc/meminfo'):
+    """MemAvailable in MB, None se il sistema non la espone."""
+    try:
+        with open(path, encoding='ascii') as f:
+            for riga in f:
+                if riga.startswith('MemAvailable:'):
+                    return int(riga.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def disco_libero_mb(path):
+    # La cartella dei batch può non esistere ancora: si misura la più vicina esistente
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free / 1024 / 1024
+
+
+def verifica(n_record, batch_attivi, batch_root, max_batch=0, min_memoria_mb=0, min_disco_mb=0,
+             mb_per_record=0, quota_mb=0, uso_mb=0):
+    """Solleva Rifiutato se il batch di n_record studenti non può essere accettato ora."""
+    try:
+        if max_batch and batch_attivi >= max_batch:
+            raise Rifiutato(MOTIVO_CODA, f"Coda piena: {batch_attivi} batch già in coda o in generazione "
+                                         f"(massimo {max_batch}). Riprovare tra qualche minuto.", 120)
+        if min_memoria_mb:
+            memoria = memoria_disponibile_mb()
+            if memoria is not None and memoria < min_memoria_mb:
+                raise Rifiutato(MOTIVO_MEMORIA, f"Memoria insufficiente sul server: {memoria:.0f} MB liberi "
+                                                f"(minimo {min_memoria_mb} MB). Riprovare più tardi.")
+        necessario = min_disco_mb + n_record * mb_per_record
+        if necessario:
+            libero = disco_libero_mb(batch_root)
+            if libero < necessario:
+                raise Rifiutato(MOTIVO_DISCO, f"Spazio temporaneo insufficiente: {libero:.0f} MB liberi, "
+                                              f"ne servono circa {necessario:.0f} per {n_record} studenti.", 300)
+        if quota_mb and uso_mb + n_record * mb_per_record > quota_mb:
+            raise Rifiutato(MOTIVO_QUOTA, f"Quota dei batch esaurita: {uso_mb:.1f} MB occupati su {quota_mb} MB "
+                                          f"da batch ancora in lavorazione. Riprovare più tardi.", 300)
+    except Rifiutato as e:
+        metrics.BATCH_RIFIUTATI.inc(motivo=e.motivo)
+        raise
@@ -1,18 +1,30 @@
-from flask import Flask, request, send_file, render_template, redirect, url_for
-from weasyprint import HTML, CSS
-from pypdf import PdfWriter
+from flask import Flask, request, send_file, render_template, redirect, url_for, Response, jsonify
+from jinja2 import FileSystemBytecodeCache
 import io
-import csv
 import zipfile
 import tempfile
 import shutil
 import os
 from datetime import datetime
 import threading
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+import time
 import uuid
-import openpyxl
-from openpyxl import Workbook, load_workbook
-import pathlib
+import metrics
+import engine
+import luoghi
+import ammissione
+import codifica
+import archive
+import magazzino
+import catalogo
+import deposito
+import nodi
+import stampa
+import scheduler
+import preflight
+import tabella
+import watchdog_record
 
 # --- CONFIGURAZIONE PERCORSI RELATIVI ---
 # Rileva la cartella dove si trova app.py
@@ -26,6 +38,9 @@ PATH_EXCEL_REGISTRO = os.path.join(BASE_DIR, "Registri")
 # Aggiungi questo percorso
 PATH_STAMPA = os.path.join(BASE_DIR, "Da_Stampare")
 
+# Catalogo di ricerca dei diplomi archiviati (SQLite, accanto agli ZIP dell'archivio locale)
+PATH_CATALOGO = os.path.join(PATH_ARCHIVIO_1, "catalogo.sqlite")
+
 # Assicurati che esista all'avvio
 for p in [PATH_ARCHIVIO_1, PATH_ARCHIVIO_2, PATH_EXCEL_REGISTRO, PATH_STAMPA]:
     os.makedirs(p, exist_ok=True)
@@ -34,63 +49,301 @@ for p in [PATH_ARCHIVIO_1, PATH_ARCHIVIO_2, PATH_EXCEL_REGISTRO, PATH_STAMPA]:
 for p in [PATH_ARCHIVIO_1, PATH_ARCHIVIO_2, PATH_EXCEL_REGISTRO]:
     os.makedirs(p, exist_ok=True)
 
-# --- FUNZIONI DI UTILITÀ ---
-def format_place_name(place_str):
-    if not place_str: return ""
-    # Preposizioni e articoli che devono restare minuscoli
-    PREPOSITIONS = {
-        'di', 'del', 'della', 'degli', 'dei', 'de', 'da', 'dal', 
-        'dalla', 'dai', 'dagli', 'su', 'sul', 'sulla', 'sui', 
-        'sugli', 'a', 'al', 'alla', 'ai', 'agli', 'in', 'nel', 
-        'nella', 'nei', 'negli', 'per', 'con', 'e', 'il', 'lo', 'la', 'gli', 'le', 
-        "d'", "l'","de'",'val','meno',"all'"
-    }
-    # Articoli con apostrofo
-    APOSTROPHES = {"d'", "l'", "all'", "dell'", "nell'"}
-    
-    words = place_str.lower().split()
-    final = []
-    
-    for i, word in enumerate(words):
-        # Se è una preposizione e non è la prima parola, resta minuscola
-        if word in PREPOSITIONS and i > 0:
-            final.append(word.lower())
-        # Gestione apostrofi (es: l'aquila -> L'Aquila)
-        elif "'" in word:
-            parts = word.split("'")
-            prefix = parts[0] + "'"
-            suffix = parts[1]
-            if prefix in APOSTROPHES and i > 0:
-                final.append(prefix.lower() + suffix.capitalize())
-            else:
-                final.append(prefix.capitalize() + suffix.capitalize())
-        # Altrimenti capitalizza normalmente
-        else:
-            final.append(word.capitalize())
-            
-    return ' '.join(final)
+app = Flask(__name__, static_folder='static')
 
-def format_name_with_exceptions(name_str):
-    if not name_str: return ""
-    words = name_str.split()
-    return ' '.join([w[1:].lower() if w.startswith('%') else w.lower().capitalize() for w in words])
+# --- CONFIGURAZIONE ---
+# Default, poi il file indicato da GENERATORE_SETTINGS, poi le variabili GENERATORE_*
+# (es. GENERATORE_CLEANUP_DELAY_SECONDS=7200, GENERATORE_TEMPLATES_AUTO_RELOAD=false)
+app.config.from_mapping(
+    BATCH_ROOT=os.path.join(tempfile.gettempdir(), 'generatore_batch'),
+    JINJA_BYTECODE_CACHE_DIR=os.path.join(tempfile.gettempdir(), 'generatore_jinja_cache'),
+    CLEANUP_DELAY_SECONDS=3600,
+    # Processi di render condivisi da tutti i batch e soglia dei batch "piccoli" (prioritari)
+    RENDER_SLOTS=os.cpu_count() or 1,
+    BATCH_PICCOLO_MAX_RECORD=20,
+    # Budget per record (watchdog): oltre questi limiti il record va in TIMEOUT; 0 = nessun limite
+    RECORD_TIMEOUT_SECONDS=120,
+    RECORD_MAX_RSS_MB=1024,
+    # Archivio_Franco come deposito a contenuto indirizzato (deposito.py) invece che cartella di ZIP
+    ARCHIVIO_FRANCO_DEDUP=False,
+    # Spool di stampa: parti di al massimo N pagine / N MB per PDF cumulativo; 0 = un solo file
+    STAMPA_PARTE_MAX_PAGINE=0,
+    STAMPA_PARTE_MAX_MB=0,
+    # PDF cumulativi del batch: 'separati' (diplomi e camicie), 'intercalato'
+    # (diploma e camicia di ogni studente in un solo PDF) o 'entrambi'
+    PDF_CUMULATIVI='separati',
+    # CSV ISTAT dei comuni da aggiungere all'indice dei luoghi di nascita (luoghi.py); vuoto = solo dati/luoghi.txt
+    LUOGHI_INDICE='',
+    # Render su altri nodi (nodi.py): URL dei nodi, es. ["http://10.0.0.5:8101"]; vuoto = pool locale.
+    # Record per richiesta a un nodo e secondi massimi di attesa di un blocco
+    RENDER_NODI=[],
+    RENDER_NODO_BLOCCO=8,
+    RENDER_NODO_TIMEOUT=600,
+    # Ammissione (ammissione.py): dimensione massima di una richiesta (oltre: 413), batch in
+    # coda o in generazione, memoria e disco minimi; 0 = nessun limite. Gli upload oltre
+    # 500 KB vengono scritti da werkzeug su file temporaneo a blocchi, non tenuti in memoria.
+    MAX_CONTENT_LENGTH=32 * 1024 * 1024,
+    MAX_BATCH_IN_CODA=20,
+    MIN_MEMORIA_LIBERA_MB=512,
+    MIN_DISCO_LIBERO_MB=1024,
+    DISCO_MB_PER_RECORD=1,
+    # Spazio massimo delle cartelle dei batch in BATCH_ROOT (magazzino.py); 0 = nessuna quota
+    QUOTA_BATCH_MB=0,
+)
+app.config.from_envvar('GENERATORE_SETTINGS', silent=True)
+app.config.from_prefixed_env('GENERATORE')
+
+# Cache del bytecode Jinja su disco: i worker non ricompilano i template ad ogni avvio
+if app.config['JINJA_BYTECODE_CACHE_DIR']:
+    os.makedirs(app.config['JINJA_BYTECODE_CACHE_DIR'], exist_ok=True)
+    app.jinja_options = {**app.jinja_options,
+                         'bytecode_cache': FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])}
+
+# Ambiente Jinja del motore di rendering (diplomi e camicie): auto-reload dei template
+# come Flask, cioè TEMPLATES_AUTO_RELOAD se impostato, altrimenti solo in debug
+def configura_engine():
+    auto_reload = app.config.get('TEMPLATES_AUTO_RELOAD')
+    if auto_reload is None:
+        auto_reload = app.debug
+    engine.configura_jinja(auto_reload=auto_reload,
+                           bytecode_cache_dir=app.config['JINJA_BYTECODE_CACHE_DIR'])
+    engine.configura_cumulativi(app.config['PDF_CUMULATIVI'])
+    luoghi.configura(app.config['LUOGHI_INDICE'])
+
+configura_engine()
 
-app = Flask(__name__, static_folder='static')
 temp_pdf_batches = {}
-CLEANUP_DELAY_SECONDS = 3600 
+CLEANUP_DELAY_SECONDS = app.config['CLEANUP_DELAY_SECONDS']
+
+def archivi():
+    """(cartelle che ricevono lo ZIP, depositi a contenuto indirizzato) per archive.archivia_batch."""
+    if app.config['ARCHIVIO_FRANCO_DEDUP']:
+        return (PATH_ARCHIVIO_1,), (PATH_ARCHIVIO_2,)
+    return (PATH_ARCHIVIO_1, PATH_ARCHIVIO_2), ()
+
+def preload():
+    """Warmup da eseguire prima del fork dei worker (preload_app di gunicorn).
+
+    Compila tutti i template del registro e carica in memoria font e immagini:
+    i worker li ereditano già pronti invece di caricarli alla prima richiesta.
+    """
+    configura_engine()
+    for template_filename in engine.precompila_template():
+        app.logger.warning("Template '%s' presente nel registro ma non trovato", template_filename)
+    n_asset = engine.carica_asset_statici()
+    app.logger.info("Preload completato: %d asset statici in memoria", n_asset)
+
+# --- SCHEDULER ---
+# Creato al primo uso (dopo il fork dei worker gunicorn: un pool per processo)
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            return _scheduler
+        slots, crea_pool = app.config['RENDER_SLOTS'], engine.crea_pool_render
+        if app.config['RENDER_NODI']:
+            # Due blocchi in volo per nodo (nodi.EsecutoreRemoto)
+            blocco = app.config['RENDER_NODO_BLOCCO']
+            slots = 2 * blocco * len(app.config['RENDER_NODI'])
+            crea_pool = lambda _slots, _warmup: nodi.EsecutoreRemoto(app.config['RENDER_NODI'], blocco,
+                                                                     timeout=app.config['RENDER_NODO_TIMEOUT'])
+        _scheduler = scheduler.RenderScheduler(slots,
+                                               soglia_piccoli=app.config['BATCH_PICCOLO_MAX_RECORD'],
+                                               budget=budget_record(), crea_pool=crea_pool)
+    spazza_batch_orfani()
+    riprendi_batch_interrotti()
+    return _scheduler
+
+def budget_record(fattore=1):
+    return watchdog_record.budget_record(app.config['RECORD_TIMEOUT_SECONDS'] * fattore,
+                                         app.config['RECORD_MAX_RSS_MB'] * fattore)
+
+def accoda_batch(batch_id, dest_dir, students_data, facolta, nome_cartella, urgente=False, profilo=False,
+                 gia_conclusi=None, rivendicazione=None):
+    metadata = engine.metadati_batch(students_data, facolta)
+
+    def on_complete(risultato):
+        # Salvataggio Batch
+        salva_batch(batch_id, engine.nuovo_batch_info(dest_dir, risultato, nome_cartella, metadata))
+        programma_pulizia(batch_id, CLEANUP_DELAY_SECONDS)
+
+    return get_scheduler().submit(scheduler.Job(batch_id, facolta, students_data, dest_dir, nome_cartella,
+                                                on_complete, urgente=urgente, profilo=profilo,
+                                                gia_conclusi=gia_conclusi, rivendicazione=rivendicazione))
+
+def programma_pulizia(batch_id, secondi):
+    timer = threading.Timer(secondi, cleanup_batch_data, args=[batch_id])
+    timer.daemon = True
+    timer.start()
+
+def spazza_batch_orfani():
+    """All'avvio: rimuove le cartelle lasciate da un processo precedente e riprogramma
+    la pulizia dei batch conclusi ancora validi (il loro timer è andato perso)."""
+    rimossi, da_programmare = magazzino.spazza(app.config['BATCH_ROOT'], CLEANUP_DELAY_SECONDS)
+    if rimossi:
+        app.logger.info("Rimosse %d cartelle di batch scadute od orfane", len(rimossi))
+    for batch_id, secondi in da_programmare:
+        programma_pulizia(batch_id, secondi)
+
+def riprendi_batch_interrotti():
+    """Rimette in coda i batch rimasti a metà (processo terminato durante la generazione).
+
+    Vengono rigenerati solo i record assenti dal manifest; la pagina /job/<id>
+    torna a mostrare l'avanzamento e poi l'anteprima. Ogni worker gunicorn lo esegue
+    all'avvio: si riprendono solo i batch di cui si ottiene il lock (quelli di un
+    worker ancora vivo restano suoi), così un batch non viene generato due volte.
+    """
+    for dest_dir in engine.batch_interrotti(app.config['BATCH_ROOT']):
+        batch_id = os.path.basename(dest_dir)
+        rivendicazione = engine.rivendica_batch(dest_dir)
+        if rivendicazione is None:
+            continue
+        # Rilettura dopo il lock: il worker che lo aveva può averlo appena concluso
+        letto = None
+        if not os.path.exists(os.path.join(dest_dir, engine.BATCH_INFO_FILENAME)):
+            letto = engine.leggi_manifest(dest_dir)
+        if letto is None:
+            engine.rilascia_batch(rivendicazione)
+            continue
+        intestazione, conclusi = letto
+        parametri = intestazione['parametri']
+        app.logger.info("Ripresa del batch %s: %d/%d record già generati", batch_id,
+                        len(conclusi), len(intestazione['students_data']))
+        accoda_batch(batch_id, dest_dir, intestazione['students_data'], parametri['facolta'],
+                     intestazione['nome_cartella'], urgente=parametri.get('urgente', False),
+                     profilo=parametri.get('profilo', False), gia_conclusi=conclusi, rivendicazione=rivendicazione)
+
+# --- STATO DEI BATCH ---
+# batch.json nella cartella del batch: con più worker la richiesta di anteprima,
+# archivio o stampa può arrivare a un processo diverso da quello che ha generato.
+def salva_batch(batch_id, batch_info):
+    temp_pdf_batches[batch_id] = batch_info
+    engine.scrivi_batch_info(batch_info)
+
+def get_batch(batch_id):
+    try:
+        uuid.UUID(batch_id)
+    except ValueError:
+        return None
+    info_path = os.path.join(app.config['BATCH_ROOT'], batch_id, engine.BATCH_INFO_FILENAME)
+    try:
+        temp_pdf_batches[batch_id] = engine.leggi_batch_info(info_path)
+    except (OSError, ValueError, KeyError):
+        temp_pdf_batches.pop(batch_id, None)
+        return None
+    magazzino.segna_accesso(os.path.dirname(info_path))
+    return temp_pdf_batches[batch_id]
+
+# --- METRICHE ---
+def _conteggio_batch():
+    conteggi = get_scheduler().conteggi() if _scheduler else {}
+    return {
+        ('in_coda',): conteggi.get(scheduler.STATO_IN_CODA, 0),
+        ('in_generazione',): conteggi.get(scheduler.STATO_IN_CORSO, 0),
+        ('in_anteprima',): len(temp_pdf_batches),
+    }
+
+def _spazio_batch():
+    # Una sola visita di BATCH_ROOT per lettura di /metrics, per entrambe le gauge
+    spazio = magazzino.spazio_per_stato(magazzino.batch(app.config['BATCH_ROOT']))
+    metrics.TEMP_DISK_USAGE_BYTES.set(sum(spazio.values()))
+    for stato, byte in spazio.items():
+        metrics.BATCH_DISK_USAGE_BYTES.set(byte, stato=stato)
+
+metrics.ACTIVE_BATCHES.set_function(_conteggio_batch)
+metrics.REGISTRY.register_collector(_spazio_batch)
 
 def cleanup_batch_data(batch_id):
-    batch_info = temp_pdf_batches.pop(batch_id, None)
-    if batch_info:
+    """Timer di pulizia: rimuove il batch se non è stato usato negli ultimi
+    CLEANUP_DELAY_SECONDS, altrimenti riprogramma il timer alla nuova scadenza."""
+    dest_dir = os.path.join(app.config['BATCH_ROOT'], batch_id)
+    # Senza get_batch: la lettura segnerebbe un accesso e la scadenza non arriverebbe mai
+    restanti = magazzino.secondi_alla_scadenza(dest_dir, CLEANUP_DELAY_SECONDS)
+    if restanti > 0:
+        programma_pulizia(batch_id, restanti)
+        return
+    temp_pdf_batches.pop(batch_id, None)
+    get_scheduler().dimentica(batch_id)
+    if magazzino.stato_batch(dest_dir) in (magazzino.STATO_CONCLUSO, magazzino.STATO_ARCHIVIATO):
         try:
-            shutil.rmtree(batch_info['temp_dir'])
-        except Exception as e:
-            print(f"Errore pulizia: {e}")
+            shutil.rmtree(dest_dir)
+        except OSError:
+            app.logger.exception("Errore nella pulizia del batch %s", batch_id)
+
+# --- AMMISSIONE ---
+def ammetti_batch(n_record):
+    """Solleva ammissione.Rifiutato se il server non può accettare ora un batch di n_record studenti."""
+    conteggi = get_scheduler().conteggi()
+    root = app.config['BATCH_ROOT']
+    # Prima si fa posto rimuovendo i batch conclusi meno usati, poi si verifica
+    for batch_id in magazzino.libera_spazio(root, n_record * app.config['DISCO_MB_PER_RECORD'],
+                                            quota_mb=app.config['QUOTA_BATCH_MB'],
+                                            min_libero_mb=app.config['MIN_DISCO_LIBERO_MB']):
+        app.logger.info("Batch %s rimosso per fare spazio", batch_id)
+        temp_pdf_batches.pop(batch_id, None)
+        get_scheduler().dimentica(batch_id)
+    ammissione.verifica(n_record, sum(conteggi.values()), root,
+                        max_batch=app.config['MAX_BATCH_IN_CODA'],
+                        min_memoria_mb=app.config['MIN_MEMORIA_LIBERA_MB'],
+                        min_disco_mb=app.config['MIN_DISCO_LIBERO_MB'],
+                        mb_per_record=app.config['DISCO_MB_PER_RECORD'],
+                        quota_mb=app.config['QUOTA_BATCH_MB'],
+                        uso_mb=sum(b['byte'] for b in magazzino.batch(root)) / 1024 / 1024
+                        if app.config['QUOTA_BATCH_MB'] else 0)
+
+def _risposta_errore(messaggio, codice):
+    # JSON per l'API e la verifica preliminare, testo per le pagine (come le altre risposte di errore)
+    if request.path.startswith('/api/') or request.endpoint == 'preflight_data':
+        return jsonify({'errore': messaggio}), codice
+    return messaggio, codice
+
+@app.errorhandler(ammissione.Rifiutato)
+def batch_rifiutato(e):
+    risposta, codice = _risposta_errore(e.messaggio, 503)
+    return risposta, codice, {'Retry-After': str(e.riprova_tra)}
+
+@app.errorhandler(codifica.ErroreCodifica)
+def codifica_non_valida(e):
+    return _risposta_errore(str(e), 400)
+
+@app.errorhandler(413)
+def richiesta_troppo_grande(e):
+    return _risposta_errore(f"File troppo grande: massimo {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB.", 413)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/', methods=['GET'])
 def homepage():
     return render_template('upload.html')
 
+def _leggi_file_dati(file):
+    # Righe decodificate a blocchi direttamente dallo stream caricato (codifica.py)
+    righe = codifica.RigheDecodificate(file.stream)
+    with metrics.PARSE_SECONDS.time():
+        students_data = engine.parse_diploma_data(righe)
+    if righe.codifica not in ('utf-8', 'utf-8-sig'):
+        app.logger.info("File dati %s letto in %s", file.filename, righe.codifica)
+    return students_data
+
+@app.route('/preflight', methods=['POST'])
+def preflight_data():
+    """Verifica preliminare del file dati (JSON), chiamata dalla pagina di upload prima dell'invio."""
+    file = request.files.get('data_file')
+    if not file or file.filename == '':
+        return jsonify({'errore': 'Nessun file selezionato'}), 400
+    students_data = _leggi_file_dati(file)
+    if not students_data:
+        return jsonify({'errore': 'File dati non valido o vuoto.'}), 400
+    report = preflight.verifica(students_data)
+    for problema in report['problemi']:
+        problema['nomi'] = [students_data[i].get('NOM_COG', '') for i in problema['righe'][:10]]
+    return jsonify(report)
+
 @app.route('/upload-data', methods=['POST'])
 def upload_data():
     # 1. Recupero la facoltà dal menu a discesa (campo obbligatorio)
@@ -103,234 +356,285 @@ def upload_data():
     if file.filename == '':
         return 'Nessun file selezionato', 400
 
-    file_content = file.stream.read().decode('utf-8')
-    students_data = parse_diploma_data(file_content)
+    students_data = _leggi_file_dati(file)
 
     if not students_data:
         return 'File dati non valido o vuoto.', 400
 
-    batch_id = str(uuid.uuid4())
-    current_batch_temp_dir = tempfile.mkdtemp()
-    generated_pdf_filenames = []
-    log_entries = []
-    nome_cartella = datetime.now().strftime('%Y-%m-%d')
-
-    # --- CICLO GENERAZIONE PDF ---
-    for i, student in enumerate(students_data):
-        student_data_for_template = {k.lower(): v for k, v in student.items()}
+    # Verifica preliminare: con errori si genera solo se l'utente conferma ('forza')
+    report = preflight.verifica(students_data)
+    if report['errori'] and not request.values.get('forza'):
+        return Response(preflight.testo_report(report, students_data), status=400, mimetype='text/plain')
+    # Ammissione solo per un batch che verrà generato: può rimuovere batch conclusi per fare spazio
+    ammetti_batch(len(students_data))
 
+    # Profilazione opzionale: checkbox 'profilo' o ?profilo=1
+    batch_id = crea_batch(students_data, facolta_selezionata, urgente=bool(request.values.get('urgente')),
+                          profilo=bool(request.values.get('profilo')))
+    return redirect(url_for('job_status_page', batch_id=batch_id))
 
-    # --- FORMATTAZIONE NOMI E LUOGHI ---
-        
-    # Gestione a capo e nomi (Logica originale)
-        student_data_for_template['corsolau'] = student_data_for_template.get('corsolau', '').replace('|', '<br>')
-        student_data_for_template['nom_cog'] = student_data_for_template.get('nom_cog', '').replace('|', '<br>')
-        
-        # --- LOGICA LUOGO DI NASCITA (Ripristinata) ---
-        luogo_nascita_completo = student_data_for_template.get('luogonas', '').strip()
-        stato_nascita = student_data_for_template.get('statnas', '').strip()
-        provincia_nascita = student_data_for_template.get('provnas', '').strip()
-        
-        if provincia_nascita:
-            luogo_nascita_completo += f" {provincia_nascita}"
-            
-        if stato_nascita:
-            luogo_nascita_completo += f" {stato_nascita}"
-        
-        # Sovrascriviamo per il template
-        student_data_for_template['luogonas'] = luogo_nascita_completo
-        # -----------------------------------------------
-
-
-
-        modulo_value = student_data_for_template.get('modulo', '').strip()
-        templates = {
-            'forml01v7': 'diploma_forml01v7.html',
-            'forml01v7tuscia': 'diploma_forml01v7tuscia.html',
-            'forml1v7': 'diploma_forml1v7.html',
-            'forml2v7': 'diploma_forml2v7.html',
-            'forml3v7': 'diploma_forml3v7.html',
-            'forml4v7': 'diploma_forml4v7.html',
-            'forml23v7': 'diploma_forml23v7.html',
-            'forml27v7': 'diploma_forml27v7.html',
-            'forml28v7': 'diploma_forml28v7.html',
-            'forml28v7A': 'diploma_forml28v7A.html',
-            'forml29v7': 'diploma_forml29v7.html',
-            'memoriastudi': 'diploma_memoriastudi.html',
-            'memorialaureamag': 'diploma_memorialaureamag.html',
-            'memorialaureatri': 'diploma_memorialaureatri.html'
-        }
-
-        template_filename = templates.get(modulo_value)
-        if not template_filename:
-            log_entries.append(f"SKIP: Modulo '{modulo_value}' non trovato per {student_data_for_template.get('nom_cog')}")
-            continue
-
-        student_data_for_template['lode'] = student_data_for_template.get('lode', '').upper().strip()
-        student_data_for_template['testo_footer_fisso'] = "Imposta di bollo assolta in modo virtuale. Autorizzazione Intendenza di Finanza di Roma n.9120/88"
-
-
-        # Gestione immagini firme/loghi
-        for k in ['firmar', 'firmap', 'firmad', 'firma4', 'firma5', 'firma6', 'logo1', 'logo2', 'logo3']:
-            val = student_data_for_template.get(k)
-            if val and not val.endswith('.png'):
-                student_data_for_template[k] = f"{val}.png"
+def crea_batch(students_data, facolta, urgente=False, profilo=False):
+    """Cartella, manifest e coda di un nuovo batch (form di upload e API); restituisce l'id."""
+    batch_id = str(uuid.uuid4())
+    current_batch_temp_dir = os.path.join(app.config['BATCH_ROOT'], batch_id)
+    os.makedirs(current_batch_temp_dir)
+    # Lock prima del manifest: un altro worker che si avvia non lo scambia per interrotto
+    rivendicazione = engine.rivendica_batch(current_batch_temp_dir)
+    nome_cartella = datetime.now().strftime('%Y-%m-%d')
 
-        try:
-            # Generazione Diploma
-            rendered_html = render_template(template_filename, **student_data_for_template)
-            pdf_bytes = HTML(string=rendered_html, base_url=request.url_root).write_pdf()
-            clean_name = student_data_for_template.get('nom_cog', 'studente').replace(' ', '_').replace('<br>', '_')
-            pdf_name = f'diploma_{clean_name}_{modulo_value}.pdf'
-            
-            with open(os.path.join(current_batch_temp_dir, pdf_name), 'wb') as f:
-                f.write(pdf_bytes)
-            generated_pdf_filenames.append(pdf_name)
-
-            # Generazione Camicia
-            camicia_data = {
-                'corso_laurea': student_data_for_template.get('corsolau', ''),
-                'nome_studente': student_data_for_template.get('nom_cog', ''),
-                'luogo_nascita': luogo_nascita_completo,
-                'provincia_nascita': provincia_nascita,
-                'data_nascita': student_data_for_template.get('datanas', ''),
-                'numero_protocollo': student_data_for_template.get('protocol', ''),
-                'numero_diploma': student_data_for_template.get('npergamena', ''),
-                'genere_nato_nata': student_data_for_template.get('sesso', 'nato/a').strip(),
-                'firmad': student_data_for_template.get('firmad', ''),
-                'firmar': student_data_for_template.get('firmar', ''),
-                'firmap': student_data_for_template.get('firmap', '')
-            }
-            c_html = render_template('camicia_template.html', **camicia_data)
-            c_pdf_bytes = HTML(string=c_html, base_url=request.url_root).write_pdf()
-            c_pdf_name = f'camicia_{clean_name}.pdf'
-            
-            with open(os.path.join(current_batch_temp_dir, c_pdf_name), 'wb') as f:
-                f.write(c_pdf_bytes)
-            generated_pdf_filenames.append(c_pdf_name)
-            
-            log_entries.append(f"OK: {student_data_for_template.get('nom_cog')}")
-        except Exception as e:
-            log_entries.append(f"ERRORE {student_data_for_template.get('nom_cog')}: {e}")
-
-    # --- OPERAZIONI POST-GENERAZIONE ---
-    # Merge Diplomi
-    diploma_files = [f for f in generated_pdf_filenames if f.startswith('diploma_')]
-    if diploma_files:
-        merger = PdfWriter()
-        comb_name = f'tutti_i_diplomi_{nome_cartella}.pdf'
-        for f in diploma_files:
-            merger.append(os.path.join(current_batch_temp_dir, f))
-        merger.write(os.path.join(current_batch_temp_dir, comb_name))
-        merger.close()
-        generated_pdf_filenames.append(comb_name)
-        
-    camicia_files = [f for f in generated_pdf_filenames if f.startswith('camicia_')]
-    if camicia_files:
-        merger_c = PdfWriter()
-        comb_c_name = f'tutte_le_camicie_{nome_cartella}.pdf'
-        for f in camicia_files:
-            merger_c.append(os.path.join(current_batch_temp_dir, f))
-        merger_c.write(os.path.join(current_batch_temp_dir, comb_c_name))
-        merger_c.close()
-        generated_pdf_filenames.append(comb_c_name)
-
-    # Definizione log_content (FIX UnboundLocalError)
-    log_content = '\n'.join(log_entries)
-    log_file_path = os.path.join(current_batch_temp_dir, 'log_creazione_diplomi.txt')
-    with open(log_file_path, 'w', encoding='utf-8') as f:
-        f.write(log_content)
-
-    # Preparazione Metadati per Archivio
-    primo_studente = students_data[0] if students_data else {}
-    
-    # 1. Protocollo pulito (es. 16828/1 -> 16828)
-    prot_raw = primo_studente.get('PROTOCOL', '').strip()
-    protocollo_clean = prot_raw.split('/')[0] if '/' in prot_raw else prot_raw
-    
-    # 2. Tipologia (LM- in CLASSE -> LaureaMagistrale)
-    classe_val = primo_studente.get('CLASSE', '')
-    tipologia = "LaureaMagistrale" if "LM-" in classe_val else "LaureaTriennale"
-    
-    # 3. Anno Laurea
-    anno_lau = primo_studente.get('DATALAUR', datetime.now().strftime('%Y')).strip().replace('/', '-')
-
-    # Salvataggio Batch
-    temp_pdf_batches[batch_id] = {
-        'temp_dir': current_batch_temp_dir,
-        'filenames': generated_pdf_filenames,
-        'log_content': log_content,
-        'log_file_path': log_file_path,
-        'original_folder_name': nome_cartella,
-        'archived': False,
-        'metadata': {
-            'protocollo': protocollo_clean,
-            'tipologia': tipologia,
-            'facolta': facolta_selezionata.replace(' ', '_'),
-            'anno_laurea': anno_lau,
-            'nomi_persone': [s.get('NOM_COG', 'N/A') for s in students_data],
-            'totale': len(students_data),
-            'student_list': students_data
-        }
-    }
-    
-    threading.Timer(CLEANUP_DELAY_SECONDS, cleanup_batch_data, args=[batch_id]).start()
-    return redirect(url_for('preview_pdfs', batch_id=batch_id))
+    # Manifest prima del render: se il processo muore, il batch riparte da dove era arrivato
+    engine.scrivi_manifest(current_batch_temp_dir, students_data, nome_cartella,
+                           facolta=facolta, urgente=urgente, profilo=profilo)
+    # Il render avviene negli slot dello scheduler; la pagina del job mostra la posizione in coda.
+    accoda_batch(batch_id, current_batch_temp_dir, students_data, facolta, nome_cartella,
+                 urgente=urgente, profilo=profilo, rivendicazione=rivendicazione)
+    return batch_id
+
+def stato_job(batch_id):
+    """Stato del batch in generazione, None se non è in generazione (concluso, scaduto o inesistente).
+
+    Il job sta nello scheduler del worker che ha ricevuto l'upload: gli altri worker
+    ricavano l'avanzamento dal manifest nella cartella del batch.
+    """
+    stato = get_scheduler().stato(batch_id)
+    if stato is not None:
+        return stato
+    try:
+        uuid.UUID(batch_id)
+    except ValueError:
+        return None
+    dest_dir = os.path.join(app.config['BATCH_ROOT'], batch_id)
+    if os.path.exists(os.path.join(dest_dir, engine.BATCH_INFO_FILENAME)):
+        return None
+    letto = engine.avanzamento_manifest(dest_dir)
+    if letto is None:
+        return None
+    parametri, totale, completati = letto
+    classe = scheduler.classe_batch(parametri.get('urgente', False), totale, app.config['BATCH_PICCOLO_MAX_RECORD'])
+    # La posizione in coda è nota solo al worker del job: qui il batch risulta in corso
+    return {'stato': scheduler.STATO_IN_CORSO, 'messaggio': '', 'posizione': 0, 'completati': completati,
+            'totale': totale, 'priorita': scheduler.NOMI_CLASSE[classe], 'facolta': parametri.get('facolta', '')}
+
+@app.route('/job/<batch_id>')
+def job_status_page(batch_id):
+    stato = stato_job(batch_id)
+    if stato is None or stato['stato'] == scheduler.STATO_COMPLETATO:
+        if get_batch(batch_id):
+            return redirect(url_for('preview_pdfs', batch_id=batch_id))
+        return "Batch non trovato o scaduto.", 404
+    return render_template('job.html', stato=stato,
+                           stato_url=url_for('job_status', batch_id=batch_id),
+                           preview_url=url_for('preview_pdfs', batch_id=batch_id))
+
+@app.route('/job/<batch_id>/stato')
+def job_status(batch_id):
+    stato = stato_job(batch_id)
+    if stato is None:
+        if get_batch(batch_id):
+            return jsonify({'stato': scheduler.STATO_COMPLETATO})
+        return jsonify({'stato': 'non_trovato'}), 404
+    return jsonify(stato)
 
 @app.route('/archive/<batch_id>', methods=['POST'])
 def archive_batch(batch_id):
-    batch_info = temp_pdf_batches.get(batch_id)
+    batch_info = get_batch(batch_id)
     if not batch_info or batch_info.get('archived'):
         return "Batch non trovato o già archiviato.", 404
 
-    meta = batch_info['metadata']
-    now = datetime.now()
-    timestamp = now.strftime('%d%m%Y_%H%M')
-    
-    # Nome cartella e ZIP
-    folder_name = f"{meta['tipologia']}_{meta['totale']}_{meta['facolta']}_{meta['anno_laurea']}_{timestamp}"
-    zip_name = f"{folder_name}.zip"
-    temp_zip_path = os.path.join(batch_info['temp_dir'], zip_name)
-
     try:
-        # Crea ZIP
-        with zipfile.ZipFile(temp_zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for f in batch_info['filenames']:
-                if f.startswith('diploma_'):
-                    zf.write(os.path.join(batch_info['temp_dir'], f), arcname=os.path.join(folder_name, f))
-            # Aggiunge log nominativi
-            log_arc_path = os.path.join(batch_info['temp_dir'], "log_archivio.txt")
-            with open(log_arc_path, 'w', encoding='utf-8') as la:
-                la.write(f"REGISTRO {meta['tipologia']} - {now}\n" + "\n".join(meta['nomi_persone']))
-            zf.write(log_arc_path, arcname=os.path.join(folder_name, "lista_nomi.txt"))
-
-        # Copia nei server
-        shutil.copy2(temp_zip_path, os.path.join(PATH_ARCHIVIO_1, zip_name))
-        shutil.copy2(temp_zip_path, os.path.join(PATH_ARCHIVIO_2, zip_name))
-
-        # Excel
-        excel_path = os.path.join(PATH_EXCEL_REGISTRO, f"Pergamene_{now.year}.xlsx")
-        new_row = [meta['protocollo'], meta['tipologia'], meta['totale'], meta['facolta'], meta['anno_laurea'], now.strftime('%d/%m/%Y %H:%M')]
-        
-        if not os.path.exists(excel_path):
-            wb = Workbook()
-            ws = wb.active
-            ws.append(["Protocollo", "Tipologia", "Totale PDF", "Facoltà", "Anno Laurea", "Data Stampa"])
-        else:
-            wb = load_workbook(excel_path)
-            ws = wb.active
-        
-        ws.append(new_row)
-        wb.save(excel_path)
-        
-        batch_info['archived'] = True
-        return f"Archiviazione completata. Protocollo: {meta['protocollo']}", 200
+        archivia(batch_id, batch_info)
+        return f"Archiviazione completata. Protocollo: {batch_info['metadata']['protocollo']}", 200
     except Exception as e:
         return f"Errore archivio: {str(e)}", 500
 
+def archivia(batch_id, batch_info):
+    destinazioni, depositi = archivi()
+    archive.archivia_batch(batch_info, destinazioni, PATH_EXCEL_REGISTRO,
+                           path_catalogo=PATH_CATALOGO, depositi=depositi)
+    batch_info['archived'] = True
+    salva_batch(batch_id, batch_info)
+
+# --- RICERCA NELL'ARCHIVIO ---
+def _cerca_in_archivio():
+    q = request.args.get('q', '').strip()
+    limite = min(request.args.get('limite', 50, type=int), 500)
+    t0 = time.perf_counter()
+    risultati = catalogo.cerca(PATH_CATALOGO, q, limite) if q else []
+    return q, risultati, (time.perf_counter() - t0) * 1000
+
+@app.route('/archivio')
+def archivio_page():
+    q, risultati, durata_ms = _cerca_in_archivio()
+    return render_template('archivio.html', q=q, risultati=risultati, durata_ms=durata_ms)
+
+@app.route('/api/archivio')
+def archivio_api():
+    """Ricerca JSON: /api/archivio?q=rossi 16828&limite=50."""
+    q, risultati, durata_ms = _cerca_in_archivio()
+    for r in risultati:
+        r['url'] = url_for('archivio_pdf', doc_id=r['id'])
+    return jsonify({'q': q, 'risultati': risultati, 'durata_ms': durata_ms})
+
+@app.route('/archivio/pdf/<int:doc_id>')
+def archivio_pdf(doc_id):
+    voce = catalogo.documento(PATH_CATALOGO, doc_id)
+    if not voce:
+        return "Documento non presente nel catalogo.", 404
+    try:
+        contenuto = catalogo.leggi_pdf(voce, (PATH_ARCHIVIO_1, PATH_ARCHIVIO_2))
+    except (OSError, KeyError):
+        return f"ZIP {voce['zip_name']} non trovato negli archivi.", 404
+    return send_file(io.BytesIO(contenuto), mimetype='application/pdf',
+                     download_name=os.path.basename(voce['membro']))
+
+@app.route('/archivio/zip/<zip_name>')
+def archivio_zip(zip_name):
+    """ZIP archiviato: dalla cartella di ZIP, oppure ricostruito dal deposito."""
+    zip_name = os.path.basename(zip_name)
+    for cartella in (PATH_ARCHIVIO_1, PATH_ARCHIVIO_2):
+        zip_path = os.path.join(cartella, zip_name)
+        if os.path.exists(zip_path):
+            return send_file(zip_path, mimetype='application/zip', as_attachment=True, download_name=zip_name)
+    nome_batch = os.path.splitext(zip_name)[0]
+    for cartella in archivi()[1]:
+        if deposito.leggi_manifest(cartella, nome_batch) is not None:
+            buffer = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
+            deposito.esporta_zip(cartella, nome_batch, buffer)
+            buffer.seek(0)
+            return send_file(buffer, mimetype='application/zip', as_attachment=True, download_name=zip_name)
+    return "ZIP non trovato negli archivi.", 404
+
+# Una correzione alla volta: riscrive i PDF cumulativi e batch.json
+_correzioni_lock = threading.Lock()
+
+def _in_lavorazione(batch_id):
+    stato = get_scheduler().stato(batch_id)
+    return stato is not None and stato['stato'] in (scheduler.STATO_IN_CODA, scheduler.STATO_IN_CORSO)
+
+@app.route('/correggi/<batch_id>', methods=['POST'])
+def correggi_record(batch_id):
+    """Rigenera un solo studente con i campi corretti.
+
+    Corpo JSON {"matri": ..., "campi": {"LUOGONAS": ...}} oppure {"indice": ..., "campi": ...},
+    o i campi del form 'matri'/'indice', 'campo' e 'valore'.
+    """
+    dati = request.get_json(silent=True) or {}
+    if not dati:
+        dati = {'matri': request.form.get('matri'), 'indice': request.form.get('indice'),
+                'campi': {request.form.get('campo', ''): request.form.get('valore', '')}}
+    campi = {k: v for k, v in (dati.get('campi') or {}).items() if k}
+    if not campi:
+        return "Nessun campo da correggere.", 400
+
+    with _correzioni_lock:
+        batch_info = get_batch(batch_id)
+        if not batch_info:
+            return "Batch non trovato.", 404
+        if batch_info.get('archived'):
+            return "Batch già archiviato: la correzione richiede un nuovo caricamento.", 409
+        if _in_lavorazione(batch_id):
+            return "Batch in lavorazione: riprovare al termine.", 409
+        try:
+            indice = engine.trova_record(batch_info['metadata']['student_list'],
+                                         matri=dati.get('matri'), indice=dati.get('indice'))
+            studente = engine.record_corretto(batch_info, indice, campi)
+        except ValueError as e:
+            return f"Correzione non eseguita: {e}", 400
+        # Il render passa dagli slot dello scheduler come ogni altro record: nei processi
+        # di render valgono i limiti di tempo e memoria (nel thread della richiesta no)
+        risultato = Future()
+        src_dir = tempfile.mkdtemp(prefix=magazzino.PREFISSO_CORREZIONE, dir=batch_info['temp_dir'])
+        # Job con una chiave propria: lo stato del batch (/job, /api/batch) non cambia e
+        # correzioni successive non trovano il batch "in lavorazione"
+        chiave = f"{batch_id}/correzione/{os.path.basename(src_dir)}"
+
+        def concludi(esiti):
+            try:
+                with _correzioni_lock:
+                    info = get_batch(batch_id)
+                    esito = engine.integra_correzione(info, indice, studente, campi, esiti[indice], src_dir)
+                    salva_batch(batch_id, info)
+                risultato.set_result(esito)
+            except Exception as e:
+                # Il batch resta com'era: l'errore è della correzione, non del job
+                risultato.set_exception(e)
+            finally:
+                shutil.rmtree(src_dir, ignore_errors=True)
+                get_scheduler().dimentica(chiave)
+
+        # students_data: solo il record corretto, all'indice che il job genera
+        get_scheduler().submit(scheduler.Job(chiave, batch_info['metadata']['facolta'], {indice: studente},
+                                             src_dir, batch_info['original_folder_name'], lambda _: None,
+                                             urgente=True, indici=[indice], concludi=concludi,
+                                             budget=budget_record()))
+    try:
+        esito = risultato.result(timeout=_attesa_correzione())
+    except FuturesTimeout:
+        return "Correzione in coda: l'anteprima si aggiornerà al termine del render.", 202
+    except ValueError as e:
+        return f"Correzione non eseguita: {e}", 400
+    except Exception as e:
+        return f"Errore correzione: {str(e)}", 500
+    return f"Record corretto: {esito['nome']}", 200
+
+def _attesa_correzione():
+    # Un posto libero negli slot (i record in corso finiscono entro il loro budget)
+    # più il render del record corretto con i suoi ritentativi
+    secondi = app.config['RECORD_TIMEOUT_SECONDS'] or 600
+    return secondi * (engine.MAX_TENTATIVI_RECORD + 1)
+
+@app.route('/ritenta/<batch_id>', methods=['POST'])
+def ritenta_errori(batch_id):
+    """Rimette in coda solo i record in ERRORE o TIMEOUT, opzionalmente con un template
+    di ripiego ('modulo_alternativo') e un budget più largo ('budget_fattore', es. 2 o 5).
+
+    I nuovi PDF vengono scritti in una sottocartella e integrati nei cumulativi
+    (engine.concludi_ritentativo) senza rigenerare gli altri record.
+    """
+    batch_info = get_batch(batch_id)
+    if not batch_info:
+        return "Batch non trovato.", 404
+    if batch_info.get('archived'):
+        return "Batch già archiviato.", 409
+    if _in_lavorazione(batch_id):
+        return "Batch già in lavorazione.", 409
+    indici = [e['indice'] for e in batch_info.get('errori', [])]
+    if not indici:
+        return "Nessun record in errore da ritentare.", 400
+
+    modulo_alternativo = request.form.get('modulo_alternativo') or None
+    template = None
+    if modulo_alternativo:
+        template = engine.TEMPLATE_REGISTRY.get(modulo_alternativo)
+        if not template:
+            return f"Modulo '{modulo_alternativo}' non presente nel registro.", 400
+
+    try:
+        budget_fattore = max(1, int(request.form.get('budget_fattore') or 1))
+    except ValueError:
+        return "Fattore di budget non valido.", 400
+
+    src_dir = tempfile.mkdtemp(prefix=magazzino.PREFISSO_RITENTATIVO, dir=batch_info['temp_dir'])
+
+    def concludi(esiti):
+        try:
+            with _correzioni_lock:
+                info = get_batch(batch_id)
+                return engine.concludi_ritentativo(info, esiti, src_dir)
+        finally:
+            shutil.rmtree(src_dir, ignore_errors=True)
+
+    get_scheduler().submit(scheduler.Job(batch_id, batch_info['metadata']['facolta'],
+                                         batch_info['metadata']['student_list'], src_dir,
+                                         batch_info['original_folder_name'],
+                                         lambda info: salva_batch(batch_id, info),
+                                         indici=indici, template=template, concludi=concludi,
+                                         budget=budget_record(budget_fattore)))
+    return redirect(url_for('job_status_page', batch_id=batch_id))
+
 @app.route('/preview/<batch_id>')
 def preview_pdfs(batch_id):
-    batch_info = temp_pdf_batches.get(batch_id)
+    batch_info = get_batch(batch_id)
     if not batch_info:
         return "Anteprima non trovata o scaduta.", 404
 
@@ -348,11 +652,16 @@ def preview_pdfs(batch_id):
                             pdf_list=pdf_list_for_template,
                             download_url=url_for('download_zip_for_preview', batch_id=batch_id),
                             log_url=url_for('get_log_for_preview', batch_id=batch_id),
+                            studenti=batch_info['metadata']['student_list'],
+                            archiviato=batch_info.get('archived', False),
+                            errori=batch_info.get('errori', []),
+                            moduli=sorted(engine.TEMPLATE_REGISTRY),
+                            stampa_max_pagine=app.config['STAMPA_PARTE_MAX_PAGINE'],
                             cleanup_delay_minutes=CLEANUP_DELAY_SECONDS / 60)
 
 @app.route('/preview/pdf/<batch_id>/<filename>')
 def get_single_pdf(batch_id, filename):
-    batch_info = temp_pdf_batches.get(batch_id)
+    batch_info = get_batch(batch_id)
     if not batch_info:
         return "File non trovato.", 404
     
@@ -363,7 +672,7 @@ def get_single_pdf(batch_id, filename):
 
 @app.route('/preview/log/<batch_id>')
 def get_log_for_preview(batch_id):
-    batch_info = temp_pdf_batches.get(batch_id)
+    batch_info = get_batch(batch_id)
     if not batch_info:
         return "Log non trovato o scaduto.", 404
     
@@ -375,12 +684,12 @@ def get_log_for_preview(batch_id):
 
 @app.route('/download_zip/<batch_id>')
 def download_zip_for_preview(batch_id):
-    batch_info = temp_pdf_batches.get(batch_id)
+    batch_info = get_batch(batch_id)
     if not batch_info:
         return "Download non trovato o scaduto.", 404
 
     zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'a', zipfile.ZIP_DEFLATED, False) as zf:
+    with metrics.ZIP_SECONDS.time(tipo='download'), zipfile.ZipFile(zip_buffer, 'a', zipfile.ZIP_DEFLATED, False) as zf:
         for filename in batch_info['filenames']:
             file_path = os.path.join(batch_info['temp_dir'], filename)
             
@@ -388,7 +697,7 @@ def download_zip_for_preview(batch_id):
                 subfolder = 'pergamene'
             elif filename.startswith('camicia_'):
                 subfolder = 'camicie'
-            elif filename.startswith('tutti_i_diplomi_'):
+            elif filename.startswith(('tutti_i_diplomi_', 'diplomi_e_camicie_')):
                 subfolder = 'combinato'
             else:
                 subfolder = 'altri' 
@@ -408,50 +717,168 @@ def download_zip_for_preview(batch_id):
         download_name=f'documenti_{batch_info["original_folder_name"]}.zip'
     )
 
-def parse_diploma_data(file_content):
-    lines = file_content.splitlines()
-    if len(lines) < 5: return []
-    header_line = lines[3]
-    data_lines = lines[4:]
-    reader = csv.reader(io.StringIO(header_line + '\n' + '\n'.join(data_lines)), delimiter='^')
-    try:
-        headers = next(reader)
-        return [{headers[i].strip(): row[i].strip() for i in range(len(headers))} for row in reader if len(row) == len(headers)]
-    except: return []
-
 @app.route('/print-files/<batch_id>', methods=['POST'])
 def print_batch(batch_id):
-    batch_info = temp_pdf_batches.get(batch_id)
+    batch_info = get_batch(batch_id)
     if not batch_info:
         return "Batch non trovato.", 404
 
     try:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        folder_name = f"Stampa_{batch_info['metadata']['facolta']}_{timestamp}"
-        dest_path = os.path.join(PATH_STAMPA, folder_name)
-        os.makedirs(dest_path, exist_ok=True)
-
-        # Copia solo i file cumulativi (quelli che iniziano con 'tutti_' o 'tutte_')
-        for filename in batch_info['filenames']:
-            if filename.startswith('tutti_i_diplomi_') or filename.startswith('tutte_le_camicie_'):
-                src = os.path.join(batch_info['temp_dir'], filename)
-                shutil.copy2(src, os.path.join(dest_path, filename))
-
-        # Generazione del file Elenco.txt (rimane uguale)
-        elenco_path = os.path.join(dest_path, "Elenco.txt")
-        with open(elenco_path, 'w', encoding='utf-8') as f:
-            f.write(f"ELENCO STAMPA - {batch_info['metadata']['facolta']} - {timestamp}\n")
-            f.write("-" * 80 + "\n")
-            for s in batch_info['metadata']['student_list']:
-                matricola = s.get('MATRI', 'N/D')
-                nome = s.get('NOM_COG', 'N/D').replace('|', ' ')
-                protocollo = s.get('PROTOCOL', 'N/D')
-                corso = s.get('CORSOLAU', 'N/D').replace('|', ' ')
-                f.write(f"MATR: {matricola} | NOM: {nome} | PROT: {protocollo} | CORSO: {corso}\n")
+        spool = _limiti_spool(request.values)
+    except ValueError:
+        return "Limiti di stampa non validi.", 400
 
+    try:
+        folder_name = stampa.prepara_stampa(batch_info, PATH_STAMPA, spool=spool)
+        if spool:
+            return f"Cartella creata con file divisi in parti, spool.json ed elenco: {folder_name}", 200
         return f"Cartella creata con file unici ed elenco: {folder_name}", 200
     except Exception as e:
         return f"Errore stampa: {str(e)}", 500
 
+def _limiti_spool(valori):
+    # Limiti dello spool dalla richiesta (campo 'Pagine per parte'), altrimenti dalla configurazione
+    return stampa.limiti_spool(valori.get('max_pagine', app.config['STAMPA_PARTE_MAX_PAGINE']),
+                               valori.get('max_mb', app.config['STAMPA_PARTE_MAX_MB']))
+
+# --- API JSON ---
+# Per altri sistemi d'ateneo: stesse operazioni delle pagine web, risposte JSON.
+#   POST /api/batch                       nuovo batch: multipart (data_file, facolta) o JSON {facolta, studenti}
+#   GET  /api/batch/<id>                  stato, avanzamento, errori
+#   GET  /api/batch/<id>/files            PDF e log del batch
+#   GET  /api/batch/<id>/files/<nome>     un file
+#   POST /api/batch/<id>/archivia         come il pulsante Archivia
+#   POST /api/batch/<id>/stampa           come il pulsante Stampa (max_pagine, max_mb)
+#   GET  /api/spazio                      spazio occupato dalle cartelle dei batch
+# Errori: {"errore": "..."} con il codice HTTP.
+def _errore_api(messaggio, codice, **altro):
+    return jsonify({'errore': messaggio, **altro}), codice
+
+def _vero(valore):
+    return valore is True or str(valore).lower() in ('1', 'true', 'si', 'sì', 'on')
+
+def _dati_nuovo_batch():
+    """(studenti, facolta, opzioni) dal form multipart o dal corpo JSON; ValueError se mancano."""
+    dati = request.get_json(silent=True)
+    if dati is None:
+        file = request.files.get('data_file')
+        if not file or file.filename == '':
+            raise ValueError("Serve il file dati (data_file) o un corpo JSON con 'studenti'")
+        facolta = request.form.get('facolta') or request.form.get('facolta_selezionata', '')
+        return _leggi_file_dati(file), facolta, request.form
+    studenti = dati.get('studenti') if isinstance(dati, dict) else None
+    if not isinstance(studenti, list) or not all(isinstance(s, dict) for s in studenti):
+        raise ValueError("'studenti' deve essere una lista di oggetti campo -> valore")
+    return tabella.TabellaStudenti.da_record(studenti), str(dati.get('facolta', '')), dati
+
+def _url_batch(batch_id):
+    return {'stato': url_for('api_batch', batch_id=batch_id),
+            'files': url_for('api_batch_files', batch_id=batch_id),
+            'anteprima': url_for('preview_pdfs', batch_id=batch_id)}
+
+@app.route('/api/batch', methods=['POST'])
+def api_crea_batch():
+    try:
+        students_data, facolta, opzioni = _dati_nuovo_batch()
+    except ValueError as e:
+        return _errore_api(str(e), 400)
+    facolta = facolta.upper()
+    if facolta not in engine.FACOLTA:
+        return _errore_api(f"Facoltà '{facolta}' non valida", 400, facolta_valide=list(engine.FACOLTA))
+    if not students_data:
+        return _errore_api('Nessuno studente nei dati.', 400)
+
+    report = preflight.verifica(students_data)
+    if report['errori'] and not _vero(opzioni.get('forza')):
+        return _errore_api('Verifica preliminare non superata (forza=true per generare comunque)', 422,
+                           preflight=report)
+    ammetti_batch(len(students_data))
+    batch_id = crea_batch(students_data, facolta, urgente=_vero(opzioni.get('urgente')),
+                          profilo=_vero(opzioni.get('profilo')))
+    risposta = jsonify({'id': batch_id, 'record': len(students_data), 'avvisi': report['avvisi'],
+                        'url': _url_batch(batch_id)})
+    return risposta, 202, {'Location': url_for('api_batch', batch_id=batch_id)}
+
+@app.route('/api/batch/<batch_id>')
+def api_batch(batch_id):
+    stato = stato_job(batch_id)
+    batch_info = None
+    if stato is None or stato['stato'] == scheduler.STATO_COMPLETATO:
+        batch_info = get_batch(batch_id)
+        if not batch_info:
+            return _errore_api('Batch non trovato o scaduto.', 404)
+    risposta = {'id': batch_id, **(stato or {'stato': scheduler.STATO_COMPLETATO}), 'url': _url_batch(batch_id)}
+    if batch_info:
+        meta = batch_info['metadata']
+        risposta.update({'stato': scheduler.STATO_COMPLETATO, 'facolta': meta['facolta'],
+                         'totale': meta['totale'], 'protocollo': meta['protocollo'],
+                         'archiviato': batch_info.get('archived', False), 'errori': batch_info.get('errori', [])})
+    return jsonify(risposta)
+
+@app.route('/api/batch/<batch_id>/files')
+def api_batch_files(batch_id):
+    batch_info = get_batch(batch_id)
+    if not batch_info:
+        return _errore_api('Batch non trovato, in lavorazione o scaduto.', 404)
+    files = []
+    for filename in batch_info['filenames']:
+        path = os.path.join(batch_info['temp_dir'], filename)
+        files.append({'nome': filename, 'byte': os.path.getsize(path),
+                      'url': url_for('api_batch_file', batch_id=batch_id, filename=filename)})
+    return jsonify({'id': batch_id, 'files': files,
+                    'log': url_for('get_log_for_preview', batch_id=batch_id),
+                    'zip': url_for('download_zip_for_preview', batch_id=batch_id)})
+
+@app.route('/api/batch/<batch_id>/files/<filename>')
+def api_batch_file(batch_id, filename):
+    batch_info = get_batch(batch_id)
+    if not batch_info:
+        return _errore_api('Batch non trovato o scaduto.', 404)
+    if filename not in batch_info['filenames']:
+        return _errore_api('File non presente nel batch.', 404)
+    mimetype = 'application/pdf' if filename.endswith('.pdf') else None
+    return send_file(os.path.join(batch_info['temp_dir'], filename), mimetype=mimetype)
+
+@app.route('/api/spazio')
+def api_spazio():
+    """Spazio delle cartelle dei batch: totale, quota e singoli batch (più recenti prima)."""
+    root = app.config['BATCH_ROOT']
+    elenco = sorted(magazzino.batch(root), key=lambda b: b['accesso'], reverse=True)
+    return jsonify({'root': root, 'quota_mb': app.config['QUOTA_BATCH_MB'],
+                    'libero_mb': ammissione.disco_libero_mb(root),
+                    'totale_byte': sum(b['byte'] for b in elenco),
+                    'batch': [{'id': b['id'], 'stato': b['stato'], 'byte': b['byte'],
+                               'ultimo_accesso': datetime.fromtimestamp(b['accesso']).isoformat(timespec='seconds')}
+                              for b in elenco]})
+
+@app.route('/api/batch/<batch_id>/archivia', methods=['POST'])
+def api_archivia(batch_id):
+    batch_info = get_batch(batch_id)
+    if not batch_info:
+        return _errore_api('Batch non trovato o scaduto.', 404)
+    if batch_info.get('archived'):
+        return _errore_api('Batch già archiviato.', 409)
+    try:
+        archivia(batch_id, batch_info)
+    except Exception as e:
+        return _errore_api(f"Errore archivio: {e}", 500)
+    return jsonify({'id': batch_id, 'archiviato': True, 'protocollo': batch_info['metadata']['protocollo']})
+
+@app.route('/api/batch/<batch_id>/stampa', methods=['POST'])
+def api_stampa(batch_id):
+    batch_info = get_batch(batch_id)
+    if not batch_info:
+        return _errore_api('Batch non trovato o scaduto.', 404)
+    try:
+        spool = _limiti_spool(request.get_json(silent=True) or request.values)
+    except ValueError:
+        return _errore_api('Limiti di stampa non validi.', 400)
+    try:
+        folder_name = stampa.prepara_stampa(batch_info, PATH_STAMPA, spool=spool)
+    except Exception as e:
+        return _errore_api(f"Errore stampa: {e}", 500)
+    return jsonify({'id': batch_id, 'cartella': folder_name, 'parti': bool(spool)})
+
+# Server di sviluppo; debug (e auto-reload dei template) con FLASK_DEBUG=1
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run()
\ No newline at end of file
@@ -0,0 +1,90 @@
+# --- ARCHIVIAZIONE ---
+# ZIP dei diplomi, copia negli archivi, registro Excel e catalogo di ricerca.
+# Un archivio può essere un deposito a contenuto indirizzato (deposito.py) invece
+# di una cartella di ZIP: riceve solo i PDF che non ha già.
+# openpyxl viene importato solo quando si aggiorna il registro.
+import os
+import zipfile
+from datetime import datetime
+
+import catalogo
+import deposito
+import metrics
+import pubblica
+
+REGISTRO_HEADER = ["Protocollo", "Tipologia", "Totale PDF", "Facoltà", "Anno Laurea", "Data Stampa"]
+
+def membri_archivio(temp_dir, filenames, folder_name, intestazione, nomi_persone):
+    """[(nome nello ZIP, path)]: i diplomi e la lista dei nominativi."""
+    membri = [(f"{folder_name}/{f}", os.path.join(temp_dir, f)) for f in filenames if f.startswith('diploma_')]
+    # Aggiunge log nominativi
+    log_arc_path = os.path.join(temp_dir, "log_archivio.txt")
+    with open(log_arc_path, 'w', encoding='utf-8') as la:
+        la.write(intestazione + "\n" + "\n".join(nomi_persone))
+    membri.append((f"{folder_name}/lista_nomi.txt", log_arc_path))
+    return membri
+
+def crea_zip_archivio(membri, zip_path):
+    with metrics.ZIP_SECONDS.time(tipo='archivio'), zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for arcname, path in membri:
+            zf.write(path, arcname=arcname)
+
+def copia_negli_archivi(zip_path, destinazioni):
+    # Reflink o copia, mai hard link: la copia d'archivio non deve condividere
+    # l'inode con lo ZIP del batch, che viene rimosso o sovrascritto con il batch
+    zip_name = os.path.basename(zip_path)
+    for path_archivio in destinazioni:
+        with metrics.ARCHIVE_COPY_SECONDS.time(destinazione=os.path.basename(path_archivio)):
+            pubblica.pubblica(zip_path, os.path.join(path_archivio, zip_name), hardlink=False)
+
+def aggiorna_registro_excel(excel_path, new_row):
+    from openpyxl import Workbook, load_workbook
+    with metrics.EXCEL_APPEND_SECONDS.time():
+        if not os.path.exists(excel_path):
+            wb = Workbook()
+            ws = wb.active
+            ws.append(REGISTRO_HEADER)
+        else:
+            wb = load_workbook(excel_path)
+            ws = wb.active
+        
+        ws.append(new_row)
+        wb.save(excel_path)
+
+def archivia_batch(batch_info, destinazioni, excel_dir, now=None, path_catalogo=None, depositi=()):
+    """ZIP dei diplomi, copia negli archivi e riga nel registro Excel dell'anno.
+
+    depositi sono archivi a contenuto indirizzato: ricevono i file del batch al
+    posto dello ZIP. Con path_catalogo i diplomi vengono aggiunti al catalogo di ricerca.
+
+    Restituisce il nome dello ZIP; le eccezioni vengono propagate al chiamante.
+    """
+    meta = batch_info['metadata']
+    now = now or datetime.now()
+    timestamp = now.strftime('%d%m%Y_%H%M')
+
+    # Nome cartella e ZIP
+    folder_name = f"{meta['tipologia']}_{meta['totale']}_{meta['facolta']}_{meta['anno_laurea']}_{timestamp}"
+    zip_name = f"{folder_name}.zip"
+    temp_zip_path = os.path.join(batch_info['temp_dir'], zip_name)
+
+    membri = membri_archivio(batch_info['temp_dir'], batch_info['filenames'], folder_name,
+                             f"REGISTRO {meta['tipologia']} - {now}", meta['student_list'].colonna('NOM_COG', 'N/A'))
+
+    # Crea ZIP e copia nei server
+    if destinazioni:
+        crea_zip_archivio(membri, temp_zip_path)
+        copia_negli_archivi(temp_zip_path, destinazioni)
+
+    # Depositi: solo i PDF nuovi più il manifest del batch
+    for root in depositi:
+        deposito.deposita_batch(root, folder_name, membri, now)
+
+    # Excel
+    excel_path = os.path.join(excel_dir, f"Pergamene_{now.year}.xlsx")
+    new_row = [meta['protocollo'], meta['tipologia'], meta['totale'], meta['facolta'], meta['anno_laurea'], now.strftime('%d/%m/%Y %H:%M')]
+    aggiorna_registro_excel(excel_path, new_row)
+
+    if path_catalogo:
+        catalogo.registra_batch(path_catalogo, batch_info, zip_name, folder_name, now)
+    return zip_name
@@ -0,0 +1,143 @@
+# --- CATALOGO DELL'ARCHIVIO ---
+# Indice SQLite (FTS5) di ogni diploma archiviato: nome, MATRI, PROTOCOL, NPERGAMENA,
+# facoltà, ZIP e nome del file nello ZIP. archive.archivia_batch aggiunge le voci del
+# batch; la ricerca risponde dall'indice e il PDF si legge dallo ZIP con accesso
+# diretto al singolo file (la directory centrale dello ZIP), senza estrarre il resto.
+# Gli ZIP archiviati prima del catalogo si importano con importa_zip: dal nome dei file
+# si ricava solo il nominativo.
+import os
+import re
+import sqlite3
+import zipfile
+from contextlib import closing
+from datetime import datetime
+
+import deposito
+import engine
+
+CAMPI_RICERCA = ('nome', 'matri', 'protocol', 'npergamena', 'facolta')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documenti (
+    id INTEGER PRIMARY KEY,
+    nome TEXT, matri TEXT, protocol TEXT, npergamena TEXT, facolta TEXT,
+    zip_name TEXT NOT NULL, membro TEXT NOT NULL, archiviato_il TEXT,
+    UNIQUE (zip_name, membro)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS documenti_fts USING fts5(
+    nome, matri, protocol, npergamena, facolta, content='documenti', content_rowid='id'
+);
+"""
+
+_DIPLOMA_RE = re.compile(r'diploma_(.+)_[^_]+\.pdf$')
+
+
+def connetti(path):
+    db = sqlite3.connect(path, timeout=30)
+    db.row_factory = sqlite3.Row
+    # WAL: la ricerca da altri worker non aspetta l'archiviazione in corso
+    db.execute('PRAGMA journal_mode=WAL')
+    db.executescript(_SCHEMA)
+    return db
+
+
+def _inserisci(db, voci):
+    inserite = 0
+    for voce in voci:
+        cur = db.execute(
+            "INSERT OR IGNORE INTO documenti (nome, matri, protocol, npergamena, facolta, zip_name, membro, archiviato_il) "
+            "VALUES (:nome, :matri, :protocol, :npergamena, :facolta, :zip_name, :membro, :archiviato_il)", voce)
+        if cur.rowcount:
+            db.execute("INSERT INTO documenti_fts (rowid, nome, matri, protocol, npergamena, facolta) "
+                       "VALUES (?, ?, ?, ?, ?, ?)", (cur.lastrowid, *(voce[c] for c in CAMPI_RICERCA)))
+            inserite += 1
+    return inserite
+
+
+def voci_batch(batch_info, zip_name, folder_name, now):
+    """Una voce per ogni diploma del batch presente nello ZIP."""
+    meta = batch_info['metadata']
+    presenti = set(batch_info['filenames'])
+    voci = []
+    for student in meta['student_list']:
+        diploma, _ = engine.nomi_file_studente(student)
+        if diploma not in presenti:
+            continue
+        voci.append({
+            'nome': student.get('NOM_COG', '').replace('|', ' '),
+            'matri': student.get('MATRI', ''),
+            'protocol': student.get('PROTOCOL', ''),
+            'npergamena': student.get('NPERGAMENA', ''),
+            'facolta': meta['facolta'],
+            'zip_name': zip_name,
+            'membro': f"{folder_name}/{diploma}",
+            'archiviato_il': now.strftime('%Y-%m-%d %H:%M'),
+        })
+    return voci
+
+
+def registra_batch(path, batch_info, zip_name, folder_name, now=None):
+    voci = voci_batch(batch_info, zip_name, folder_name, now or datetime.now())
+    with closing(connetti(path)) as db, db:
+        return _inserisci(db, voci)
+
+
+def importa_zip(path, zip_path, facolta=''):
+    """Aggiunge al catalogo i diplomi di uno ZIP archiviato in precedenza (solo nominativo).
+
+    Restituisce il numero di voci nuove: i diplomi già catalogati vengono ignorati.
+    """
+    zip_name = os.path.basename(zip_path)
+    archiviato_il = datetime.fromtimestamp(os.path.getmtime(zip_path)).strftime('%Y-%m-%d %H:%M')
+    voci = []
+    with zipfile.ZipFile(zip_path) as zf:
+        for membro in zf.namelist():
+            trovato = _DIPLOMA_RE.search(os.path.basename(membro))
+            if trovato:
+                voci.append({'nome': trovato.group(1).replace('_', ' '), 'matri': '', 'protocol': '',
+                             'npergamena': '', 'facolta': facolta, 'zip_name': zip_name,
+                             'membro': membro, 'archiviato_il': archiviato_il})
+    with closing(connetti(path)) as db, db:
+        return _inserisci(db, voci)
+
+
+def _query_fts(testo):
+    # Ogni parola come frase con prefisso: "16828/1" e "ross" trovano 16828/1 e ROSSI
+    parole = [p.replace('"', '') for p in testo.split()]
+    return ' '.join(f'"{p}"*' for p in parole if p)
+
+
+def cerca(path, testo, limite=50):
+    """Voci del catalogo che contengono tutte le parole cercate, più recenti prima."""
+    query = _query_fts(testo)
+    if not query or not os.path.exists(path):
+        return []
+    with closing(connetti(path)) as db:
+        righe = db.execute(
+            "SELECT d.* FROM documenti_fts f JOIN documenti d ON d.id = f.rowid "
+            "WHERE documenti_fts MATCH ? ORDER BY d.archiviato_il DESC, d.id LIMIT ?", (query, limite)).fetchall()
+    return [dict(r) for r in righe]
+
+
+def documento(path, doc_id):
+    if not os.path.exists(path):
+        return None
+    with closing(connetti(path)) as db:
+        riga = db.execute("SELECT * FROM documenti WHERE id = ?", (doc_id,)).fetchone()
+    return dict(riga) if riga else None
+
+
+def leggi_pdf(voce, cartelle_archivio):
+    """Byte del PDF dal primo archivio che lo contiene; FileNotFoundError se assente.
+
+    In una cartella di ZIP si legge il solo file dallo ZIP, in un deposito il suo blob.
+    """
+    nome_batch = os.path.splitext(voce['zip_name'])[0]
+    for cartella in cartelle_archivio:
+        zip_path = os.path.join(cartella, voce['zip_name'])
+        if os.path.exists(zip_path):
+            with zipfile.ZipFile(zip_path) as zf:
+                return zf.read(voce['membro'])
+        if deposito.leggi_manifest(cartella, nome_batch) is not None:
+            return deposito.leggi_membro(cartella, nome_batch, voce['membro'])
+    raise FileNotFoundError(voce['zip_name'])
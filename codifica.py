@@ -0,0 +1,101 @@
+# --- CODIFICA DEI FILE DATI ---
+# Gli export di ESSE3 arrivano in UTF-8, ma alcuni passano dal gestionale della
+# segreteria in Windows-1252 (o Latin-1), con i nomi accentati che non sono UTF-8 valido.
+# RigheDecodificate legge lo stream binario a blocchi e restituisce le righe già
+# decodificate, da passare direttamente a engine.parse_diploma_data:
+#   - la codifica si rileva dal primo blocco: BOM (UTF-8, UTF-16), altrimenti UTF-8 se
+#     il blocco è UTF-8 valido, altrimenti Windows-1252
+#   - i blocchi seguenti passano da un decoder incrementale: un carattere multibyte
+#     tagliato tra due blocchi viene completato con il blocco successivo
+#   - se il primo blocco era solo ASCII e più avanti compare un byte non UTF-8, il
+#     decoder passa a Windows-1252 da quel punto: le righe già lette sono identiche in
+#     entrambe le codifiche, nessuna rilettura del file
+# I cinque byte che Windows-1252 non definisce (0x81, 0x8D, 0x8F, 0x90, 0x9D) si leggono
+# come Latin-1: un file Windows-1252 non fa mai fallire la decodifica. Un file UTF-8 con
+# una sequenza non valida dopo caratteri accentati già letti solleva ErroreCodifica.
+import codecs
+
+BLOCCO = 64 * 1024
+CODIFICA_RIPIEGO = 'cp1252'
+_BOM = ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+_ERRORI_RIPIEGO = 'generatore-latin1'
+
+
+def _latin1(errore):
+    return errore.object[errore.start:errore.end].decode('latin-1'), errore.end
+
+
+codecs.register_error(_ERRORI_RIPIEGO, _latin1)
+
+
+class ErroreCodifica(ValueError):
+    pass
+
+
+def rileva_codifica(campione):
+    """Codifica del file dal suo primo blocco di byte."""
+    for bom, codifica in _BOM:
+        if campione.startswith(bom):
+            return codifica
+    try:
+        # final=False: l'ultimo carattere può essere tagliato dalla fine del campione
+        codecs.getincrementaldecoder('utf-8')().decode(campione, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return CODIFICA_RIPIEGO
+
+
+def _decoder(codifica):
+    errori = _ERRORI_RIPIEGO if codecs.lookup(codifica).name == CODIFICA_RIPIEGO else 'strict'
+    return codecs.getincrementaldecoder(codifica)(errori)
+
+
+class RigheDecodificate:
+    """Righe di testo (senza terminatore) di uno stream binario, decodificate a blocchi.
+
+    codifica=None la rileva dal primo blocco; dopo la lettura self.codifica è quella usata
+    (cambia in 'cp1252' se il ripiego è scattato a metà file).
+    """
+
+    def __init__(self, stream, codifica=None, blocco=BLOCCO):
+        self.stream = stream
+        self.codifica = codifica
+        self.blocco = blocco
+
+    def __iter__(self):
+        # Il primo blocco è anche il campione per la rilevazione: almeno un BOM intero
+        primo = self.stream.read(max(self.blocco, 4))
+        rilevata = self.codifica is None
+        if rilevata:
+            self.codifica = rileva_codifica(primo)
+        decoder = _decoder(self.codifica)
+        solo_ascii = True
+        resto = ''
+        numero = 0
+        dati = primo
+        while True:
+            fine = not dati
+            in_sospeso = decoder.getstate()[0]
+            try:
+                testo = decoder.decode(dati, final=fine)
+            except UnicodeDecodeError as e:
+                if not (rilevata and solo_ascii and self.codifica == 'utf-8'):
+                    # Riga del byte non valido: anche quelle complete nello stesso blocco
+                    valido = (in_sospeso + dati)[:e.start].decode(self.codifica, errors='replace')
+                    riga = numero + len((resto + valido + '.').splitlines())
+                    raise ErroreCodifica(f"Il file non è in {self.codifica} valido ({e.reason} alla "
+                                         f"riga {riga}): salvarlo in UTF-8") from e
+                # Fin qui solo ASCII: stesso testo in Windows-1252, si prosegue con quello
+                self.codifica = CODIFICA_RIPIEGO
+                decoder = _decoder(self.codifica)
+                testo = decoder.decode(in_sospeso + dati, final=fine)
+            solo_ascii = solo_ascii and testo.isascii()
+            righe = (resto + testo).splitlines(keepends=True)
+            # L'ultima riga senza \n (anche un \r seguito dal \n nel blocco dopo) aspetta il blocco successivo
+            resto = righe.pop() if righe and not fine and not righe[-1].endswith('\n') else ''
+            for riga in righe:
+                numero += 1
+                yield riga.splitlines()[0]
+            if fine:
+                return
+            dati = self.stream.read(self.blocco)
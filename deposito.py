@@ -0,0 +1,138 @@
+# --- DEPOSITO A CONTENUTO INDIRIZZATO ---
+# Alternativa allo ZIP completo per un archivio (tipicamente Archivio_Franco):
+#   <root>/blob/ab/abcdef...   ogni file una sola volta, con il suo SHA-256 come nome
+#   <root>/batch/<nome>.json   manifest del batch: per ogni file nome nello ZIP, hash e dimensione
+# Ristampe e riarchiviazioni dopo una correzione riusano i blob già presenti: si
+# scrivono solo i PDF nuovi e un manifest di pochi KB. Lo ZIP abituale si ricostruisce
+# su richiesta (esporta_zip); replica copia in un altro deposito solo i blob mancanti.
+# Blob e manifest compaiono con os.replace da un file temporaneo: un manifest
+# visibile ha sempre tutti i suoi blob.
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from datetime import datetime
+
+import metrics
+import pubblica
+
+BLOB_DIR = 'blob'
+BATCH_DIR = 'batch'
+_BLOCCO = 1024 * 1024
+
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for blocco in iter(lambda: f.read(_BLOCCO), b''):
+            h.update(blocco)
+    return h.hexdigest()
+
+
+def path_blob(root, sha256):
+    return os.path.join(root, BLOB_DIR, sha256[:2], sha256)
+
+
+def path_manifest(root, nome_batch):
+    return os.path.join(root, BATCH_DIR, f"{nome_batch}.json")
+
+
+def _pubblica(src, dest):
+    # Reflink o copia, mai hard link: il blob non deve cambiare se cambia il file d'origine
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    pubblica.pubblica(src, dest, hardlink=False)
+
+
+def _scrivi_manifest(root, manifest):
+    dest = path_manifest(root, manifest['nome'])
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.tmp_', dir=os.path.dirname(dest))
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, dest)
+
+
+def deposita_batch(root, nome_batch, membri, now=None):
+    """Archivia i file [(nome_nello_zip, path)] come batch nome_batch.
+
+    Restituisce {'nuovi', 'riusati', 'byte_nuovi'}: solo i blob nuovi vengono scritti.
+    """
+    with metrics.ARCHIVE_COPY_SECONDS.time(destinazione=os.path.basename(root)):
+        voci = []
+        conteggi = {'nuovi': 0, 'riusati': 0, 'byte_nuovi': 0}
+        for nome, src in membri:
+            sha256 = _hash_file(src)
+            dimensione = os.path.getsize(src)
+            dest = path_blob(root, sha256)
+            if os.path.exists(dest):
+                conteggi['riusati'] += 1
+            else:
+                _pubblica(src, dest)
+                conteggi['nuovi'] += 1
+                conteggi['byte_nuovi'] += dimensione
+            voci.append({'nome': nome, 'sha256': sha256, 'dimensione': dimensione})
+        _scrivi_manifest(root, {'nome': nome_batch,
+                                'creato': (now or datetime.now()).strftime('%Y-%m-%d %H:%M:%S'),
+                                'files': voci})
+    return conteggi
+
+
+def leggi_manifest(root, nome_batch):
+    """Manifest del batch, None se il deposito non lo contiene."""
+    try:
+        with open(path_manifest(root, nome_batch), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def elenco_batch(root):
+    try:
+        return sorted(f[:-len('.json')] for f in os.listdir(os.path.join(root, BATCH_DIR)) if f.endswith('.json'))
+    except OSError:
+        return []
+
+
+def leggi_membro(root, nome_batch, membro):
+    """Byte di un file del batch, letti direttamente dal suo blob; KeyError se assente."""
+    manifest = leggi_manifest(root, nome_batch)
+    voce = next((v for v in (manifest or {}).get('files', []) if v['nome'] == membro), None)
+    if voce is None:
+        raise KeyError(membro)
+    with open(path_blob(root, voce['sha256']), 'rb') as f:
+        return f.read()
+
+
+def esporta_zip(root, nome_batch, dest):
+    """Ricostruisce lo ZIP del batch (stessi nomi e struttura di archive.crea_zip_archivio)."""
+    manifest = leggi_manifest(root, nome_batch)
+    if manifest is None:
+        raise FileNotFoundError(f"Batch {nome_batch} non presente nel deposito {root}")
+    with metrics.ZIP_SECONDS.time(tipo='esportazione'), zipfile.ZipFile(dest, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for voce in manifest['files']:
+            zf.write(path_blob(root, voce['sha256']), arcname=voce['nome'])
+    return dest
+
+
+def replica(root, dest_root):
+    """Porta in dest_root i batch mancanti: prima i blob assenti, poi i manifest.
+
+    Restituisce {'batch', 'blob', 'byte'} trasferiti.
+    """
+    trasferiti = {'batch': 0, 'blob': 0, 'byte': 0}
+    presenti = set(elenco_batch(dest_root))
+    for nome_batch in elenco_batch(root):
+        if nome_batch in presenti:
+            continue
+        manifest = leggi_manifest(root, nome_batch)
+        for voce in manifest['files']:
+            dest = path_blob(dest_root, voce['sha256'])
+            if not os.path.exists(dest):
+                _pubblica(path_blob(root, voce['sha256']), dest)
+                trasferiti['blob'] += 1
+                trasferiti['byte'] += voce['dimensione']
+        _scrivi_manifest(dest_root, manifest)
+        trasferiti['batch'] += 1
+    return trasferiti
@@ -0,0 +1,952 @@
+# --- MOTORE DI RENDERING ---
+# Pipeline di generazione condivisa da app.py (upload via browser) e
+# generatore.py (riga di comando): parsing, preparazione dei record,
+# render Jinja + WeasyPrint, merge dei PDF, log del batch.
+# weasyprint e pypdf vengono importati solo quando serve davvero renderizzare:
+# importare questo modulo (o app.py) non costa secondi di avvio.
+import cProfile
+import csv
+import itertools
+import json
+import mimetypes
+import os
+import posixpath
+import pstats
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from urllib.parse import urlsplit, unquote
+
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, TemplateNotFound, select_autoescape
+from werkzeug.security import safe_join
+
+import luoghi
+import metrics
+import watchdog_record
+from codifica import ErroreCodifica
+from tabella import TabellaStudenti, contesto, json_default
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+
+# Gli URL /static/... dei template sono risolti da static_url_fetcher:
+# non serve un server in ascolto, basta un URL base assoluto.
+DEFAULT_BASE_URL = 'http://localhost/'
+LOG_FILENAME = 'log_creazione_diplomi.txt'
+BATCH_INFO_FILENAME = 'batch.json'
+# File vuoto accanto a batch.json di un batch archiviato: lo stato si legge senza aprire batch.json
+ARCHIVIATO_FILENAME = '.archiviato'
+MANIFEST_FILENAME = 'manifest.jsonl'
+LOCK_FILENAME = '.generazione.lock'
+PROFILO_PARZIALE_PREFIX = '.profilo_record_'
+# Esiti che finiscono nella lista errori del batch e vengono rigenerati alla ripresa
+STATI_FALLITI = ('ERRORE', 'TIMEOUT')
+# Un record il cui processo di render muore viene riprovato al massimo tante volte
+MAX_TENTATIVI_RECORD = 2
+
+# Registro dei template: valore della colonna MODULO -> file del diploma
+TEMPLATE_REGISTRY = {
+    'forml01v7': 'diploma_forml01v7.html',
+    'forml01v7tuscia': 'diploma_forml01v7tuscia.html',
+    'forml1v7': 'diploma_forml1v7.html',
+    'forml2v7': 'diploma_forml2v7.html',
+    'forml3v7': 'diploma_forml3v7.html',
+    'forml4v7': 'diploma_forml4v7.html',
+    'forml23v7': 'diploma_forml23v7.html',
+    'forml27v7': 'diploma_forml27v7.html',
+    'forml28v7': 'diploma_forml28v7.html',
+    'forml28v7A': 'diploma_forml28v7A.html',
+    'forml29v7': 'diploma_forml29v7.html',
+    'memoriastudi': 'diploma_memoriastudi.html',
+    'memorialaureamag': 'diploma_memorialaureamag.html',
+    'memorialaureatri': 'diploma_memorialaureatri.html'
+}
+CAMICIA_TEMPLATE = 'camicia_template.html'
+# Codici facoltà (valori di facolta_selezionata in upload.html)
+FACOLTA = ('INGAER', 'GIUR', 'ECON', 'SMFN', 'LETFIL', 'ARCH', 'FARMED', 'ICI', 'I3S', 'MEDODO', 'MEDPSI', 'SPSC')
+TESTO_FOOTER_FISSO = "Imposta di bollo assolta in modo virtuale. Autorizzazione Intendenza di Finanza di Roma n.9120/88"
+# PDF cumulativi: tipo -> (prefisso del cumulativo, prefissi dei PDF di record che contiene)
+CUMULATIVI = {
+    'diplomi': ('tutti_i_diplomi_', ('diploma_',)),
+    'camicie': ('tutte_le_camicie_', ('camicia_',)),
+    # Per ogni studente il diploma e poi la sua camicia
+    'intercalato': ('diplomi_e_camicie_', ('diploma_', 'camicia_')),
+}
+MODI_CUMULATIVI = {
+    'separati': ('diplomi', 'camicie'),
+    'intercalato': ('intercalato',),
+    'entrambi': ('diplomi', 'camicie', 'intercalato'),
+}
+CAMPI_IMMAGINE = ['firmar', 'firmap', 'firmad', 'firma4', 'firma5', 'firma6', 'logo1', 'logo2', 'logo3']
+
+# --- PARSING ---
+def parse_diploma_data(file_content):
+    """TabellaStudenti dal file dati (vuota se il file non è valido).
+
+    file_content è il testo del file oppure le sue righe, anche da un iteratore
+    (codifica.RigheDecodificate): le righe vengono lette man mano, senza il file intero in memoria.
+    Un errore di decodifica (codifica.ErroreCodifica) arriva al chiamante.
+    """
+    righe = iter(file_content.splitlines() if isinstance(file_content, str) else file_content)
+    # Tre righe di intestazione dell'export, la riga dei nomi di colonna e almeno una riga di dati
+    inizio = list(itertools.islice(righe, 5))
+    if len(inizio) < 5: return TabellaStudenti()
+    reader = csv.reader(itertools.chain(inizio[3:], righe), delimiter='^')
+    try:
+        headers = [h.strip() for h in next(reader)]
+        return TabellaStudenti.da_righe(headers, ([v.strip() for v in row] for row in reader if len(row) == len(headers)))
+    except ErroreCodifica: raise
+    except: return TabellaStudenti()
+
+# --- AMBIENTE JINJA ---
+# Indipendente da Flask: lo stesso ambiente serve il web e la riga di comando.
+_jinja_settings = {'auto_reload': True, 'bytecode_cache_dir': None}
+_jinja_env = None
+
+def configura_jinja(auto_reload=True, bytecode_cache_dir=None):
+    global _jinja_env
+    _jinja_settings.update(auto_reload=auto_reload, bytecode_cache_dir=bytecode_cache_dir)
+    _jinja_env = None
+
+def _static_url_for(endpoint, filename='', **kwargs):
+    # Nei template dei diplomi url_for è usato solo per 'static'
+    return STATIC_URL_PREFIX + filename
+
+def get_jinja_env():
+    global _jinja_env
+    if _jinja_env is None:
+        bytecode_cache = None
+        if _jinja_settings['bytecode_cache_dir']:
+            os.makedirs(_jinja_settings['bytecode_cache_dir'], exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(_jinja_settings['bytecode_cache_dir'])
+        env = Environment(loader=FileSystemLoader(TEMPLATES_DIR),
+                          autoescape=select_autoescape(['html', 'htm', 'xml']),
+                          auto_reload=_jinja_settings['auto_reload'],
+                          bytecode_cache=bytecode_cache)
+        env.globals['url_for'] = _static_url_for
+        _jinja_env = env
+    return _jinja_env
+
+def _template_in_cache(env, template_filename):
+    # La cache LRU di Jinja usa come chiave (weakref al loader, nome del template)
+    return env.cache is not None and (weakref.ref(env.loader), template_filename) in env.cache
+
+def precompila_template():
+    """Compila tutti i template del registro; restituisce quelli mancanti."""
+    env = get_jinja_env()
+    mancanti = []
+    for template_filename in sorted(set(TEMPLATE_REGISTRY.values()) | {CAMICIA_TEMPLATE}):
+        try:
+            env.get_template(template_filename)
+        except TemplateNotFound:
+            mancanti.append(template_filename)
+    return mancanti
+
+# --- ASSET STATICI (font, firme, loghi) ---
+# WeasyPrint li leggerebbe via HTTP dal server stesso ad ogni render:
+# li serviamo dalla memoria, caricati una volta (in produzione prima del fork).
+STATIC_URL_PREFIX = '/static/'
+_asset_cache = {}
+# Hit/miss della cache degli asset del documento in corso di impaginazione in questo
+# thread: tornano al processo padre dentro l'esito del record (registra_metriche)
+_conteggio_asset = threading.local()
+
+def carica_asset_statici():
+    if not os.path.isdir(STATIC_DIR):
+        return 0
+    for root, _, files in os.walk(STATIC_DIR):
+        for name in files:
+            full_path = os.path.join(root, name)
+            rel = os.path.relpath(full_path, STATIC_DIR).replace(os.sep, '/')
+            with open(full_path, 'rb') as f:
+                _asset_cache[rel] = f.read()
+    return len(_asset_cache)
+
+def static_url_fetcher(url, *args, **kwargs):
+    path = urlsplit(url).path
+    if path.startswith(STATIC_URL_PREFIX):
+        # I template usano anche percorsi come /static/font//Sapienza/...
+        rel = posixpath.normpath(unquote(path[len(STATIC_URL_PREFIX):])).lstrip('/')
+        data = _asset_cache.get(rel)
+        conteggio = getattr(_conteggio_asset, 'valori', None)
+        if conteggio is not None:
+            conteggio[data is None] += 1
+        if data is None:
+            full_path = safe_join(STATIC_DIR, rel)
+            if full_path and os.path.isfile(full_path):
+                with open(full_path, 'rb') as f:
+                    data = _asset_cache[rel] = f.read()
+        if data is not None:
+            return {'string': data, 'mime_type': mimetypes.guess_type(rel)[0], 'redirected_url': url}
+    from weasyprint import default_url_fetcher
+    return default_url_fetcher(url, *args, **kwargs)
+
+# --- PREPARAZIONE DEL RECORD ---
+def prepara_record(student, template=None):
+    """Dal record del file dati al contesto dei template.
+
+    Restituisce (template_filename, modulo, dati_diploma, dati_camicia);
+    template_filename è None se il modulo non è nel registro.
+    template sostituisce quello del registro (ritentativo con template di ripiego).
+    """
+    student_data_for_template = contesto(student)
+
+    # --- FORMATTAZIONE NOMI E LUOGHI ---
+    # Gestione a capo e nomi (Logica originale)
+    student_data_for_template['corsolau'] = student_data_for_template.get('corsolau', '').replace('|', '<br>')
+    student_data_for_template['nom_cog'] = student_data_for_template.get('nom_cog', '').replace('|', '<br>')
+
+    # --- LOGICA LUOGO DI NASCITA (Ripristinata) ---
+    # Comune e stato nella grafia canonica (luoghi.normalizza, memorizzata per valore)
+    luogo_nascita_completo = luoghi.normalizza(student_data_for_template.get('luogonas', ''))
+    stato_nascita = luoghi.normalizza(student_data_for_template.get('statnas', ''))
+    provincia_nascita = student_data_for_template.get('provnas', '').strip()
+
+    if provincia_nascita:
+        luogo_nascita_completo += f" {provincia_nascita}"
+
+    if stato_nascita:
+        luogo_nascita_completo += f" {stato_nascita}"
+
+    # Sovrascriviamo per il template
+    student_data_for_template['luogonas'] = luogo_nascita_completo
+
+    modulo_value = student_data_for_template.get('modulo', '').strip()
+    template_filename = template or TEMPLATE_REGISTRY.get(modulo_value)
+    if not template_filename:
+        return None, modulo_value, student_data_for_template, None
+
+    student_data_for_template['lode'] = student_data_for_template.get('lode', '').upper().strip()
+    student_data_for_template['testo_footer_fisso'] = TESTO_FOOTER_FISSO
+
+    # Gestione immagini firme/loghi
+    for k in CAMPI_IMMAGINE:
+        val = student_data_for_template.get(k)
+        if val and not val.endswith('.png'):
+            student_data_for_template[k] = f"{val}.png"
+
+    camicia_data = {
+        'corso_laurea': student_data_for_template.get('corsolau', ''),
+        'nome_studente': student_data_for_template.get('nom_cog', ''),
+        'luogo_nascita': luogo_nascita_completo,
+        'provincia_nascita': provincia_nascita,
+        'data_nascita': student_data_for_template.get('datanas', ''),
+        'numero_protocollo': student_data_for_template.get('protocol', ''),
+        'numero_diploma': student_data_for_template.get('npergamena', ''),
+        'genere_nato_nata': student_data_for_template.get('sesso', 'nato/a').strip(),
+        'firmad': student_data_for_template.get('firmad', ''),
+        'firmar': student_data_for_template.get('firmar', ''),
+        'firmap': student_data_for_template.get('firmap', '')
+    }
+    return template_filename, modulo_value, student_data_for_template, camicia_data
+
+def nomi_file_record(dati, modulo_value):
+    clean_name = dati.get('nom_cog', 'studente').replace(' ', '_').replace('<br>', '_')
+    return f'diploma_{clean_name}_{modulo_value}.pdf', f'camicia_{clean_name}.pdf'
+
+def nomi_file_studente(student):
+    """(diploma, camicia) dello studente, senza preparare tutto il contesto dei template."""
+    dati = {'nom_cog': student['NOM_COG'].replace('|', '<br>')} if 'NOM_COG' in student else {}
+    return nomi_file_record(dati, student.get('MODULO', '').strip())
+
+# --- IMPAGINAZIONE E MERGE ---
+def layout_pdf(rendered_html, base_url, dest_path):
+    """Impaginazione WeasyPrint e scrittura del PDF su disco.
+
+    Restituisce (secondi di impaginazione, secondi di scrittura, pagine, [hit, miss] degli asset).
+    """
+    from weasyprint import HTML
+    _conteggio_asset.valori = conteggio = [0, 0]
+    try:
+        t0 = time.perf_counter()
+        document = HTML(string=rendered_html, base_url=base_url, url_fetcher=static_url_fetcher).render()
+        t1 = time.perf_counter()
+        pdf_bytes = document.write_pdf()
+    finally:
+        _conteggio_asset.valori = None
+    with open(dest_path, 'wb') as f:
+        f.write(pdf_bytes)
+    return t1 - t0, time.perf_counter() - t1, len(document.pages), conteggio
+
+def render_documento(template_filename, context, dest_path, base_url=DEFAULT_BASE_URL):
+    """Render Jinja + impaginazione + scrittura: ({'jinja', 'layout', 'write', 'cache_hit', 'asset_hit', 'asset_miss'}, pagine)."""
+    env = get_jinja_env()
+    cache_hit = _template_in_cache(env, template_filename)
+    t0 = time.perf_counter()
+    rendered_html = env.get_template(template_filename).render(**context)
+    jinja_s = time.perf_counter() - t0
+    layout_s, write_s, pagine, (asset_hit, asset_miss) = layout_pdf(rendered_html, base_url, dest_path)
+    return {'jinja': jinja_s, 'layout': layout_s, 'write': write_s, 'cache_hit': cache_hit,
+            'asset_hit': asset_hit, 'asset_miss': asset_miss}, pagine
+
+def render_record(indice, student, dest_dir, base_url=DEFAULT_BASE_URL, profilo=False, template=None, budget=None):
+    """Genera diploma e camicia di uno studente in dest_dir.
+
+    Può girare in un processo separato: restituisce un esito serializzabile
+    con stato (OK / SKIP / ERRORE / TIMEOUT), file scritti con le loro pagine e tempi per fase.
+    budget ({'secondi', 'rss_mb'}) limita durata e crescita di memoria del record.
+    Con profilo=True il profilo del record viene salvato in dest_dir e
+    unito da concludi_batch a quello del batch.
+    """
+    if profilo:
+        profiler = cProfile.Profile()
+        esito = profiler.runcall(_render_record, indice, student, dest_dir, base_url, template, budget)
+        profiler.dump_stats(os.path.join(dest_dir, f'{PROFILO_PARZIALE_PREFIX}{indice}.pstats'))
+        return esito
+    return _render_record(indice, student, dest_dir, base_url, template, budget)
+
+def _render_record(indice, student, dest_dir, base_url, template=None, budget=None):
+    template_filename, modulo_value, dati, camicia_data = prepara_record(student, template)
+    esito = {'indice': indice, 'nome': dati.get('nom_cog'), 'modulo': modulo_value,
+             'files': [], 'pagine': {}, 'tempi': {}, 'stato': 'OK', 'messaggio': ''}
+    if not template_filename:
+        esito.update(stato='SKIP', messaggio=f"Modulo '{modulo_value}' non trovato per {dati.get('nom_cog')}")
+        return esito
+
+    pdf_name, c_pdf_name = nomi_file_record(dati, modulo_value)
+    try:
+        with watchdog_record.Watchdog(budget, dest_dir, indice):
+            # Generazione Diploma
+            esito['tempi']['diploma'], esito['pagine'][pdf_name] = render_documento(
+                template_filename, dati, os.path.join(dest_dir, pdf_name), base_url)
+            esito['files'].append(pdf_name)
+            # Generazione Camicia
+            esito['tempi']['camicia'], esito['pagine'][c_pdf_name] = render_documento(
+                CAMICIA_TEMPLATE, camicia_data, os.path.join(dest_dir, c_pdf_name), base_url)
+            esito['files'].append(c_pdf_name)
+    except watchdog_record.BudgetSuperato as e:
+        # Il segnale può arrivare a camicia già scritta, prima che il watchdog si fermi
+        if c_pdf_name not in esito['files']:
+            esito.update(stato='TIMEOUT', messaggio=str(e), costo=e.costo)
+    except Exception as e:
+        esito.update(stato='ERRORE', messaggio=str(e))
+    return esito
+
+def esito_interrotto(indice, student, dest_dir, errore, tentativi, marcatori=None):
+    """Esito di un record il cui processo di render è morto, o None se va riprovato.
+
+    Se il processo è stato terminato dal watchdog mentre rendeva questo record, il
+    record è TIMEOUT con il costo misurato. marcatori (watchdog_record.marcatori_presenti
+    dei record in corso nel pool) dice se il watchdog l'ha terminato per un altro record:
+    in quel caso questo record torna in coda senza contare il tentativo. Altrimenti
+    (memoria esaurita, crash senza marcatore) viene riprovato fino a MAX_TENTATIVI_RECORD volte.
+    """
+    esito = {'indice': indice, 'nome': student.get('NOM_COG'), 'modulo': student.get('MODULO', ''),
+             'files': [], 'tempi': {}, 'stato': 'ERRORE', 'messaggio': ''}
+    marcatore = None
+    if marcatori is None or watchdog_record.marcatore_path(dest_dir, indice) in marcatori:
+        marcatore = watchdog_record.esito_da_marcatore(dest_dir, indice)
+    if marcatore:
+        motivo, costo = marcatore
+        esito.update(stato='TIMEOUT', costo=costo,
+                     messaggio=f"{motivo} ({costo['secondi']:.2f}s, +{costo['rss_mb']:.0f} MB RSS), processo terminato")
+        return esito
+    if marcatori:
+        return None
+    tentativi[indice] = tentativi.get(indice, 0) + 1
+    if tentativi[indice] < MAX_TENTATIVI_RECORD:
+        return None
+    esito['messaggio'] = f"processo di render interrotto: {errore}"
+    return esito
+
+# Cumulativi prodotti da concludi_batch (configura_cumulativi, da PDF_CUMULATIVI dell'app)
+_tipi_cumulativi = MODI_CUMULATIVI['separati']
+
+def configura_cumulativi(modo):
+    global _tipi_cumulativi
+    if modo not in MODI_CUMULATIVI:
+        raise ValueError(f"Modo dei PDF cumulativi '{modo}' non valido: {', '.join(MODI_CUMULATIVI)}")
+    _tipi_cumulativi = MODI_CUMULATIVI[modo]
+
+def nome_cumulativo(tipo, nome_cartella):
+    return f'{CUMULATIVI[tipo][0]}{nome_cartella}.pdf'
+
+class MergeIncrementale:
+    """PDF cumulativi costruiti man mano che i record sono pronti.
+
+    Gli esiti arrivano in qualsiasi ordine (aggiungi); le pagine di un record
+    entrano nei cumulativi appena sono pronti tutti i record che lo precedono in
+    indici, così il merge procede mentre gli altri record sono ancora in render.
+    Ogni PDF di record viene letto una volta e va in ciascun cumulativo che lo
+    contiene. concludi() scrive i file e ne restituisce i nomi (quelli con almeno
+    una pagina). Le pagine restano in memoria fino a concludi(): è incrementale
+    l'accodamento, non la scrittura su disco.
+    """
+
+    def __init__(self, dest_dir, nome_cartella, indici, tipi=None):
+        from pypdf import PdfWriter
+        self.dest_dir = dest_dir
+        self.nome_cartella = nome_cartella
+        self.tipi = tuple(tipi or _tipi_cumulativi)
+        self._ordine = list(indici)
+        self._prossimo = 0
+        self._in_attesa = {}
+        self._writers = {tipo: PdfWriter() for tipo in self.tipi}
+        self._usati = set()
+        self._durata = 0.0
+
+    @property
+    def completo(self):
+        return self._prossimo == len(self._ordine)
+
+    def aggiungi(self, esito):
+        self._in_attesa[esito['indice']] = esito
+        while not self.completo and self._ordine[self._prossimo] in self._in_attesa:
+            self._accoda(self._in_attesa.pop(self._ordine[self._prossimo]))
+            self._prossimo += 1
+
+    def _accoda(self, esito):
+        from pypdf import PdfReader
+        t0 = time.perf_counter()
+        for f in esito['files']:
+            destinazioni = [tipo for tipo in self.tipi if f.startswith(CUMULATIVI[tipo][1])]
+            if not destinazioni:
+                continue
+            reader = PdfReader(os.path.join(self.dest_dir, f))
+            for tipo in destinazioni:
+                self._writers[tipo].append(reader)
+                self._usati.add(tipo)
+        self._durata += time.perf_counter() - t0
+
+    def concludi(self):
+        if not self.completo:
+            raise RuntimeError(f"Merge incompleto: manca il record {self._ordine[self._prossimo]}")
+        t0 = time.perf_counter()
+        nomi = []
+        for tipo in self.tipi:
+            if tipo in self._usati:
+                # Nuovo file e os.replace: le copie pubblicate con hard link restano intatte
+                dest_path = os.path.join(self.dest_dir, nome_cumulativo(tipo, self.nome_cartella))
+                self._writers[tipo].write(dest_path + '.tmp')
+                os.replace(dest_path + '.tmp', dest_path)
+                nomi.append(os.path.basename(dest_path))
+            self._writers[tipo].close()
+        metrics.MERGE_SECONDS.observe(self._durata + time.perf_counter() - t0, tipo='cumulativi')
+        return nomi
+
+# --- BATCH ---
+def _init_processo_render(jinja_settings, luoghi_indice=None, con_warmup=False):
+    watchdog_record.terminazione_consentita = True
+    configura_jinja(**jinja_settings)
+    luoghi.configura(luoghi_indice)
+    carica_asset_statici()
+    if con_warmup:
+        warmup()
+
+def crea_pool_render(workers, con_warmup=False):
+    # WeasyPrint è CPU-bound e tiene il GIL: si parallelizza con processi.
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_processo_render,
+                               initargs=(dict(_jinja_settings), luoghi.indice_completo, con_warmup))
+
+def _esegui_render(students_data, indici, dest_dir, workers, base_url, profilo, budget=None):
+    if workers <= 1:
+        for i in indici:
+            yield render_record(i, students_data[i], dest_dir, base_url, profilo, budget=budget)
+        return
+    # Esiti nell'ordine di completamento: un record lento non ferma gli altri.
+    # Se un processo muore il pool viene ricreato per i record rimasti.
+    da_fare = list(indici)
+    tentativi = {}
+    while da_fare:
+        with crea_pool_render(workers) as executor:
+            futures = {executor.submit(render_record, i, students_data[i], dest_dir, base_url, profilo,
+                                       budget=budget): i for i in da_fare}
+            da_fare = []
+            marcatori = None
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    yield future.result()
+                except BrokenProcessPool as e:
+                    if marcatori is None:
+                        marcatori = watchdog_record.marcatori_presenti((dest_dir, j) for j in futures.values())
+                    esito = esito_interrotto(i, students_data[i], dest_dir, e, tentativi, marcatori)
+                    if esito is None:
+                        da_fare.append(i)
+                    else:
+                        yield esito
+
+def registra_metriche(esito):
+    """Metriche del record nel processo padre: il render può essere avvenuto in un altro processo."""
+    for documento, tempi in esito['tempi'].items():
+        metrics.RENDER_CACHE.record(tempi['cache_hit'])
+        # Esiti scritti prima che il conteggio degli asset esistesse non hanno le chiavi
+        metrics.RENDER_CACHE.aggiungi(tempi.get('asset_hit', 0), tempi.get('asset_miss', 0))
+        metrics.JINJA_RENDER_SECONDS.observe(tempi['jinja'], documento=documento, modulo=esito['modulo'])
+        metrics.WEASYPRINT_LAYOUT_SECONDS.observe(tempi['layout'], documento=documento, modulo=esito['modulo'])
+        metrics.WEASYPRINT_WRITE_SECONDS.observe(tempi['write'], documento=documento, modulo=esito['modulo'])
+
+def voce_log(esito):
+    if esito['stato'] == 'SKIP':
+        return f"SKIP: {esito['messaggio']}"
+    if esito['stato'] in STATI_FALLITI:
+        return f"{esito['stato']} {esito['nome']}: {esito['messaggio']}"
+    d, c = esito['tempi']['diploma'], esito['tempi']['camicia']
+    return (f"OK: {esito['nome']} | "
+            f"diploma render {d['jinja'] + d['layout']:.3f}s scrittura {d['write']:.3f}s | "
+            f"camicia render {c['jinja'] + c['layout']:.3f}s scrittura {c['write']:.3f}s")
+
+def durata_record(esito):
+    return sum(t['jinja'] + t['layout'] + t['write'] for t in esito['tempi'].values())
+
+RIEPILOGO_TITOLO = "--- RIEPILOGO TEMPI ---"
+
+def riepilogo_tempi(tempi_record, n_errori, n_saltati, durata_totale, n_lenti=5, n_timeout=0):
+    """Righe di riepilogo in coda a log_creazione_diplomi.txt."""
+    righe = ["", RIEPILOGO_TITOLO,
+             f"Record generati: {len(tempi_record)} | Errori: {n_errori} | Timeout: {n_timeout} | Saltati: {n_saltati}",
+             f"Tempo totale batch: {durata_totale:.2f}s"]
+    if tempi_record:
+        durate = [t for _, t in tempi_record]
+        righe.append(f"Tempo totale record: {sum(durate):.2f}s | media {sum(durate) / len(durate):.3f}s")
+        righe.append("Percentili per record: " + " | ".join(
+            f"p{q} {metrics.percentile(durate, q):.3f}s" for q in (50, 90, 99)) + f" | max {max(durate):.3f}s")
+        righe.append("Record più lenti:")
+        for nome, durata in sorted(tempi_record, key=lambda r: r[1], reverse=True)[:n_lenti]:
+            righe.append(f"  {durata:.3f}s  {nome}")
+    return righe
+
+def salva_profilo(profiler, dest_dir, nome_cartella):
+    """Salva il profilo cProfile del batch: .pstats (snakeviz, flameprof) + testo leggibile.
+
+    Unisce il profilo del processo principale (merge) a quelli dei singoli
+    record, anche se renderizzati in processi separati.
+    """
+    pstats_name = f'profilo_{nome_cartella}.pstats'
+    txt_name = f'profilo_{nome_cartella}.txt'
+    parziali = sorted(os.path.join(dest_dir, f) for f in os.listdir(dest_dir) if f.startswith(PROFILO_PARZIALE_PREFIX))
+    with open(os.path.join(dest_dir, txt_name), 'w', encoding='utf-8') as f:
+        stats = pstats.Stats(profiler, *parziali, stream=f)
+        stats.dump_stats(os.path.join(dest_dir, pstats_name))
+        stats.sort_stats('cumulative').print_stats(60)
+    for path in parziali:
+        os.remove(path)
+    return [pstats_name, txt_name]
+
+def genera_batch(students_data, dest_dir, nome_cartella, workers=1, profilo=False, base_url=DEFAULT_BASE_URL,
+                 gia_conclusi=None, budget=None):
+    """Genera diplomi, camicie, PDF cumulativi e log in dest_dir.
+
+    Ogni record concluso viene annotato nel manifest; gia_conclusi (da
+    leggi_manifest) sono gli esiti di un'esecuzione interrotta da non rigenerare.
+    budget: limiti di tempo e memoria per record (watchdog_record.budget_record).
+    """
+    t_inizio_batch = time.perf_counter()
+    esiti = dict(gia_conclusi or {})
+    merge = MergeIncrementale(dest_dir, nome_cartella, range(len(students_data)))
+    for esito in esiti.values():
+        merge.aggiungi(esito)
+    mancanti = [i for i in range(len(students_data)) if i not in esiti]
+    # Con più processi il merge dei record pronti avanza mentre gli altri sono in render
+    for esito in _esegui_render(students_data, mancanti, dest_dir, workers, base_url, profilo, budget):
+        registra_esito(dest_dir, esito)
+        esiti[esito['indice']] = esito
+        merge.aggiungi(esito)
+    return concludi_batch([esiti[i] for i in range(len(students_data))], dest_dir, nome_cartella,
+                          t_inizio_batch, profilo, merge=merge)
+
+def concludi_batch(esiti, dest_dir, nome_cartella, t_inizio_batch, profilo=False, merge=None):
+    """Dagli esiti dei record (nell'ordine del file dati) a merge, profilo e log.
+
+    merge: MergeIncrementale che ha già ricevuto gli esiti durante il render;
+    altrimenti i cumulativi vengono costruiti qui.
+    """
+    generated_pdf_filenames = []
+    log_entries = []
+    tempi_record = []
+    n_errori = n_saltati = n_timeout = 0
+    profiler = None
+    if profilo:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # --- CICLO ESITI ---
+    esiti = list(esiti)
+    for esito in esiti:
+        registra_metriche(esito)
+        generated_pdf_filenames.extend(esito['files'])
+        log_entries.append(voce_log(esito))
+        if esito['stato'] == 'SKIP':
+            n_saltati += 1
+        elif esito['stato'] == 'ERRORE':
+            n_errori += 1
+        elif esito['stato'] == 'TIMEOUT':
+            n_timeout += 1
+        else:
+            tempi_record.append((esito['nome'], durata_record(esito)))
+
+    # --- OPERAZIONI POST-GENERAZIONE ---
+    # Merge: diplomi, camicie e/o intercalato in una sola passata
+    if merge is None:
+        merge = MergeIncrementale(dest_dir, nome_cartella, [e['indice'] for e in esiti])
+        for esito in esiti:
+            merge.aggiungi(esito)
+    generated_pdf_filenames.extend(merge.concludi())
+
+    if profiler:
+        profiler.disable()
+        generated_pdf_filenames.extend(salva_profilo(profiler, dest_dir, nome_cartella))
+
+    log_entries.extend(riepilogo_tempi(tempi_record, n_errori, n_saltati, time.perf_counter() - t_inizio_batch,
+                                       n_timeout=n_timeout))
+
+    log_content = '\n'.join(log_entries)
+    log_file_path = os.path.join(dest_dir, LOG_FILENAME)
+    with open(log_file_path, 'w', encoding='utf-8') as f:
+        f.write(log_content)
+
+    return {'filenames': generated_pdf_filenames, 'log_content': log_content, 'log_file_path': log_file_path,
+            'errori': errori_batch(esiti)}
+
+def errori_batch(esiti):
+    """Record in ERRORE o TIMEOUT, per il pulsante 'Ritenta errori' dell'anteprima."""
+    return [{'indice': e['indice'], 'nome': e['nome'], 'modulo': e['modulo'], 'stato': e['stato'],
+             'messaggio': e['messaggio']}
+            for e in esiti if e['stato'] in STATI_FALLITI]
+
+def metadati_batch(students_data, facolta):
+    """Metadati per archivio e stampa, ricavati dal primo studente."""
+    primo_studente = students_data[0] if students_data else {}
+
+    # 1. Protocollo pulito (es. 16828/1 -> 16828)
+    prot_raw = primo_studente.get('PROTOCOL', '').strip()
+    protocollo_clean = prot_raw.split('/')[0] if '/' in prot_raw else prot_raw
+
+    # 2. Tipologia (LM- in CLASSE -> LaureaMagistrale)
+    classe_val = primo_studente.get('CLASSE', '')
+    tipologia = "LaureaMagistrale" if "LM-" in classe_val else "LaureaTriennale"
+
+    # 3. Anno Laurea
+    anno_lau = primo_studente.get('DATALAUR', datetime.now().strftime('%Y')).strip().replace('/', '-')
+
+    return {
+        'protocollo': protocollo_clean,
+        'tipologia': tipologia,
+        'facolta': facolta.replace(' ', '_'),
+        'anno_laurea': anno_lau,
+        'totale': len(students_data),
+        'student_list': students_data
+    }
+
+def nuovo_batch_info(dest_dir, risultato, nome_cartella, metadata):
+    return {
+        'temp_dir': dest_dir,
+        'filenames': risultato['filenames'],
+        'log_content': risultato['log_content'],
+        'log_file_path': risultato['log_file_path'],
+        'original_folder_name': nome_cartella,
+        'archived': False,
+        'errori': risultato['errori'],
+        'metadata': metadata
+    }
+
+def scrivi_batch_info(batch_info):
+    # batch.json nella cartella del batch: stato condiviso tra worker, CLI e ingestione
+    with open(os.path.join(batch_info['temp_dir'], BATCH_INFO_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(batch_info, f, ensure_ascii=False, default=json_default)
+    if batch_info.get('archived'):
+        open(os.path.join(batch_info['temp_dir'], ARCHIVIATO_FILENAME), 'w').close()
+
+def leggi_batch_info(path):
+    """batch.json con student_list come TabellaStudenti; OSError/ValueError se illeggibile."""
+    with open(path, encoding='utf-8') as f:
+        batch_info = json.load(f)
+    meta = batch_info['metadata']
+    meta['student_list'] = TabellaStudenti.da_json(meta['student_list'])
+    meta.pop('nomi_persone', None)
+    return batch_info
+
+# --- CHECKPOINT ---
+# manifest.jsonl nella cartella del batch: una riga di intestazione con tutto ciò
+# che serve a ripartire (studenti, nome cartella, parametri del chiamante), poi
+# una riga per ogni record concluso, scritta in append con fsync. Se il processo
+# muore a metà batch si rigenerano solo i record mancanti, poi merge e log.
+# Un batch è interrotto se ha il manifest ma non ancora batch.json.
+def scrivi_manifest(dest_dir, students_data, nome_cartella, **parametri):
+    intestazione = {'nome_cartella': nome_cartella, 'parametri': parametri, 'students_data': students_data}
+    with open(os.path.join(dest_dir, MANIFEST_FILENAME), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(intestazione, ensure_ascii=False, default=json_default) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def registra_esito(dest_dir, esito):
+    with open(os.path.join(dest_dir, MANIFEST_FILENAME), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(esito, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def _leggi_righe_manifest(dest_dir):
+    # (intestazione, {indice: ultimo esito registrato}); l'ultima riga può essere troncata
+    try:
+        with open(os.path.join(dest_dir, MANIFEST_FILENAME), encoding='utf-8') as f:
+            righe = f.read().splitlines()
+        intestazione = json.loads(righe[0])
+        intestazione['students_data'] = TabellaStudenti.da_json(intestazione['students_data'])
+    except (OSError, ValueError, IndexError, KeyError):
+        return None
+    esiti = {}
+    for riga in righe[1:]:
+        try:
+            esito = json.loads(riga)
+        except ValueError:
+            continue
+        esiti[esito['indice']] = esito
+    return intestazione, esiti
+
+def leggi_manifest(dest_dir):
+    """(intestazione, {indice: esito}) dei record già conclusi, None senza manifest.
+
+    Non contano come conclusi gli esiti ERRORE o TIMEOUT (spesso dovuti proprio
+    all'interruzione), quelli con PDF mancanti e l'ultima riga se troncata.
+    """
+    letto = _leggi_righe_manifest(dest_dir)
+    if letto is None:
+        return None
+    intestazione, esiti = letto
+    conclusi = {i: e for i, e in esiti.items()
+                if e['stato'] not in STATI_FALLITI and all(os.path.exists(os.path.join(dest_dir, f)) for f in e['files'])}
+    return intestazione, conclusi
+
+def avanzamento_manifest(dest_dir):
+    """(parametri, totale, record conclusi) dal manifest, None se manca o è illeggibile.
+
+    Per lo stato di un batch generato da un altro worker: si contano gli esiti registrati
+    (anche ERRORE e TIMEOUT, come lo scheduler) senza ricostruire la tabella degli studenti.
+    """
+    try:
+        with open(os.path.join(dest_dir, MANIFEST_FILENAME), encoding='utf-8') as f:
+            intestazione = json.loads(f.readline())
+            studenti = intestazione['students_data']
+            totale = len(studenti['righe'] if isinstance(studenti, dict) else studenti)
+            indici = set()
+            for riga in f:
+                try:
+                    indici.add(json.loads(riga)['indice'])
+                except (ValueError, KeyError):
+                    continue
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return intestazione.get('parametri', {}), totale, len(indici)
+
+def rivendica_batch(dest_dir):
+    """Lock esclusivo sulla generazione del batch: fd da tenere aperto finché il batch
+    non è concluso, None se un altro processo vivo lo sta già generando.
+
+    lockf (lock POSIX) e non flock: non passa ai processi di render creati con fork
+    dopo la rivendicazione e il sistema lo rilascia quando il worker muore, così un
+    worker riavviato può riprendere il batch. Senza fcntl (Windows) non c'è lock.
+    """
+    fd = os.open(os.path.join(dest_dir, LOCK_FILENAME), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        import fcntl
+        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except ImportError:
+        pass
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+def rilascia_batch(fd):
+    if fd is not None:
+        os.close(fd)
+
+def batch_interrotti(root):
+    """Cartelle dei batch in root con manifest ma senza batch.json.
+
+    Possono essere ancora in generazione in un altro worker: prima di riprenderle
+    serve rivendica_batch.
+    """
+    try:
+        entries = sorted(os.scandir(root), key=lambda e: e.name)
+    except OSError:
+        return []
+    return [e.path for e in entries
+            if e.is_dir() and os.path.exists(os.path.join(e.path, MANIFEST_FILENAME))
+            and not os.path.exists(os.path.join(e.path, BATCH_INFO_FILENAME))]
+
+# --- CORREZIONE E RITENTATIVO DEI RECORD ---
+def trova_record(student_list, matri=None, indice=None):
+    """Indice del record da correggere, per MATRI o per posizione nel file dati (da 0)."""
+    if matri:
+        trovati = [i for i, s in enumerate(student_list) if s.get('MATRI', '').strip() == str(matri).strip()]
+        if len(trovati) != 1:
+            raise ValueError(f"MATRI {matri}: {'nessun record' if not trovati else 'più record'} nel batch")
+        return trovati[0]
+    try:
+        indice = int(indice)
+    except (TypeError, ValueError):
+        raise ValueError("Indice non valido: indicare MATRI o il numero di riga dello studente") from None
+    if not 0 <= indice < len(student_list):
+        raise ValueError(f"Indice non valido: il batch ha {len(student_list)} studenti (da 0 a {len(student_list) - 1})")
+    return indice
+
+def conta_pagine(paths):
+    from pypdf import PdfReader
+    return sum(len(PdfReader(p).pages) for p in paths)
+
+def pagine_record(esito, dest_dir, prefisso):
+    """Pagine dei PDF del record che iniziano con prefisso.
+
+    Le pagine sono annotate nell'esito (e nel manifest) al render; i PDF vengono
+    riletti solo per gli esiti senza conteggio (manifest scritti prima dell'annotazione).
+    """
+    pagine = esito.get('pagine', {})
+    return sum(pagine[f] if f in pagine else conta_pagine([os.path.join(dest_dir, f)])
+               for f in esito['files'] if f.startswith(prefisso))
+
+def sostituisci_pagine(combinato, sostituzioni):
+    """Sostituisce gruppi di pagine di un PDF cumulativo in una sola passata, senza rifare il merge.
+
+    sostituzioni: (inizio, n_vecchie, nuovi_paths) ordinate per inizio. Il file
+    viene riscritto accanto e rimpiazzato con os.replace: chi lo sta leggendo
+    vede il vecchio o il nuovo, mai un PDF a metà.
+    """
+    from pypdf import PdfReader, PdfWriter
+    with metrics.MERGE_SECONDS.time(tipo='incrementale'):
+        writer = PdfWriter()
+        reader = PdfReader(combinato) if os.path.exists(combinato) else None
+        pos = 0
+        for inizio, n_vecchie, nuovi_paths in sostituzioni:
+            if reader and inizio > pos:
+                writer.append(reader, pages=(pos, inizio))
+            for path in nuovi_paths:
+                writer.append(path)
+            pos = inizio + n_vecchie
+        if reader and pos < len(reader.pages):
+            writer.append(reader, pages=(pos, len(reader.pages)))
+        tmp_path = combinato + '.tmp'
+        writer.write(tmp_path)
+        writer.close()
+        os.replace(tmp_path, combinato)
+
+def integra_esiti(batch_info, nuovi_esiti, src_dir, note_log):
+    """Porta nel batch i record rigenerati in src_dir, senza toccare gli altri.
+
+    Per ogni esito OK le pagine del record vengono sostituite (o inserite) nei
+    PDF cumulativi del batch (CUMULATIVI), i suoi PDF spostati nella cartella
+    del batch e annotati nel manifest; filenames, log ed errori di batch_info si
+    aggiornano (batch.json va poi riscritto dal chiamante). Gli esiti non OK
+    vengono ignorati. note_log: righe da aggiungere in coda al log.
+    """
+    dest_dir = batch_info['temp_dir']
+    nome_cartella = batch_info['original_folder_name']
+    letto = _leggi_righe_manifest(dest_dir)
+    if letto is None:
+        raise ValueError("Manifest del batch non disponibile")
+    esiti = letto[1]
+    ok = {i: e for i, e in nuovi_esiti.items() if e['stato'] == 'OK'}
+
+    # I cumulativi seguono l'ordine del file dati: le pagine di un record
+    # iniziano dopo quelle dei record precedenti
+    cumulativi = []
+    if ok:
+        ultimo = max(ok)
+        # I cumulativi già presenti nel batch; se non ce n'è nessuno, quelli configurati
+        tipi = [t for t in CUMULATIVI if nome_cumulativo(t, nome_cartella) in batch_info['filenames']]
+        for tipo in tipi or _tipi_cumulativi:
+            prefisso, combinato = CUMULATIVI[tipo][1], nome_cumulativo(tipo, nome_cartella)
+            sostituzioni = []
+            pagina = 0
+            for i in sorted(set(esiti) | set(ok)):
+                if i > ultimo:
+                    break
+                n_vecchie = pagine_record(esiti.get(i, {'files': []}), dest_dir, prefisso)
+                if i in ok:
+                    sostituzioni.append((pagina, n_vecchie, [os.path.join(src_dir, f) for f in ok[i]['files']
+                                                             if f.startswith(prefisso)]))
+                pagina += n_vecchie
+            sostituisci_pagine(os.path.join(dest_dir, combinato), sostituzioni)
+            cumulativi.append(combinato)
+
+    vecchi_files = set()
+    for i, esito in ok.items():
+        vecchi = esiti.get(i, {'files': []})['files']
+        vecchi_files.update(vecchi)
+        for f in vecchi:
+            if f not in esito['files']:
+                os.remove(os.path.join(dest_dir, f))
+        for f in esito['files']:
+            os.replace(os.path.join(src_dir, f), os.path.join(dest_dir, f))
+        registra_metriche(esito)
+        registra_esito(dest_dir, esito)
+        esiti[i] = esito
+
+    # File dei record nell'ordine del file dati, poi cumulativi e profilo
+    files_record = [f for i in sorted(esiti) for f in esiti[i]['files']]
+    altri = [f for f in batch_info['filenames'] if f not in vecchi_files and f not in files_record]
+    batch_info['filenames'] = files_record + altri + [f for f in cumulativi if f not in altri]
+    batch_info['errori'] = [e for e in batch_info.get('errori', []) if e['indice'] not in ok]
+
+    # Log: voci dei record rigenerate dal manifest, riepilogo e note precedenti invariati
+    _, titolo, riepilogo = batch_info['log_content'].partition('\n' + RIEPILOGO_TITOLO)
+    batch_info['log_content'] = '\n'.join([voce_log(esiti[i]) for i in sorted(esiti)]
+                                          + ([titolo + riepilogo] if titolo else []) + list(note_log))
+    with open(batch_info['log_file_path'], 'w', encoding='utf-8') as f:
+        f.write(batch_info['log_content'])
+    return list(ok.values())
+
+def record_corretto(batch_info, indice, correzioni):
+    """Lo studente indice con i campi corretti; ValueError per campi che il file dati non ha."""
+    studente = batch_info['metadata']['student_list'][indice]
+    ignoti = set(correzioni) - set(studente)
+    if ignoti:
+        raise ValueError(f"Campi sconosciuti: {', '.join(sorted(ignoti))}")
+    return studente.con(correzioni)
+
+def integra_correzione(batch_info, indice, studente, correzioni, esito, src_dir):
+    """Porta nel batch il record corretto, generato in src_dir con render_record.
+
+    Le sue pagine vengono sostituite nei PDF cumulativi (integra_esiti) e
+    student_list si aggiorna. Se il record corretto non si è generato solleva
+    ValueError e il batch resta com'era.
+    """
+    if esito['stato'] != 'OK':
+        raise ValueError(voce_log(esito))
+    meta = batch_info['metadata']
+    campi = ', '.join(f"{k}={v}" for k, v in correzioni.items())
+    integra_esiti(batch_info, {indice: esito}, src_dir,
+                  [f"CORREZIONE {datetime.now().strftime('%d/%m/%Y %H:%M')}: "
+                   f"{esito['nome']} (riga {indice + 1}) rigenerato con {campi}"])
+    students = meta['student_list']
+    students[indice] = studente
+    if indice == 0:
+        # Protocollo, tipologia e anno vengono dal primo studente
+        meta.update(metadati_batch(students, meta['facolta']))
+    return esito
+
+def concludi_ritentativo(batch_info, nuovi_esiti, src_dir):
+    """Integra nel batch gli esiti di un ritentativo dei record in ERRORE o TIMEOUT."""
+    ora = datetime.now().strftime('%d/%m/%Y %H:%M')
+    note = []
+    for i in sorted(nuovi_esiti):
+        esito = nuovi_esiti[i]
+        if esito['stato'] == 'OK':
+            note.append(f"RITENTATIVO {ora}: {esito['nome']} (riga {i + 1}) generato")
+        else:
+            note.append(f"RITENTATIVO {ora}: {esito['nome']} (riga {i + 1}) ancora in "
+                        f"{esito['stato']}: {esito['messaggio']}")
+    integra_esiti(batch_info, nuovi_esiti, src_dir, note)
+    # Gli errori rimasti riportano stato e messaggio dell'ultimo tentativo
+    for errore in batch_info['errori']:
+        if errore['indice'] in nuovi_esiti:
+            errore['stato'] = nuovi_esiti[errore['indice']]['stato']
+            errore['messaggio'] = nuovi_esiti[errore['indice']]['messaggio']
+    return batch_info
+
+# --- WARM-UP ---
+def warmup():
+    """Da chiamare una volta per worker prima di accettare richieste.
+
+    Importa weasyprint e pypdf e impagina un documento minimo: il primo
+    diploma reale non paga il caricamento di Pango, fontconfig e dei CSS di default.
+    """
+    from weasyprint import HTML
+    import pypdf  # noqa: F401
+    t0 = time.perf_counter()
+    HTML(string='<p style="font-family: serif">warm-up</p>', url_fetcher=static_url_fetcher).write_pdf()
+    return time.perf_counter() - t0
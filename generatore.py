@@ -0,0 +1,284 @@
+# --- GENERATORE DIPLOMI DA RIGA DI COMANDO ---
+# Stessa pipeline di /upload-data (engine.genera_batch), senza server web:
+#
+#   python -m generatore verifica export.txt
+#   python -m generatore render export.txt --facolta ICI --workers 8 --out DIR [--archivia] [--profilo] [--forza]
+#   python -m generatore riprendi DIR [--workers 8]
+#   python -m generatore watch INBOX --out DIR [--workers 8] [--paralleli 2] [--debounce 5]
+#   python -m generatore catalogo cerca TESTO | importa [ZIP ...]
+#   python -m generatore deposito elenco | esporta NOME --out FILE.zip | replica DEST [--da SRC]
+#   python -m generatore nodo [--host 0.0.0.0] [--porta 8101] [--workers 8]
+#
+# In DIR vengono scritti diplomi, camicie, PDF cumulativi, log, manifest.jsonl e batch.json.
+# Se il render si interrompe, 'riprendi DIR' genera solo i record mancanti dal manifest.
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+
+import engine
+import archive
+import codifica
+import preflight
+import stampa
+import watchdog_record
+
+
+def _carica_app():
+    # Percorsi degli archivi e configurazione (GENERATORE_SETTINGS / GENERATORE_*) condivisi con il web
+    import app
+    engine.configura_jinja(auto_reload=False, bytecode_cache_dir=app.app.config['JINJA_BYTECODE_CACHE_DIR'])
+    return app
+
+
+def _budget(args, app_module):
+    # Limiti per record: da riga di comando, altrimenti dalla configurazione del web
+    return watchdog_record.budget_record(
+        app_module.app.config['RECORD_TIMEOUT_SECONDS'] if args.timeout is None else args.timeout,
+        app_module.app.config['RECORD_MAX_RSS_MB'] if args.max_rss is None else args.max_rss)
+
+
+def _leggi(args):
+    with open(args.file, 'rb') as f:
+        righe = codifica.RigheDecodificate(f, args.encoding)
+        try:
+            students_data = engine.parse_diploma_data(righe)
+        except codifica.ErroreCodifica as e:
+            print(f"{args.file}: {e}", file=sys.stderr)
+            return None
+    if righe.codifica not in ('utf-8', 'utf-8-sig'):
+        print(f"File dati letto in {righe.codifica}", file=sys.stderr)
+    if not students_data:
+        print(f"File dati non valido o vuoto: {args.file}", file=sys.stderr)
+    return students_data
+
+
+def cmd_verifica(args):
+    students_data = _leggi(args)
+    if not students_data:
+        return 1
+    report = preflight.verifica(students_data)
+    print(preflight.testo_report(report, students_data))
+    return 1 if report['errori'] else 0
+
+
+def cmd_render(args):
+    app_module = _carica_app()
+    students_data = _leggi(args)
+    if not students_data:
+        return 1
+    report = preflight.verifica(students_data)
+    if report['problemi']:
+        print(preflight.testo_report(report, students_data), file=sys.stderr)
+    if report['errori'] and not args.forza:
+        print("Generazione annullata: correggere il file o usare --forza", file=sys.stderr)
+        return 1
+
+    out_dir = os.path.abspath(args.out)
+    os.makedirs(out_dir, exist_ok=True)
+    nome_cartella = datetime.now().strftime('%Y-%m-%d')
+    engine.scrivi_manifest(out_dir, students_data, nome_cartella, facolta=args.facolta,
+                           archivia=args.archivia, profilo=args.profilo)
+    return _genera(app_module, students_data, out_dir, nome_cartella, args.facolta, args.workers,
+                   args.archivia, args.profilo, budget=_budget(args, app_module))
+
+
+def cmd_riprendi(args):
+    app_module = _carica_app()
+    out_dir = os.path.abspath(args.dir)
+    letto = engine.leggi_manifest(out_dir)
+    if letto is None:
+        print(f"Nessun manifest valido in {out_dir}", file=sys.stderr)
+        return 1
+    if os.path.exists(os.path.join(out_dir, engine.BATCH_INFO_FILENAME)):
+        print(f"Il batch in {out_dir} è già completo", file=sys.stderr)
+        return 1
+    intestazione, conclusi = letto
+    students_data = intestazione['students_data']
+    parametri = intestazione['parametri']
+    print(f"Ripresa: {len(conclusi)}/{len(students_data)} record già generati")
+    return _genera(app_module, students_data, out_dir, intestazione['nome_cartella'], parametri['facolta'],
+                   args.workers, parametri.get('archivia', False), parametri.get('profilo', False), conclusi,
+                   budget=_budget(args, app_module))
+
+
+def _genera(app_module, students_data, out_dir, nome_cartella, facolta, workers, archivia, profilo,
+            gia_conclusi=None, budget=None):
+    engine.carica_asset_statici()
+    risultato = engine.genera_batch(students_data, out_dir, nome_cartella, workers=workers, profilo=profilo,
+                                    gia_conclusi=gia_conclusi, budget=budget)
+    batch_info = engine.nuovo_batch_info(out_dir, risultato, nome_cartella,
+                                         engine.metadati_batch(students_data, facolta))
+
+    if archivia:
+        destinazioni, depositi = app_module.archivi()
+        zip_name = archive.archivia_batch(batch_info, destinazioni, app_module.PATH_EXCEL_REGISTRO,
+                                          path_catalogo=app_module.PATH_CATALOGO, depositi=depositi)
+        batch_info['archived'] = True
+        print(f"Archiviazione completata: {zip_name}")
+
+    engine.scrivi_batch_info(batch_info)
+
+    print(risultato['log_content'])
+    print(f"\nFile generati in {out_dir}")
+    return 0
+
+
+def cmd_watch(args):
+    import ingest
+    app_module = _carica_app()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    engine.carica_asset_statici()
+    watcher = ingest.InboxWatcher(args.inbox, args.out, app_module.PATH_STAMPA, workers=args.workers,
+                                  paralleli=args.paralleli, debounce=args.debounce,
+                                  intervallo=args.intervallo, facolta_default=args.facolta,
+                                  budget=_budget(args, app_module),
+                                  spool=stampa.limiti_spool(
+                                      app_module.app.config['STAMPA_PARTE_MAX_PAGINE'] if args.parte_max_pagine is None
+                                      else args.parte_max_pagine,
+                                      app_module.app.config['STAMPA_PARTE_MAX_MB'] if args.parte_max_mb is None
+                                      else args.parte_max_mb))
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
+    return 0
+
+
+def cmd_catalogo(args):
+    import catalogo
+    app_module = _carica_app()
+    if args.azione == 'cerca':
+        for voce in catalogo.cerca(app_module.PATH_CATALOGO, ' '.join(args.argomenti), args.limite):
+            print(f"{voce['id']:>6}  {voce['nome']} | MATR: {voce['matri']} | PROT: {voce['protocol']} | "
+                  f"{voce['facolta']} | {voce['zip_name']}")
+        return 0
+    # importa: gli ZIP indicati, o tutti quelli dell'archivio locale
+    zip_paths = args.argomenti or sorted(
+        os.path.join(app_module.PATH_ARCHIVIO_1, f) for f in os.listdir(app_module.PATH_ARCHIVIO_1) if f.endswith('.zip'))
+    for zip_path in zip_paths:
+        # <Tipologia>_<N>_<Facolta>_<Anno>_<timestamp>.zip
+        parti = os.path.basename(zip_path).split('_')
+        n = catalogo.importa_zip(app_module.PATH_CATALOGO, zip_path, facolta=parti[2] if len(parti) > 4 else '')
+        print(f"{os.path.basename(zip_path)}: {n} diplomi")
+    return 0
+
+
+def cmd_nodo(args):
+    import nodi
+    _carica_app()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    engine.carica_asset_statici()
+    try:
+        nodi.avvia_nodo(args.host, args.porta, args.workers)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_deposito(args):
+    import deposito
+    app_module = _carica_app()
+    root = args.da or app_module.PATH_ARCHIVIO_2
+    if args.azione == 'elenco':
+        for nome_batch in deposito.elenco_batch(root):
+            print(nome_batch)
+    elif args.azione == 'esporta':
+        if not args.argomento or not args.out:
+            print("Indicare il batch da esportare e --out", file=sys.stderr)
+            return 2
+        print(deposito.esporta_zip(root, args.argomento, args.out))
+    else:
+        if not args.argomento:
+            print("Indicare il deposito di destinazione", file=sys.stderr)
+            return 2
+        trasferiti = deposito.replica(root, args.argomento)
+        print(f"Replicati {trasferiti['batch']} batch: {trasferiti['blob']} file nuovi, "
+              f"{trasferiti['byte'] / 1024 / 1024:.1f} MB")
+    return 0
+
+
+def _aggiungi_budget(parser):
+    parser.add_argument('--timeout', type=float,
+                        help='Secondi massimi per record, 0 = nessun limite (default: RECORD_TIMEOUT_SECONDS)')
+    parser.add_argument('--max-rss', type=float,
+                        help='MB di memoria aggiuntiva per record, 0 = nessun limite (default: RECORD_MAX_RSS_MB)')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m generatore', description='Generatore Diplomi senza server web')
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p_render = sub.add_parser('render', help='Genera un batch da un file di export ESSE3')
+    p_render.add_argument('file', help="File dati delimitato da '^'")
+    p_render.add_argument('--facolta', required=True, type=str.upper, choices=engine.FACOLTA, help='Codice facoltà (es. ICI, GIUR, ECON)')
+    p_render.add_argument('--out', required=True, help='Cartella di destinazione')
+    p_render.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                          help='Processi di render in parallelo (default: numero di CPU)')
+    p_render.add_argument('--encoding', help='Codifica del file dati (default: rilevata, UTF-8 o Windows-1252)')
+    p_render.add_argument('--archivia', action='store_true',
+                          help='Archivia come il pulsante Archivia: ZIP negli archivi e registro Excel')
+    p_render.add_argument('--profilo', action='store_true', help='Salva il profilo cProfile del batch')
+    p_render.add_argument('--forza', action='store_true', help='Genera anche se la verifica preliminare trova errori')
+    _aggiungi_budget(p_render)
+    p_render.set_defaults(func=cmd_render)
+
+    p_verifica = sub.add_parser('verifica', help='Verifica preliminare di un file dati, senza generare nulla')
+    p_verifica.add_argument('file', help="File dati delimitato da '^'")
+    p_verifica.add_argument('--encoding', help='Codifica del file dati (default: rilevata, UTF-8 o Windows-1252)')
+    p_verifica.set_defaults(func=cmd_verifica)
+
+    p_riprendi = sub.add_parser('riprendi', help='Completa un batch interrotto generando solo i record mancanti')
+    p_riprendi.add_argument('dir', help='Cartella del batch (quella passata a --out)')
+    p_riprendi.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processi di render in parallelo (default: numero di CPU)')
+    _aggiungi_budget(p_riprendi)
+    p_riprendi.set_defaults(func=cmd_riprendi)
+
+    p_watch = sub.add_parser('watch', help='Elabora automaticamente gli export depositati in una cartella')
+    p_watch.add_argument('inbox', help='Cartella da osservare (i file elaborati vanno in elaborati/ o errori/)')
+    p_watch.add_argument('--out', required=True, help='Cartella in cui creare le cartelle dei batch')
+    p_watch.add_argument('--facolta', type=str.upper, choices=engine.FACOLTA, help='Facoltà di default se non indicata da sidecar o nome file')
+    p_watch.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                         help='Processi di render per batch (default: numero di CPU)')
+    p_watch.add_argument('--paralleli', type=int, default=1, help='File elaborati contemporaneamente (default 1)')
+    p_watch.add_argument('--debounce', type=float, default=5.0,
+                         help='Secondi di stabilità prima di leggere un file (default 5)')
+    p_watch.add_argument('--intervallo', type=float, default=2.0, help='Secondi tra due scansioni (default 2)')
+    p_watch.add_argument('--parte-max-pagine', type=int,
+                         help='Divide i PDF di stampa in parti di al massimo N pagine (default: STAMPA_PARTE_MAX_PAGINE)')
+    p_watch.add_argument('--parte-max-mb', type=float,
+                         help='Divide i PDF di stampa in parti di al massimo N MB (default: STAMPA_PARTE_MAX_MB)')
+    _aggiungi_budget(p_watch)
+    p_watch.set_defaults(func=cmd_watch)
+
+    p_catalogo = sub.add_parser('catalogo', help='Ricerca nel catalogo dei diplomi archiviati o importazione di ZIP')
+    p_catalogo.add_argument('azione', choices=('cerca', 'importa'))
+    p_catalogo.add_argument('argomenti', nargs='*', help='Testo da cercare, oppure ZIP da importare (default: tutti)')
+    p_catalogo.add_argument('--limite', type=int, default=50, help='Risultati massimi della ricerca (default 50)')
+    p_catalogo.set_defaults(func=cmd_catalogo)
+
+    p_deposito = sub.add_parser('deposito', help='Deposito a contenuto indirizzato: elenco, esportazione ZIP, replica')
+    p_deposito.add_argument('azione', choices=('elenco', 'esporta', 'replica'))
+    p_deposito.add_argument('argomento', nargs='?', help='Batch da esportare, oppure deposito di destinazione della replica')
+    p_deposito.add_argument('--da', help='Deposito di origine (default: Archivio_Franco)')
+    p_deposito.add_argument('--out', help='ZIP da creare (esporta)')
+    p_deposito.set_defaults(func=cmd_deposito)
+
+    p_nodo = sub.add_parser('nodo', help='Nodo di render per un coordinatore con RENDER_NODI')
+    p_nodo.add_argument('--host', default='127.0.0.1', help='Indirizzo di ascolto (default 127.0.0.1)')
+    p_nodo.add_argument('--porta', type=int, default=8101, help='Porta HTTP (default 8101)')
+    p_nodo.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Processi di render del nodo (default: numero di CPU)')
+    p_nodo.set_defaults(func=cmd_nodo)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
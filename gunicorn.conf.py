@@ -0,0 +1,38 @@
+# --- CONFIGURAZIONE GUNICORN ---
+# I valori si possono sovrascrivere con le variabili d'ambiente GENERATORE_*
+# oppure da riga di comando (gunicorn -c gunicorn.conf.py --workers 4 ...).
+import os
+
+wsgi_app = 'wsgi:app'
+bind = os.environ.get('GENERATORE_BIND', '0.0.0.0:5000')
+
+# Il render non avviene nei worker HTTP ma negli slot dello scheduler (RENDER_SLOTS
+# processi per worker gunicorn). Default 1 worker con thread: una sola coda, quindi il
+# tetto globale di render e la ripartizione equa tra facoltà valgono per tutto il server.
+# Più worker sono supportati (stato e avanzamento dei batch si leggono dalla cartella
+# del batch, un batch interrotto viene ripreso da un solo worker e mai mentre il
+# worker che lo genera è vivo), ma ognuno ha il suo scheduler: i processi di render diventano
+# workers × RENDER_SLOTS e priorità ed equità valgono solo tra i batch dello stesso worker.
+workers = int(os.environ.get('GENERATORE_WORKERS', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GENERATORE_THREADS', 8))
+
+# Template, font e immagini caricati nel master prima del fork (vedi wsgi.py)
+preload_app = True
+
+# La generazione non blocca le richieste (scheduler), ma archiviazione (ZIP, deposito e
+# registro Excel), download dello ZIP e stampa divisa in parti di un batch grande
+# avvengono ancora dentro la richiesta: il timeout di default (30s) non basta.
+timeout = int(os.environ.get('GENERATORE_TIMEOUT', 1800))
+graceful_timeout = 60
+
+accesslog = os.environ.get('GENERATORE_ACCESSLOG', '-')
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    # Avvia lo scheduler prima che il worker riceva traffico: i processi di
+    # render eseguono engine.warmup() nel loro initializer
+    from app import get_scheduler
+    get_scheduler().avvia()
+    worker.log.info("Scheduler di render avviato")
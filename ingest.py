@@ -0,0 +1,208 @@
+# --- INGESTIONE AUTOMATICA DALLA INBOX ---
+# Le segreterie depositano gli export ESSE3 ('^'-delimitati) in una cartella:
+# ogni file, una volta completo, passa per la stessa pipeline di /upload-data
+# (engine.genera_batch) e i PDF cumulativi finiscono in Da_Stampare come col pulsante Stampa.
+#
+# La facoltà si legge, in ordine, da:
+#   1. sidecar <nome>.facolta (prima riga) oppure <nome>.json ({"facolta": "ICI"})
+#   2. un token del nome file uguale a un codice facoltà (es. ICI_export_luglio.txt)
+#   3. il valore di default passato al watcher
+# Un sidecar con un codice che non è in engine.FACOLTA manda il file in errori/.
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import codifica
+import engine
+import preflight
+import stampa
+
+logger = logging.getLogger('generatore.ingest')
+
+ESTENSIONI_DATI = ('.txt',)
+CARTELLA_ELABORATI = 'elaborati'
+CARTELLA_ERRORI = 'errori'
+
+
+def sidecar_paths(path):
+    stem = os.path.splitext(path)[0]
+    return [stem + '.facolta', stem + '.json']
+
+
+def facolta_per_file(path, default=None):
+    for sidecar in sidecar_paths(path):
+        if not os.path.isfile(sidecar):
+            continue
+        with open(sidecar, encoding='utf-8') as f:
+            if sidecar.endswith('.json'):
+                valore = json.load(f).get('facolta', '')
+            else:
+                valore = f.readline()
+        valore = valore.strip().upper()
+        if valore:
+            # Il codice finisce nel nome della cartella di stampa: solo facoltà note
+            if valore not in engine.FACOLTA:
+                raise ValueError(f"Facoltà '{valore}' in {os.path.basename(sidecar)} non valida "
+                                 f"(valide: {', '.join(engine.FACOLTA)})")
+            return valore
+    stem = os.path.splitext(os.path.basename(path))[0]
+    for token in re.split(r'[^A-Za-z0-9]+', stem):
+        if token.upper() in engine.FACOLTA:
+            return token.upper()
+    return default
+
+
+class InboxWatcher:
+    """Osserva la inbox a intervalli regolari (polling, nessuna dipendenza esterna).
+
+    Un file è pronto quando dimensione e mtime non cambiano per `debounce`
+    secondi: così non si legge un export ancora in copia dalla rete.
+    """
+
+    def __init__(self, inbox, out_root, path_stampa, workers=1, paralleli=1,
+                 debounce=5.0, intervallo=2.0, facolta_default=None, budget=None, spool=None):
+        self.inbox = os.path.abspath(inbox)
+        self.out_root = os.path.abspath(out_root)
+        self.path_stampa = path_stampa
+        self.spool = spool
+        self.workers = workers
+        self.paralleli = max(1, paralleli)
+        self.debounce = debounce
+        self.intervallo = intervallo
+        self.facolta_default = facolta_default
+        self.budget = budget
+        self._osservati = {}
+        self._in_coda = set()
+        self._coda = queue.Queue()
+        self._stop = threading.Event()
+        for cartella in (self.inbox, self.out_root, self._cartella(CARTELLA_ELABORATI), self._cartella(CARTELLA_ERRORI)):
+            os.makedirs(cartella, exist_ok=True)
+
+    def _cartella(self, nome):
+        return os.path.join(self.inbox, nome)
+
+    def file_pronti(self, adesso=None):
+        adesso = adesso if adesso is not None else time.time()
+        pronti = []
+        presenti = set()
+        with os.scandir(self.inbox) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.startswith(('.', '~')):
+                    continue
+                if not entry.name.lower().endswith(ESTENSIONI_DATI):
+                    continue
+                presenti.add(entry.path)
+                if entry.path in self._in_coda:
+                    continue
+                st = entry.stat()
+                firma = (st.st_size, st.st_mtime)
+                precedente = self._osservati.get(entry.path)
+                if precedente is None or precedente[0] != firma:
+                    self._osservati[entry.path] = (firma, adesso)
+                    continue
+                if adesso - precedente[1] >= self.debounce and adesso - st.st_mtime >= self.debounce:
+                    pronti.append(entry.path)
+        for path in list(self._osservati):
+            if path not in presenti:
+                del self._osservati[path]
+        return sorted(pronti)
+
+    def _sposta(self, path, cartella):
+        dest = self._cartella(cartella)
+        for p in [path] + sidecar_paths(path):
+            if os.path.exists(p):
+                shutil.move(p, os.path.join(dest, os.path.basename(p)))
+
+    def elabora(self, path):
+        """Genera il batch di un file della inbox; restituisce la cartella del batch."""
+        nome_file = os.path.basename(path)
+        facolta = facolta_per_file(path, self.facolta_default)
+        if not facolta:
+            raise ValueError(f"Facoltà non determinabile per {nome_file}: aggiungere un file .facolta")
+        with open(path, 'rb') as f:
+            students_data = engine.parse_diploma_data(codifica.RigheDecodificate(f))
+        if not students_data:
+            raise ValueError(f"File dati non valido o vuoto: {nome_file}")
+        # Un file con errori va in errori/ con il report, prima di qualsiasi render
+        report = preflight.verifica(students_data)
+        if report['errori']:
+            raise ValueError(preflight.testo_report(report, students_data))
+        if report['avvisi']:
+            logger.warning("%s: %s", nome_file, preflight.testo_report(report, students_data))
+
+        ripresa = self._batch_interrotto(nome_file, students_data)
+        if ripresa:
+            # Il file era già in lavorazione quando il processo è stato fermato
+            batch_dir, nome_cartella, conclusi = ripresa
+            logger.info("%s: ripresa di %s (%d record già generati)", nome_file, batch_dir, len(conclusi))
+        else:
+            now = datetime.now()
+            nome_cartella = now.strftime('%Y-%m-%d')
+            batch_dir = os.path.join(self.out_root, f"{os.path.splitext(nome_file)[0]}_{now.strftime('%Y%m%d_%H%M%S')}")
+            os.makedirs(batch_dir, exist_ok=True)
+            engine.scrivi_manifest(batch_dir, students_data, nome_cartella, facolta=facolta, sorgente=nome_file)
+            conclusi = None
+        risultato = engine.genera_batch(students_data, batch_dir, nome_cartella, workers=self.workers,
+                                        gia_conclusi=conclusi, budget=self.budget)
+        batch_info = engine.nuovo_batch_info(batch_dir, risultato, nome_cartella,
+                                             engine.metadati_batch(students_data, facolta))
+        engine.scrivi_batch_info(batch_info)
+        cartella_stampa = stampa.prepara_stampa(batch_info, self.path_stampa, spool=self.spool)
+        logger.info("%s: %d studenti (%s) -> %s, stampa in %s",
+                    nome_file, len(students_data), facolta, batch_dir, cartella_stampa)
+        return batch_dir
+
+    def _batch_interrotto(self, nome_file, students_data):
+        for batch_dir in engine.batch_interrotti(self.out_root):
+            letto = engine.leggi_manifest(batch_dir)
+            if letto is None:
+                continue
+            intestazione, conclusi = letto
+            if (intestazione['parametri'].get('sorgente') == nome_file
+                    and intestazione['students_data'] == students_data):
+                return batch_dir, intestazione['nome_cartella'], conclusi
+        return None
+
+    def _consumatore(self):
+        while True:
+            path = self._coda.get()
+            if path is None:
+                return
+            try:
+                self.elabora(path)
+                self._sposta(path, CARTELLA_ELABORATI)
+            except Exception as e:
+                logger.error("Errore su %s: %s", os.path.basename(path), e)
+                with open(os.path.join(self._cartella(CARTELLA_ERRORI), os.path.basename(path) + '.errore.txt'),
+                          'w', encoding='utf-8') as f:
+                    f.write(str(e))
+                self._sposta(path, CARTELLA_ERRORI)
+            finally:
+                self._in_coda.discard(path)
+                self._osservati.pop(path, None)
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        logger.info("In ascolto su %s (debounce %.1fs)", self.inbox, self.debounce)
+        consumatori = [threading.Thread(target=self._consumatore, daemon=True) for _ in range(self.paralleli)]
+        for t in consumatori:
+            t.start()
+        try:
+            while not self._stop.is_set():
+                for path in self.file_pronti():
+                    self._in_coda.add(path)
+                    self._coda.put(path)
+                self._stop.wait(self.intervallo)
+        finally:
+            for _ in consumatori:
+                self._coda.put(None)
+            for t in consumatori:
+                t.join()
@@ -0,0 +1,106 @@
+# --- NORMALIZZAZIONE DEI LUOGHI DI NASCITA ---
+# Grafia canonica di comuni e stati (maiuscole, apostrofi, accenti) per LUOGONAS e STATNAS.
+# Prima si cerca il valore nell'indice offline (dati/luoghi.txt, oppure il CSV ISTAT
+# indicato in LUOGHI_INDICE della configurazione dell'app, vedi configura); se manca si applicano le regole di
+# format_place_name. Entrambe le funzioni sono memorizzate: in un batch i luoghi di
+# nascita si ripetono molto, e ogni valore distinto viene elaborato una volta sola.
+import csv
+import os
+import unicodedata
+from functools import lru_cache
+
+INDICE_PREDEFINITO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dati', 'luoghi.txt')
+COLONNA_ISTAT = 'Denominazione in italiano'
+# Indice completo (CSV ISTAT) da aggiungere a quello predefinito: None = nessuno
+indice_completo = None
+
+# Preposizioni e articoli che devono restare minuscoli
+PREPOSIZIONI = frozenset({
+    'di', 'del', 'della', 'degli', 'dei', 'de', 'da', 'dal',
+    'dalla', 'dai', 'dagli', 'su', 'sul', 'sulla', 'sui',
+    'sugli', 'a', 'al', 'alla', 'ai', 'agli', 'in', 'nel',
+    'nella', 'nei', 'negli', 'per', 'con', 'e', 'il', 'lo', 'la', 'gli', 'le',
+    "d'", "l'", "de'", 'val', 'meno', "all'",
+})
+# Articoli con apostrofo
+APOSTROFI = frozenset({"d'", "l'", "all'", "dell'", "nell'"})
+
+
+def chiave(valore):
+    """Chiave di ricerca: minuscole, senza accenti né apostrofi in fondo alle parole.
+
+    FORLI' e Forlì, L’AQUILA e L'Aquila danno la stessa chiave.
+    """
+    testo = unicodedata.normalize('NFD', valore.replace('’', "'").lower())
+    testo = ''.join(c for c in testo if not unicodedata.combining(c))
+    return ' '.join(parola.rstrip("'") if parola.endswith("'") and len(parola) > 2 else parola
+                    for parola in testo.replace(' - ', '-').split())
+
+
+def _leggi_indice(path):
+    with open(path, encoding='utf-8-sig', errors='replace') as f:
+        if not path.lower().endswith('.csv'):
+            return [riga.strip() for riga in f if riga.strip() and not riga.startswith('#')]
+        # Elenco comuni ISTAT: separatore ';', nomi bilingui come "Bolzano/Bozen"
+        nomi = []
+        for riga in csv.DictReader(f, delimiter=';'):
+            nome = (riga.get(COLONNA_ISTAT) or '').strip()
+            if nome:
+                nomi.extend(n.strip() for n in nome.split('/'))
+        return nomi
+
+
+def configura(path):
+    """Imposta l'indice completo (LUOGHI_INDICE dell'app; vuoto = solo l'indice predefinito)."""
+    global indice_completo
+    path = path or None
+    if path != indice_completo:
+        indice_completo = path
+        indice.cache_clear()
+        normalizza.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def indice():
+    """{chiave: grafia canonica}: indice predefinito più, se indicato, quello completo."""
+    voci = {}
+    for path in (INDICE_PREDEFINITO, indice_completo):
+        if path and os.path.exists(path):
+            for nome in _leggi_indice(path):
+                voci.setdefault(chiave(nome), nome)
+    return voci
+
+
+@lru_cache(maxsize=65536)
+def format_place_name(place_str):
+    if not place_str: return ""
+    words = place_str.lower().split()
+    final = []
+
+    for i, word in enumerate(words):
+        # Se è una preposizione e non è la prima parola, resta minuscola
+        if word in PREPOSIZIONI and i > 0:
+            final.append(word.lower())
+        # Gestione apostrofi (es: l'aquila -> L'Aquila)
+        elif "'" in word:
+            parts = word.split("'")
+            prefix = parts[0] + "'"
+            suffix = parts[1]
+            if prefix in APOSTROFI and i > 0:
+                final.append(prefix.lower() + suffix.capitalize())
+            else:
+                final.append(prefix.capitalize() + suffix.capitalize())
+        # Altrimenti capitalizza normalmente
+        else:
+            final.append(word.capitalize())
+
+    return ' '.join(final)
+
+
+@lru_cache(maxsize=65536)
+def normalizza(valore):
+    """Grafia canonica di un comune o di uno stato: dall'indice, altrimenti dalle regole."""
+    valore = valore.strip()
+    if not valore:
+        return ''
+    return indice().get(chiave(valore)) or format_place_name(valore)
@@ -0,0 +1,142 @@
+# --- CARTELLE DI LAVORO DEI BATCH ---
+# Le cartelle dei batch vivono in BATCH_ROOT (anche un tmpfs, per velocità) finché
+# il timer di pulizia non le rimuove, CLEANUP_DELAY_SECONDS dopo l'ultimo accesso
+# (secondi_alla_scadenza). Questo modulo:
+#   - misura lo spazio di ogni batch (/api/spazio, metrica per stato)
+#   - libera spazio prima di un nuovo batch quando si supera QUOTA_BATCH_MB o il disco
+#     è quasi pieno: rimuove i batch conclusi meno usati di recente (LRU sull'ultimo
+#     accesso), prima quelli già archiviati, mai quelli in generazione
+#   - all'avvio rimuove le cartelle rimaste da un processo precedente: batch conclusi
+#     da più di CLEANUP_DELAY_SECONDS (il timer è andato perso) e cartelle senza manifest
+# Lo stato si ricava dai file della cartella, così vale per tutti i worker gunicorn:
+# manifest senza batch.json = in generazione, batch.json = concluso, con accanto
+# il file .archiviato = archiviato. Basta la presenza dei file: nessun JSON da leggere.
+import os
+import shutil
+import time
+
+import engine
+import metrics
+from ammissione import disco_libero_mb
+
+STATO_IN_GENERAZIONE = 'in_generazione'
+STATO_CONCLUSO = 'concluso'
+STATO_ARCHIVIATO = 'archiviato'
+STATO_ORFANO = 'orfano'
+# Una cartella senza manifest più giovane di così può essere un batch appena creato
+ETA_MINIMA_ORFANI = 3600
+# Sottocartelle di lavoro (ritentativo o correzione in corso, create dall'app con questi
+# prefissi): finché esistono il batch non si tocca
+PREFISSO_RITENTATIVO = '.ritenta_'
+PREFISSO_CORREZIONE = '.correzione_'
+_LAVORO_PREFISSI = (PREFISSO_RITENTATIVO, PREFISSO_CORREZIONE)
+
+
+def stato_batch(dest_dir):
+    if os.path.exists(os.path.join(dest_dir, engine.BATCH_INFO_FILENAME)):
+        if os.path.exists(os.path.join(dest_dir, engine.ARCHIVIATO_FILENAME)):
+            return STATO_ARCHIVIATO
+        return STATO_CONCLUSO
+    if os.path.exists(os.path.join(dest_dir, engine.MANIFEST_FILENAME)):
+        return STATO_IN_GENERAZIONE
+    return STATO_ORFANO
+
+
+def _in_lavoro(dest_dir):
+    try:
+        return any(nome.startswith(_LAVORO_PREFISSI) for nome in os.listdir(dest_dir))
+    except OSError:
+        return False
+
+
+def ultimo_accesso(dest_dir):
+    try:
+        return os.stat(dest_dir).st_mtime
+    except OSError:
+        return 0
+
+
+def segna_accesso(dest_dir):
+    """Anteprima, download, stampa: il batch diventa il più recente per l'LRU."""
+    try:
+        os.utime(dest_dir)
+    except OSError:
+        pass
+
+
+def secondi_alla_scadenza(dest_dir, scadenza_secondi, now=None):
+    """Secondi che mancano alla rimozione del batch da parte del timer di pulizia, 0 se scaduto.
+
+    La scadenza conta dall'ultimo accesso, non dalla fine della generazione; un
+    ritentativo o una correzione in corso la rimandano di scadenza_secondi.
+    """
+    restanti = ultimo_accesso(dest_dir) + scadenza_secondi - (now or time.time())
+    if restanti <= 0 and _in_lavoro(dest_dir):
+        return scadenza_secondi
+    return max(0, restanti)
+
+
+def spazio_per_stato(elenco):
+    """Byte occupati per stato (tutti gli stati, anche a 0) da un elenco di batch()."""
+    spazio = dict.fromkeys((STATO_IN_GENERAZIONE, STATO_CONCLUSO, STATO_ARCHIVIATO, STATO_ORFANO), 0)
+    for b in elenco:
+        spazio[b['stato']] += b['byte']
+    return spazio
+
+
+def batch(root):
+    """[{'id', 'path', 'stato', 'byte', 'accesso'}] per ogni cartella di batch in root."""
+    try:
+        entries = [e for e in os.scandir(root) if e.is_dir(follow_symlinks=False)]
+    except OSError:
+        return []
+    return [{'id': e.name, 'path': e.path, 'stato': stato_batch(e.path),
+             'byte': metrics.directory_size(e.path), 'accesso': ultimo_accesso(e.path)}
+            for e in entries]
+
+
+def libera_spazio(root, necessario_mb, quota_mb=0, min_libero_mb=0, escludi=()):
+    """Rimuove batch conclusi (LRU, prima gli archiviati) finché un nuovo batch di
+    necessario_mb entra nella quota e lascia min_libero_mb liberi sul disco.
+
+    Restituisce gli id rimossi; se non basta, il controllo di ammissione rifiuterà il batch.
+    """
+    def manca():
+        if quota_mb and uso / 1024 / 1024 + necessario_mb > quota_mb:
+            return True
+        return bool(min_libero_mb) and disco_libero_mb(root) < min_libero_mb + necessario_mb
+
+    elenco = batch(root)
+    uso = sum(b['byte'] for b in elenco)
+    candidati = sorted((b for b in elenco if b['stato'] in (STATO_CONCLUSO, STATO_ARCHIVIATO)
+                        and b['id'] not in escludi and not _in_lavoro(b['path'])),
+                       key=lambda b: (b['stato'] != STATO_ARCHIVIATO, b['accesso']))
+    rimossi = []
+    for b in candidati:
+        if not manca():
+            break
+        shutil.rmtree(b['path'], ignore_errors=True)
+        uso -= b['byte']
+        rimossi.append(b['id'])
+    return rimossi
+
+
+def spazza(root, scadenza_secondi, now=None):
+    """Pulizia all'avvio: (rimossi, [(id, secondi_restanti)] dei batch conclusi ancora validi).
+
+    I batch in generazione restano: li riprende app.riprendi_batch_interrotti.
+    """
+    now = now or time.time()
+    rimossi, da_programmare = [], []
+    for b in batch(root):
+        eta = now - b['accesso']
+        if b['stato'] == STATO_ORFANO and eta > ETA_MINIMA_ORFANI:
+            shutil.rmtree(b['path'], ignore_errors=True)
+            rimossi.append(b['id'])
+        elif b['stato'] in (STATO_CONCLUSO, STATO_ARCHIVIATO):
+            if eta >= scadenza_secondi:
+                shutil.rmtree(b['path'], ignore_errors=True)
+                rimossi.append(b['id'])
+            else:
+                da_programmare.append((b['id'], scadenza_secondi - eta))
+    return rimossi, da_programmare
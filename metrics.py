@@ -0,0 +1,257 @@
+# --- METRICHE (formato testo Prometheus) ---
+# Registro minimale senza dipendenze esterne: istogrammi, contatori e gauge con etichette,
+# esposti dalla rotta /metrics di app.py.
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket in secondi: da pochi millisecondi (render Jinja) a minuti (merge di batch grandi)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: etichette attese {self.labelnames}, ricevute {tuple(labels)}")
+        return tuple(str(labels[k]) for k in self.labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            serie = self._series.get(key)
+            if serie is None:
+                serie = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    serie['counts'][i] += 1
+            serie['sum'] += value
+            serie['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: {'counts': list(v['counts']), 'sum': v['sum'], 'count': v['count']} for k, v in self._series.items()}
+        for key, serie in sorted(series.items()):
+            for upper, cumulative in zip(self.buckets, serie['counts']):
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(upper)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, ('le', '+Inf'))
+            lines.append(f"{self.name}_bucket{labels} {serie['count']}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(serie['sum'])}")
+            lines.append(f"{self.name}_count{labels} {serie['count']}")
+        return lines
+
+
+class Gauge:
+    tipo = 'gauge'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = None
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: etichette attese {self.labelnames}, ricevute {tuple(labels)}")
+        return tuple(str(labels[k]) for k in self.labelnames)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, func):
+        """Il valore viene calcolato al momento della lettura di /metrics.
+
+        func restituisce un numero (gauge senza etichette) oppure un dict
+        {tupla_valori_etichette: numero}.
+        """
+        self._function = func
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.tipo}"]
+        if self._function is not None:
+            result = self._function()
+            values = result if isinstance(result, dict) else {(): result}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Gauge):
+    """Valore che può solo crescere (per processo); per convenzione il nome finisce in _total."""
+    tipo = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError(f"{self.name}: un contatore non può diminuire")
+        super().inc(amount, **labels)
+
+
+class CacheStats:
+    """Contatori hit/miss condivisi dalle cache di rendering."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def aggiungi(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, func):
+        """func() viene chiamata una volta a ogni lettura, prima delle metriche:
+        aggiorna con set() più gauge ricavate dalla stessa misura."""
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# --- ISTOGRAMMI PER FASE ---
+PARSE_SECONDS = REGISTRY.register(Histogram(
+    'generatore_parse_seconds', 'Tempo di lettura e parsing del file dati caricato'))
+PREFLIGHT_SECONDS = REGISTRY.register(Histogram(
+    'generatore_preflight_seconds', 'Tempo della verifica preliminare del file dati'))
+JINJA_RENDER_SECONDS = REGISTRY.register(Histogram(
+    'generatore_jinja_render_seconds', 'Tempo di rendering Jinja per documento',
+    ('documento', 'modulo')))
+WEASYPRINT_LAYOUT_SECONDS = REGISTRY.register(Histogram(
+    'generatore_weasyprint_layout_seconds', 'Tempo di impaginazione WeasyPrint per documento',
+    ('documento', 'modulo')))
+WEASYPRINT_WRITE_SECONDS = REGISTRY.register(Histogram(
+    'generatore_weasyprint_write_seconds', 'Tempo di scrittura PDF WeasyPrint per documento',
+    ('documento', 'modulo')))
+MERGE_SECONDS = REGISTRY.register(Histogram(
+    'generatore_merge_seconds', 'Tempo di creazione dei PDF cumulativi', ('tipo',)))
+ZIP_SECONDS = REGISTRY.register(Histogram(
+    'generatore_zip_seconds', 'Tempo di creazione degli ZIP', ('tipo',)))
+ARCHIVE_COPY_SECONDS = REGISTRY.register(Histogram(
+    'generatore_archive_copy_seconds', 'Tempo di copia dello ZIP negli archivi', ('destinazione',)))
+EXCEL_APPEND_SECONDS = REGISTRY.register(Histogram(
+    'generatore_excel_append_seconds', 'Tempo di aggiornamento del registro Excel'))
+
+# --- CONTATORI ---
+BATCH_RIFIUTATI = REGISTRY.register(Counter(
+    'generatore_batch_rifiutati_total', 'Batch rifiutati dal controllo di ammissione', ('motivo',)))
+
+# --- GAUGE ---
+ACTIVE_BATCHES = REGISTRY.register(Gauge(
+    'generatore_active_batches', 'Batch attivi per stato', ('stato',)))
+TEMP_DISK_USAGE_BYTES = REGISTRY.register(Gauge(
+    'generatore_temp_disk_usage_bytes', 'Spazio occupato dalle cartelle temporanee dei batch'))
+BATCH_DISK_USAGE_BYTES = REGISTRY.register(Gauge(
+    'generatore_batch_disk_usage_bytes', 'Spazio occupato dalle cartelle dei batch per stato', ('stato',)))
+RENDER_CACHE = CacheStats()
+RENDER_CACHE_HIT_RATIO = REGISTRY.register(Gauge(
+    'generatore_render_cache_hit_ratio', 'Rapporto hit/(hit+miss) delle cache di rendering'))
+RENDER_CACHE_HIT_RATIO.set_function(RENDER_CACHE.ratio)
+
+
+def percentile(values, q):
+    """Percentile q (0-100) con interpolazione lineare, come numpy.percentile."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    pos = (len(ordered) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def directory_size(path):
+    total = 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+                elif entry.is_dir(follow_symlinks=False):
+                    total += directory_size(entry.path)
+    except OSError:
+        pass
+    return total
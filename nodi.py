@@ -0,0 +1,296 @@
+# --- RENDER SU PIÙ NODI ---
+# Modalità opzionale coordinatore/worker per i picchi di lauree:
+#   - nodo di render: `python -m generatore nodo --porta 8101 --workers 8`, un server HTTP
+#     con lo stesso codice, template e asset statici; ogni richiesta POST /render è un
+#     blocco di record, renderizzati nel suo pool di processi (con watchdog e ritentativi
+#     come in locale). La risposta è uno ZIP con esiti.json e i PDF di ogni record.
+#   - coordinatore: l'app con RENDER_NODI = ["http://host:8101", ...]. Lo scheduler usa
+#     EsecutoreRemoto al posto del pool di processi locale: i record assegnati agli slot
+#     vengono raccolti in blocchi di RENDER_NODO_BLOCCO e inviati al primo nodo libero
+#     (due blocchi in volo per nodo: mentre uno è in render l'altro viaggia). I PDF
+#     ricevuti finiscono nella cartella del batch e l'esito torna allo scheduler, che
+#     prosegue come in locale (manifest, merge in ordine, archivio).
+# Un nodo che non risponde viene messo in pausa e il blocco passa a un altro nodo; dopo
+# un tentativo per nodo i record vanno in ERRORE ("Ritenta errori" dall'anteprima).
+# Il nodo non ha autenticazione: va esposto solo sulla rete interna (default 127.0.0.1).
+# Per provarlo su una sola macchina bastano più nodi su porte diverse.
+import io
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import urllib.request
+import zipfile
+from concurrent.futures import Future, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import engine
+import watchdog_record
+from tabella import TabellaStudenti
+
+logger = logging.getLogger('generatore.nodi')
+
+ESITI_FILENAME = 'esiti.json'
+# Secondi di pausa di un nodo dopo un errore di comunicazione
+PAUSA_NODO_GUASTO = 10
+_FINE = object()
+
+
+# --- LATO NODO ---
+class NodoRender:
+    """Pool di processi persistente del nodo: render_blocco rende un blocco di record."""
+
+    def __init__(self, workers, con_warmup=True):
+        self.workers = max(1, workers)
+        self.con_warmup = con_warmup
+        self._lock = threading.Lock()
+        self._pool = engine.crea_pool_render(self.workers, con_warmup)
+
+    def chiudi(self):
+        self._pool.shutdown(wait=True)
+
+    def _ricrea(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                pool.shutdown(wait=False)
+                self._pool = engine.crea_pool_render(self.workers, self.con_warmup)
+            return self._pool
+
+    def _submit(self, *args):
+        pool = self._pool
+        try:
+            return pool, pool.submit(engine.render_record, *args)
+        except BrokenProcessPool:
+            pool = self._ricrea(pool)
+            return pool, pool.submit(engine.render_record, *args)
+
+    def render_blocco(self, voci, base_url, dest_dir):
+        """Esiti nell'ordine di voci; i PDF della voce n in dest_dir/n.
+
+        Come nel pool locale, un processo morto viene ricreato e il record
+        riprovato (o chiuso in TIMEOUT se l'ha terminato il watchdog mentre lo rendeva).
+        """
+        esiti = [None] * len(voci)
+        tentativi = {}
+        da_fare = list(range(len(voci)))
+        while da_fare:
+            futures = {}
+            for n in da_fare:
+                voce = voci[n]
+                cartella = os.path.join(dest_dir, str(n))
+                os.makedirs(cartella, exist_ok=True)
+                pool, future = self._submit(voce['indice'], voce['studente'], cartella, base_url,
+                                            voce['profilo'], voce['template'], voce['budget'])
+                futures[future] = (n, pool)
+            da_fare = []
+            marcatori = {}
+            for future in as_completed(futures):
+                n, pool = futures[future]
+                try:
+                    esiti[n] = future.result()
+                except BrokenProcessPool as e:
+                    self._ricrea(pool)
+                    if pool not in marcatori:
+                        marcatori[pool] = watchdog_record.marcatori_presenti(
+                            (os.path.join(dest_dir, str(m)), voci[m]['indice'])
+                            for m, p in futures.values() if p is pool)
+                    esito = engine.esito_interrotto(voci[n]['indice'], voci[n]['studente'],
+                                                    os.path.join(dest_dir, str(n)), e, tentativi, marcatori[pool])
+                    if esito is None:
+                        da_fare.append(n)
+                    else:
+                        esiti[n] = esito
+        return esiti
+
+
+def _voce_da_json(voce):
+    return {'indice': voce['indice'], 'studente': TabellaStudenti.da_record([voce['studente']])[0],
+            'profilo': voce.get('profilo', False), 'template': voce.get('template'), 'budget': voce.get('budget')}
+
+
+def zip_blocco(esiti, dest_dir):
+    """Risposta del nodo: esiti.json più i file di ogni voce (n/nome)."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zf:
+        zf.writestr(ESITI_FILENAME, json.dumps(esiti))
+        for n in range(len(esiti)):
+            cartella = os.path.join(dest_dir, str(n))
+            for nome in sorted(os.listdir(cartella)):
+                # I PDF sono già compressi: ZIP_STORED, nessun costo di CPU
+                zf.write(os.path.join(cartella, nome), arcname=f'{n}/{nome}')
+    return buffer.getvalue()
+
+
+class _GestoreNodo(BaseHTTPRequestHandler):
+    nodo = None
+
+    def _rispondi(self, codice, corpo, content_type='application/json'):
+        self.send_response(codice)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def do_GET(self):
+        if self.path != '/stato':
+            return self._rispondi(404, b'{"errore": "non trovato"}')
+        self._rispondi(200, json.dumps({'workers': self.nodo.workers}).encode())
+
+    def do_POST(self):
+        if self.path != '/render':
+            return self._rispondi(404, b'{"errore": "non trovato"}')
+        try:
+            richiesta = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            voci = [_voce_da_json(v) for v in richiesta['voci']]
+        except (ValueError, KeyError, TypeError) as e:
+            return self._rispondi(400, json.dumps({'errore': f"richiesta non valida: {e}"}).encode())
+        dest_dir = tempfile.mkdtemp(prefix='nodo_')
+        try:
+            esiti = self.nodo.render_blocco(voci, richiesta.get('base_url', engine.DEFAULT_BASE_URL), dest_dir)
+            corpo = zip_blocco(esiti, dest_dir)
+        except Exception as e:
+            logger.exception("Errore nel render del blocco")
+            return self._rispondi(500, json.dumps({'errore': str(e)}).encode())
+        finally:
+            shutil.rmtree(dest_dir, ignore_errors=True)
+        self._rispondi(200, corpo, 'application/zip')
+
+    def log_message(self, formato, *args):
+        logger.info("%s %s", self.address_string(), formato % args)
+
+
+def avvia_nodo(host, porta, workers, con_warmup=True):
+    """Server HTTP del nodo di render (bloccante fino a KeyboardInterrupt)."""
+    nodo = NodoRender(workers, con_warmup)
+    gestore = type('GestoreNodo', (_GestoreNodo,), {'nodo': nodo})
+    server = ThreadingHTTPServer((host, porta), gestore)
+    logger.info("Nodo di render su http://%s:%d (%d processi)", host, porta, nodo.workers)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        nodo.chiudi()
+
+
+# --- LATO COORDINATORE ---
+class _Richiesta:
+    __slots__ = ('future', 'indice', 'studente', 'dest_dir', 'base_url', 'profilo', 'template', 'budget',
+                 'tentativi')
+
+    def __init__(self, future, indice, studente, dest_dir, base_url, profilo, template, budget):
+        self.future = future
+        self.indice = indice
+        self.studente = studente
+        self.dest_dir = dest_dir
+        self.base_url = base_url
+        self.profilo = profilo
+        self.template = template
+        self.budget = budget
+        self.tentativi = 0
+
+    def a_json(self):
+        return {'indice': self.indice, 'studente': dict(self.studente), 'profilo': self.profilo,
+                'template': self.template, 'budget': self.budget}
+
+
+class EsecutoreRemoto:
+    """Al posto del ProcessPoolExecutor dello scheduler: submit(engine.render_record, ...)
+    restituisce un Future risolto quando il nodo ha reso il record e i suoi PDF sono
+    nella cartella del batch."""
+
+    def __init__(self, nodi, blocco=8, connessioni=2, timeout=600):
+        self.nodi = list(nodi)
+        self.blocco = max(1, blocco)
+        self.timeout = timeout
+        self._coda = queue.Queue()
+        self._fermo = threading.Event()
+        self._threads = [threading.Thread(target=self._lavora, args=(nodo,), name=f'nodo-{nodo}', daemon=True)
+                         for nodo in self.nodi for _ in range(connessioni)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, funzione, indice, studente, dest_dir, base_url=engine.DEFAULT_BASE_URL, profilo=False,
+               template=None, budget=None):
+        if funzione is not engine.render_record:
+            raise ValueError("I nodi di render eseguono solo engine.render_record")
+        future = Future()
+        self._coda.put(_Richiesta(future, indice, studente, dest_dir, base_url, profilo, template, budget))
+        return future
+
+    def shutdown(self, wait=True):
+        self._fermo.set()
+        self._coda.put(_FINE)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _preleva(self):
+        # Un blocco: attende il primo record, poi prende quelli già in coda fino a blocco
+        primo = self._coda.get()
+        if primo is _FINE:
+            self._coda.put(_FINE)
+            return None
+        richieste = [primo]
+        while len(richieste) < self.blocco:
+            try:
+                richiesta = self._coda.get_nowait()
+            except queue.Empty:
+                break
+            if richiesta is _FINE:
+                self._coda.put(_FINE)
+                break
+            richieste.append(richiesta)
+        return richieste
+
+    def _lavora(self, nodo):
+        while not self._fermo.is_set():
+            richieste = self._preleva()
+            if richieste is None:
+                return
+            try:
+                self._invia(nodo, richieste)
+            except Exception as e:
+                # Rete, risposta HTTP troncata (http.client.IncompleteRead), ZIP o esiti non validi:
+                # i record non ancora risolti tornano in coda, il thread resta vivo e il nodo va in pausa
+                logger.warning("Nodo %s non disponibile (%r): %d record a un altro nodo", nodo, e, len(richieste))
+                for richiesta in richieste:
+                    self._riprova(richiesta, e)
+                self._fermo.wait(PAUSA_NODO_GUASTO)
+
+    def _riprova(self, richiesta, errore):
+        if richiesta.future.done():
+            return
+        richiesta.tentativi += 1
+        if richiesta.tentativi <= len(self.nodi):
+            self._coda.put(richiesta)
+        else:
+            richiesta.future.set_exception(errore)
+
+    def _invia(self, nodo, richieste):
+        corpo = json.dumps({'base_url': richieste[0].base_url, 'voci': [r.a_json() for r in richieste]}).encode()
+        http_richiesta = urllib.request.Request(nodo.rstrip('/') + '/render', data=corpo, method='POST',
+                                                headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(http_richiesta, timeout=self.timeout) as risposta:
+            contenuto = risposta.read()
+        with zipfile.ZipFile(io.BytesIO(contenuto)) as zf:
+            esiti = json.loads(zf.read(ESITI_FILENAME))
+            if len(esiti) != len(richieste):
+                raise ValueError(f"{len(esiti)} esiti per {len(richieste)} record")
+            for n, (richiesta, esito) in enumerate(zip(richieste, esiti)):
+                for membro in zf.namelist():
+                    cartella, _, nome = membro.partition('/')
+                    if cartella == str(n) and nome:
+                        _scrivi(zf, membro, os.path.join(richiesta.dest_dir, os.path.basename(nome)))
+                richiesta.future.set_result(esito)
+
+
+def _scrivi(zf, membro, dest):
+    # Nome temporaneo e os.replace, come per gli altri file del batch
+    tmp = dest + '.tmp'
+    with zf.open(membro) as src, open(tmp, 'wb') as f:
+        shutil.copyfileobj(src, f)
+    os.replace(tmp, dest)
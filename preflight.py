@@ -0,0 +1,152 @@
+# --- VERIFICA PRELIMINARE DEL BATCH ---
+# Controlli sull'intero file dati prima di qualsiasi render: modulo sconosciuto o
+# senza template, immagini di firma assenti in static/imglib, NOM_COG vuoto,
+# DATALAUR malformata, PROTOCOL senza '/'.
+# Le colonne vengono lette direttamente dalla TabellaStudenti; ogni controllo
+# valuta i valori distinti della colonna contro insiemi precalcolati (registro dei
+# template, file presenti in imglib) e riporta le righe che li contengono.
+import os
+import re
+import time
+from datetime import datetime
+
+import engine
+import metrics
+
+IMGLIB_DIR = os.path.join(engine.STATIC_DIR, 'imglib')
+
+LIVELLO_ERRORE = 'errore'
+LIVELLO_AVVISO = 'avviso'
+
+_DATALAUR_RE = re.compile(r'^(\d{4}|\d{2}/\d{2}/\d{4})$')
+
+# Elenchi di cartella per mtime: si rileggono solo se la cartella cambia
+_elenchi = {}
+
+
+def _file_in_cartella(path):
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    voce = _elenchi.get(path)
+    if voce is None or voce[0] != mtime:
+        with os.scandir(path) as it:
+            voce = _elenchi[path] = (mtime, frozenset(e.name for e in it if e.is_file()))
+    return voce[1]
+
+
+def colonne(students_data):
+    """Vista per colonna dei record: {colonna: [valore di ogni riga]}."""
+    return {nome: students_data.colonna(nome) for nome in students_data.colonne.nomi}
+
+
+def _righe_per_valore(valori):
+    indice = {}
+    for i, valore in enumerate(valori):
+        indice.setdefault(valore, []).append(i)
+    return indice
+
+
+def _datalaur_valida(valore):
+    if not _DATALAUR_RE.match(valore):
+        return False
+    if '/' in valore:
+        try:
+            datetime.strptime(valore, '%d/%m/%Y')
+        except ValueError:
+            return False
+    return True
+
+
+def verifica(students_data):
+    """Report completo dei problemi del batch, senza generare nulla.
+
+    Restituisce {'record', 'problemi', 'errori', 'avvisi', 'durata_ms'}; ogni
+    problema ha livello, controllo, campo, valore, messaggio e righe (indici da 0).
+    Gli errori producono diplomi sbagliati o mancanti; gli avvisi segnalano
+    dati sospetti (es. modulo sconosciuto: il record verrebbe saltato).
+    """
+    with metrics.PREFLIGHT_SECONDS.time():
+        return _verifica(students_data)
+
+
+def _verifica(students_data):
+    t0 = time.perf_counter()
+    viste = colonne(students_data)
+    problemi = []
+
+    def segnala(livello, controllo, campo, valore, messaggio, righe):
+        problemi.append({'livello': livello, 'controllo': controllo, 'campo': campo, 'valore': valore,
+                         'messaggio': messaggio, 'righe': righe})
+
+    # Insiemi di riferimento
+    template_presenti = _file_in_cartella(engine.TEMPLATES_DIR) or frozenset()
+    immagini_presenti = _file_in_cartella(IMGLIB_DIR)
+
+    # Modulo: nel registro e con il template su disco
+    for modulo, righe in _righe_per_valore([m.strip() for m in viste.get('MODULO', [])]).items():
+        template = engine.TEMPLATE_REGISTRY.get(modulo)
+        if template is None:
+            segnala(LIVELLO_AVVISO, 'modulo_sconosciuto', 'MODULO', modulo,
+                    f"Modulo '{modulo}' non presente nel registro: il record verrà saltato", righe)
+        elif template not in template_presenti:
+            segnala(LIVELLO_ERRORE, 'template_mancante', 'MODULO', modulo,
+                    f"Template '{template}' del modulo '{modulo}' non trovato", righe)
+
+    # Immagini di firme e loghi in static/imglib
+    campi_immagine = [c for c in viste if c.lower() in engine.CAMPI_IMMAGINE]
+    if campi_immagine and immagini_presenti is None:
+        segnala(LIVELLO_ERRORE, 'imglib_mancante', '', '', f"Cartella {IMGLIB_DIR} non trovata", [])
+    elif campi_immagine:
+        for campo in campi_immagine:
+            for valore, righe in _righe_per_valore([v.strip() for v in viste[campo]]).items():
+                if not valore:
+                    continue
+                nome_file = valore if valore.endswith('.png') else f'{valore}.png'
+                if nome_file not in immagini_presenti:
+                    segnala(LIVELLO_ERRORE, 'immagine_mancante', campo, valore,
+                            f"Immagine '{nome_file}' non presente in static/imglib", righe)
+
+    # NOM_COG vuoto
+    if 'NOM_COG' in viste:
+        righe = [i for i, v in enumerate(viste['NOM_COG']) if not v.strip()]
+        if righe:
+            segnala(LIVELLO_ERRORE, 'nome_vuoto', 'NOM_COG', '', "Nome e cognome vuoto", righe)
+    else:
+        segnala(LIVELLO_ERRORE, 'colonna_mancante', 'NOM_COG', '', "Colonna NOM_COG assente", [])
+
+    # DATALAUR: anno (AAAA) o data (GG/MM/AAAA)
+    for valore, righe in _righe_per_valore([v.strip() for v in viste.get('DATALAUR', [])]).items():
+        if not _datalaur_valida(valore):
+            segnala(LIVELLO_AVVISO, 'datalaur_malformata', 'DATALAUR', valore,
+                    f"DATALAUR '{valore}' non è un anno (AAAA) o una data (GG/MM/AAAA)", righe)
+
+    # PROTOCOL nella forma numero/progressivo
+    righe = [i for i, v in enumerate(viste.get('PROTOCOL', [])) if '/' not in v]
+    if righe:
+        segnala(LIVELLO_AVVISO, 'protocollo_senza_barra', 'PROTOCOL', '',
+                "PROTOCOL senza '/' (atteso numero/progressivo)", righe)
+
+    problemi.sort(key=lambda p: (p['livello'] != LIVELLO_ERRORE, p['righe'][0] if p['righe'] else 0))
+    return {
+        'record': len(students_data),
+        'problemi': problemi,
+        'errori': sum(1 for p in problemi if p['livello'] == LIVELLO_ERRORE),
+        'avvisi': sum(1 for p in problemi if p['livello'] == LIVELLO_AVVISO),
+        'durata_ms': (time.perf_counter() - t0) * 1000,
+    }
+
+
+def testo_report(report, students_data=None):
+    """Report leggibile (riga di comando, file .errore.txt della inbox, risposta 400)."""
+    righe = [f"Verifica preliminare: {report['record']} record, {report['errori']} errori, "
+             f"{report['avvisi']} avvisi ({report['durata_ms']:.1f} ms)"]
+    for p in report['problemi']:
+        dove = ''
+        if p['righe']:
+            dove = ' - righe ' + ', '.join(str(i + 1) for i in p['righe'][:10]) + (' ...' if len(p['righe']) > 10 else '')
+            if students_data and len(p['righe']) <= 3:
+                dove += ' (' + ', '.join(students_data[i].get('NOM_COG', '') or '?' for i in p['righe']) + ')'
+        righe.append(f"{p['livello'].upper()}: {p['messaggio']}{dove}")
+    return '\n'.join(righe)
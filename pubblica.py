@@ -0,0 +1,93 @@
+# --- PUBBLICAZIONE DEI FILE ---
+# Copia "a costo zero" dalla cartella del batch verso Da_Stampare e gli archivi:
+#   1. reflink (copy-on-write, Btrfs/XFS): nessun byte copiato, file indipendenti
+#   2. hard link sullo stesso filesystem: stesso inode, nessun byte copiato
+#      (solo per Da_Stampare: archivi e deposito vogliono file indipendenti)
+#   3. copia bufferizzata (shutil.copyfile) tra dispositivi diversi
+# Il file viene preparato con un nome temporaneo nascosto nella cartella di
+# destinazione e reso visibile con os.replace: chi osserva la cartella vede il file
+# completo o non lo vede.
+# Il hard link è sicuro perché i file del batch non vengono mai riscritti sul posto
+# (merge, sostituisci_pagine e integra_esiti scrivono un nuovo file e usano os.replace).
+import errno
+import logging
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger('generatore.pubblica')
+
+# ioctl FICLONE di Linux (linux/fs.h)
+FICLONE = 0x40049409
+
+MODO_REFLINK = 'reflink'
+MODO_HARDLINK = 'hardlink'
+MODO_COPIA = 'copia'
+
+# Errori che indicano "non supportato qui": si passa al metodo successivo
+_NON_SUPPORTATO = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EINVAL, errno.ENOTTY,
+                   errno.EOPNOTSUPP, errno.ENOSYS, errno.EBADF}
+
+
+def _reflink(src, tmp):
+    import fcntl
+    with open(src, 'rb') as s, open(tmp, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def _temporaneo(dest):
+    cartella, nome = os.path.split(dest)
+    return os.path.join(cartella, f".{nome}.{uuid.uuid4().hex[:8]}.tmp")
+
+
+def pubblica(src, dest, hardlink=True):
+    """Rende visibile in dest il contenuto di src; restituisce il metodo usato.
+
+    hardlink=False per destinazioni che non devono condividere l'inode con src
+    (archivi e blob del deposito: devono sopravvivere alla cartella del batch).
+    """
+    tmp = _temporaneo(dest)
+    tentativi = [(MODO_REFLINK, _reflink)]
+    if hardlink:
+        tentativi.append((MODO_HARDLINK, os.link))
+    try:
+        for modo, funzione in tentativi:
+            try:
+                funzione(src, tmp)
+            except (OSError, ImportError) as e:
+                if isinstance(e, OSError) and e.errno not in _NON_SUPPORTATO:
+                    raise
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                continue
+            break
+        else:
+            modo = MODO_COPIA
+            shutil.copyfile(src, tmp)
+        if modo != MODO_HARDLINK:
+            shutil.copystat(src, tmp)
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    logger.debug("%s -> %s (%s)", src, dest, modo)
+    return modo
+
+
+@contextmanager
+def nuova_cartella(dest_dir):
+    """Cartella temporanea nascosta da riempire; alla fine diventa dest_dir.
+
+    dest_dir compare già completa (os.rename): l'operatore non vede mai una
+    cartella di stampa a metà. In caso di errore la cartella temporanea sparisce.
+    """
+    tmp_dir = _temporaneo(dest_dir)
+    os.makedirs(tmp_dir)
+    try:
+        yield tmp_dir
+        os.rename(tmp_dir, dest_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
@@ -0,0 +1,370 @@
+# --- SCHEDULER DEI BATCH ---
+# Un solo pool di processi di render ("slot") condiviso da tutti i batch caricati:
+# il numero di slot è il tetto globale di render contemporanei.
+# I record vengono assegnati agli slot uno alla volta scegliendo il batch con:
+#   1. classe di priorità migliore (urgente < piccolo < normale)
+#   2. facoltà con meno record in corso (equa ripartizione tra uffici)
+#   3. facoltà servita meno di recente
+#   4. ordine di arrivo
+# I record conclusi passano, attraverso una coda limitata, allo stadio di merge del
+# batch (un thread con engine.MergeIncrementale): i PDF cumulativi crescono mentre
+# gli altri record sono in render. Un batch riceve nuovi slot solo se la sua coda
+# di merge ha posto per i record in volo: se il merge rallenta, rallenta il render
+# di quel batch e non la memoria. Quando tutti i record sono pronti, scrittura dei
+# cumulativi e log (engine.concludi_batch) girano in un thread separato, senza
+# fermare l'assegnazione degli slot.
+# Ogni record concluso viene annotato nel manifest del batch (engine.registra_esito):
+# un job ricreato dopo un riavvio riceve gli esiti già pronti e rigenera solo gli altri.
+# Un job può limitarsi ad alcuni record (indici) e concludersi con una funzione
+# propria: è il caso del ritentativo dei record in ERRORE dall'anteprima.
+# Con crea_pool gli slot possono essere serviti da altro che il pool di processi
+# locale (nodi.EsecutoreRemoto: render su altre macchine).
+import itertools
+import logging
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import engine
+import watchdog_record
+
+logger = logging.getLogger('generatore.scheduler')
+
+CLASSE_URGENTE = 0
+CLASSE_PICCOLO = 1
+CLASSE_NORMALE = 2
+NOMI_CLASSE = {CLASSE_URGENTE: 'urgente', CLASSE_PICCOLO: 'piccolo', CLASSE_NORMALE: 'normale'}
+
+STATO_IN_CODA = 'in_coda'
+STATO_IN_CORSO = 'in_corso'
+STATO_COMPLETATO = 'completato'
+STATO_ERRORE = 'errore'
+
+_FINE = object()
+
+
+class Stadio:
+    """Thread che applica funzione agli elementi di una coda limitata, nell'ordine di arrivo.
+
+    metti() blocca se la coda è piena; al_consumo viene chiamata dopo ogni
+    elemento (per risvegliare chi aspetta posto). Un errore della funzione ferma
+    l'elaborazione (gli elementi successivi vengono scartati) e viene rilanciato da chiudi().
+    """
+
+    def __init__(self, nome, funzione, capacita, al_consumo=None):
+        self.funzione = funzione
+        self.capacita = capacita
+        self.al_consumo = al_consumo
+        self.errore = None
+        self._coda = queue.Queue(maxsize=capacita)
+        self._thread = threading.Thread(target=self._esegui, name=nome, daemon=True)
+        self._thread.start()
+
+    def metti(self, elemento):
+        self._coda.put(elemento)
+
+    def in_coda(self):
+        # Elementi ricevuti e non ancora elaborati (compreso quello in corso)
+        return self._coda.unfinished_tasks
+
+    def chiudi(self):
+        self._coda.put(_FINE)
+        self._thread.join()
+        if self.errore is not None:
+            raise self.errore
+
+    def _esegui(self):
+        while True:
+            elemento = self._coda.get()
+            try:
+                if elemento is _FINE:
+                    return
+                if self.errore is None:
+                    self.funzione(elemento)
+            except Exception as e:
+                logger.exception("Errore nello stadio %s", self._thread.name)
+                self.errore = e
+            finally:
+                self._coda.task_done()
+                if self.al_consumo:
+                    self.al_consumo()
+
+
+def classe_batch(urgente, totale, soglia_piccoli):
+    if urgente:
+        return CLASSE_URGENTE
+    return CLASSE_PICCOLO if totale <= soglia_piccoli else CLASSE_NORMALE
+
+
+class Job:
+    def __init__(self, batch_id, facolta, students_data, dest_dir, nome_cartella,
+                 on_complete, urgente=False, profilo=False, gia_conclusi=None,
+                 indici=None, template=None, concludi=None, budget=None, rivendicazione=None):
+        self.batch_id = batch_id
+        self.facolta = facolta
+        self.students_data = students_data
+        self.dest_dir = dest_dir
+        self.nome_cartella = nome_cartella
+        self.on_complete = on_complete
+        self.urgente = urgente
+        self.profilo = profilo
+        self.template = template
+        self.budget = budget
+        self.tentativi = {}
+        self.concludi = concludi
+        # fd di engine.rivendica_batch: rilasciato quando il batch è concluso
+        self.rivendicazione = rivendicazione
+        self.indici = list(range(len(students_data))) if indici is None else list(indici)
+        self.totale = len(self.indici)
+        self.esiti = dict(gia_conclusi or {})
+        self.da_fare = [i for i in self.indici if i not in self.esiti]
+        self.prossimo = 0
+        self.in_volo = 0
+        self.completati = len(self.esiti)
+        self.stato = STATO_IN_CODA
+        self.messaggio = ''
+        # Stadio di merge incrementale (solo per la generazione completa del batch)
+        self.merge = None
+        self.stadio_merge = None
+        self.classe = CLASSE_NORMALE
+        self.sequenza = 0
+        self.t_inizio = None
+
+    @property
+    def da_assegnare(self):
+        return self.prossimo < len(self.da_fare)
+
+
+class RenderScheduler:
+    def __init__(self, slots, soglia_piccoli=20, base_url=engine.DEFAULT_BASE_URL, con_warmup=True, budget=None,
+                 crea_pool=engine.crea_pool_render):
+        self.slots = max(1, slots)
+        self.crea_pool = crea_pool
+        self.budget = budget
+        self.soglia_piccoli = soglia_piccoli
+        self.base_url = base_url
+        self.con_warmup = con_warmup
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self._sequenza = itertools.count()
+        self._turno = itertools.count()
+        self._in_volo = 0
+        self._in_volo_facolta = {}
+        self._ultimo_servizio = {}
+        self._pool = None
+        # Record (dest_dir, indice) in corso su ogni pool, e marcatori del watchdog di un pool rotto
+        self._record_sul_pool = weakref.WeakKeyDictionary()
+        self._marcatori_rottura = weakref.WeakKeyDictionary()
+        self._finalizzatori = ThreadPoolExecutor(max_workers=2, thread_name_prefix='concludi-batch')
+        self._dispatcher = None
+        self._fermo = False
+
+    # --- CICLO DI VITA ---
+    def avvia(self):
+        """Crea il pool (con warm-up di WeasyPrint nei processi) e il thread di assegnazione."""
+        with self._cond:
+            if self._dispatcher is not None:
+                return
+            self._pool = self.crea_pool(self.slots, self.con_warmup)
+            self._dispatcher = threading.Thread(target=self._assegna, name='scheduler-render', daemon=True)
+            self._dispatcher.start()
+
+    def ferma(self):
+        with self._cond:
+            self._fermo = True
+            self._cond.notify_all()
+        if self._dispatcher:
+            self._dispatcher.join()
+        if self._pool:
+            self._pool.shutdown(wait=True)
+        self._finalizzatori.shutdown(wait=True)
+
+    # --- API ---
+    def submit(self, job):
+        self.avvia()
+        if job.concludi is None:
+            job.merge = engine.MergeIncrementale(job.dest_dir, job.nome_cartella, job.indici)
+            # Posto per un giro di slot in volo più uno in attesa di merge
+            job.stadio_merge = Stadio(f'merge-{job.batch_id}', job.merge.aggiungi, 2 * self.slots,
+                                      al_consumo=self._risveglia)
+            for indice in sorted(job.esiti):
+                job.stadio_merge.metti(job.esiti[indice])
+        with self._cond:
+            job.sequenza = next(self._sequenza)
+            job.classe = classe_batch(job.urgente, job.totale, self.soglia_piccoli)
+            self._jobs[job.batch_id] = job
+            self._cond.notify_all()
+        if job.completati == job.totale:
+            # Batch ripreso con tutti i record già pronti: mancano solo merge e log
+            job.stato = STATO_IN_CORSO
+            job.t_inizio = time.perf_counter()
+            self._finalizzatori.submit(self._concludi, job)
+        return job
+
+    def _davanti(self, job):
+        # Batch che verranno serviti prima: classe migliore, oppure stessa classe
+        # e stessa facoltà ma arrivati prima (le altre facoltà si dividono gli slot)
+        return sum(1 for j in self._jobs.values()
+                   if j is not job and j.stato in (STATO_IN_CODA, STATO_IN_CORSO) and j.da_assegnare
+                   and (j.classe < job.classe
+                        or (j.classe == job.classe and j.facolta == job.facolta and j.sequenza < job.sequenza)))
+
+    def stato(self, batch_id):
+        with self._cond:
+            job = self._jobs.get(batch_id)
+            if job is None:
+                return None
+            return {
+                'stato': job.stato,
+                'messaggio': job.messaggio,
+                'posizione': self._davanti(job) + 1 if job.stato == STATO_IN_CODA else 0,
+                'completati': job.completati,
+                'totale': job.totale,
+                'priorita': NOMI_CLASSE[job.classe],
+                'facolta': job.facolta,
+            }
+
+    def conteggi(self):
+        with self._cond:
+            conteggi = {STATO_IN_CODA: 0, STATO_IN_CORSO: 0}
+            for job in self._jobs.values():
+                if job.stato in conteggi:
+                    conteggi[job.stato] += 1
+            return conteggi
+
+    def _risveglia(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def dimentica(self, batch_id):
+        with self._cond:
+            self._jobs.pop(batch_id, None)
+
+    # --- ASSEGNAZIONE DEGLI SLOT ---
+    def _scegli(self):
+        candidati = [j for j in self._jobs.values() if j.da_assegnare and j.stato in (STATO_IN_CODA, STATO_IN_CORSO)
+                     and self._merge_libero(j)]
+        if not candidati:
+            return None
+        return min(candidati, key=lambda j: (j.classe,
+                                             self._in_volo_facolta.get(j.facolta, 0),
+                                             self._ultimo_servizio.get(j.facolta, -1),
+                                             j.sequenza))
+
+    @staticmethod
+    def _merge_libero(job):
+        # Ogni record in volo ha un posto riservato nella coda di merge: metti() non blocca mai
+        return job.stadio_merge is None or job.in_volo + job.stadio_merge.in_coda() < job.stadio_merge.capacita
+
+    def _assegna(self):
+        while True:
+            with self._cond:
+                while not self._fermo and (self._in_volo >= self.slots or self._scegli() is None):
+                    self._cond.wait()
+                if self._fermo:
+                    return
+                job = self._scegli()
+                indice = job.da_fare[job.prossimo]
+                job.prossimo += 1
+                job.in_volo += 1
+                if job.stato == STATO_IN_CODA:
+                    job.stato = STATO_IN_CORSO
+                    job.t_inizio = time.perf_counter()
+                self._in_volo += 1
+                self._in_volo_facolta[job.facolta] = self._in_volo_facolta.get(job.facolta, 0) + 1
+                self._ultimo_servizio[job.facolta] = next(self._turno)
+                pool = self._pool
+                self._record_sul_pool.setdefault(pool, set()).add((job.dest_dir, indice))
+            try:
+                future = pool.submit(engine.render_record, indice, job.students_data[indice],
+                                     job.dest_dir, self.base_url, job.profilo, job.template,
+                                     job.budget or self.budget)
+            except BrokenProcessPool as e:
+                self._record_concluso(job, indice, None, e, pool)
+                continue
+            future.add_done_callback(
+                lambda f, job=job, indice=indice, pool=pool: self._record_concluso(job, indice, f, pool=pool))
+
+    def _record_concluso(self, job, indice, future, errore=None, pool=None):
+        if future is not None:
+            try:
+                esito = future.result()
+            except Exception as e:
+                errore = e
+        if isinstance(errore, BrokenProcessPool):
+            # Il processo di render è morto (watchdog, memoria esaurita): il pool
+            # viene ricreato; il record va in TIMEOUT se l'ha terminato il watchdog,
+            # torna in coda senza contare il tentativo se il watchdog l'ha terminato per
+            # un altro record (o il record non è mai partito), altrimenti torna in coda
+            # fino a engine.MAX_TENTATIVI_RECORD tentativi
+            if future is None:
+                esito = None
+            else:
+                esito = engine.esito_interrotto(indice, job.students_data[indice], job.dest_dir, errore,
+                                                job.tentativi, self._marcatori(pool))
+        elif errore is not None:
+            esito = {'indice': indice, 'nome': job.students_data[indice].get('NOM_COG'), 'modulo': '',
+                     'files': [], 'tempi': {}, 'stato': 'ERRORE', 'messaggio': f"render non eseguito: {errore}"}
+        if esito is not None:
+            try:
+                engine.registra_esito(job.dest_dir, esito)
+            except OSError:
+                logger.exception("Impossibile aggiornare il manifest del batch %s", job.batch_id)
+            if job.stadio_merge is not None:
+                job.stadio_merge.metti(esito)
+        with self._cond:
+            self._record_sul_pool.get(pool, set()).discard((job.dest_dir, indice))
+            if isinstance(errore, BrokenProcessPool):
+                self._ricrea_pool()
+            if esito is None:
+                job.da_fare.append(indice)
+            else:
+                job.esiti[indice] = esito
+                job.completati += 1
+            job.in_volo -= 1
+            self._in_volo -= 1
+            self._in_volo_facolta[job.facolta] -= 1
+            completo = job.completati == job.totale
+            self._cond.notify_all()
+        if completo:
+            self._finalizzatori.submit(self._concludi, job)
+
+    def _marcatori(self, pool):
+        # Letti una volta per pool rotto, prima che il record colpevole consumi il suo marcatore
+        with self._cond:
+            if pool not in self._marcatori_rottura:
+                self._marcatori_rottura[pool] = watchdog_record.marcatori_presenti(
+                    self._record_sul_pool.pop(pool, ()))
+            return self._marcatori_rottura[pool]
+
+    def _ricrea_pool(self):
+        if self._pool is not None and getattr(self._pool, '_broken', False):
+            self._pool.shutdown(wait=False)
+            self._pool = self.crea_pool(self.slots, self.con_warmup)
+
+    def _concludi(self, job):
+        try:
+            if job.concludi:
+                risultato = job.concludi(job.esiti)
+            else:
+                job.stadio_merge.chiudi()
+                esiti = [job.esiti[i] for i in job.indici]
+                risultato = engine.concludi_batch(esiti, job.dest_dir, job.nome_cartella, job.t_inizio, job.profilo,
+                                                  merge=job.merge)
+            job.on_complete(risultato)
+            job.stato = STATO_COMPLETATO
+            # batch.json scritto: il batch non è più interrotto, nessun altro worker lo riprende
+            engine.rilascia_batch(job.rivendicazione)
+            job.rivendicazione = None
+        except Exception as e:
+            logger.exception("Errore nella conclusione del batch %s", job.batch_id)
+            job.stato = STATO_ERRORE
+            job.messaggio = str(e)
+        finally:
+            # I dati degli studenti restano in batch.json: non serve tenerli in memoria
+            job.students_data = []
+            job.esiti = {}
+            job.merge = job.stadio_merge = None
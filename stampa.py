@@ -0,0 +1,189 @@
+# --- CARTELLA DI STAMPA ---
+# PDF cumulativi ed Elenco.txt in Da_Stampare/Stampa_<facolta>_<timestamp>,
+# usato dal pulsante Stampa e dall'ingestione automatica della inbox.
+# I PDF vengono pubblicati con reflink/hard link quando possibile (pubblica.py) e la
+# cartella compare in Da_Stampare solo quando è completa.
+# Con un limite di pagine o di MB per file (spool) i cumulativi vengono divisi in
+# parti numerate, tagliate tra uno studente e l'altro: diplomi e camicie della parte N
+# riguardano gli stessi studenti (così anche il cumulativo intercalato, con diploma e
+# camicia di ogni studente uno dopo l'altro). spool.json descrive le parti per inviarle
+# a più stampanti in parallelo; Elenco.txt elenca gli studenti parte per parte.
+import json
+import os
+from datetime import datetime
+
+import engine
+import metrics
+import pubblica
+
+SPOOL_FILENAME = 'spool.json'
+
+
+def limiti_spool(max_pagine=0, max_mb=0):
+    """Limiti per parte, None se la divisione non è richiesta (entrambi 0)."""
+    max_pagine, max_mb = int(max_pagine or 0), float(max_mb or 0)
+    if max_pagine <= 0 and max_mb <= 0:
+        return None
+    return {'pagine': max(0, max_pagine), 'byte': int(max(0, max_mb) * 1024 * 1024)}
+
+
+def prepara_stampa(batch_info, path_stampa, spool=None):
+    """Copia i PDF cumulativi del batch nella cartella di stampa; restituisce il nome della cartella.
+
+    spool = limiti_spool(...) divide i cumulativi in parti al posto della copia.
+    """
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    folder_name = f"Stampa_{batch_info['metadata']['facolta']}_{timestamp}"
+    os.makedirs(path_stampa, exist_ok=True)
+    # Due stampe nello stesso secondo: cartelle distinte
+    n = 1
+    while os.path.exists(os.path.join(path_stampa, folder_name)):
+        n += 1
+        folder_name = f"Stampa_{batch_info['metadata']['facolta']}_{timestamp}_{n}"
+
+    with pubblica.nuova_cartella(os.path.join(path_stampa, folder_name)) as dest_path:
+        if spool:
+            _riempi_cartella_spool(batch_info, dest_path, timestamp, spool)
+        else:
+            _riempi_cartella(batch_info, dest_path, timestamp)
+    return folder_name
+
+
+def _riga_elenco(s):
+    matricola = s.get('MATRI', 'N/D')
+    nome = s.get('NOM_COG', 'N/D').replace('|', ' ')
+    protocollo = s.get('PROTOCOL', 'N/D')
+    corso = s.get('CORSOLAU', 'N/D').replace('|', ' ')
+    return f"MATR: {matricola} | NOM: {nome} | PROT: {protocollo} | CORSO: {corso}\n"
+
+
+def _riempi_cartella(batch_info, dest_path, timestamp):
+    # Solo i file cumulativi (tutti_i_diplomi_, tutte_le_camicie_, diplomi_e_camicie_)
+    prefissi = tuple(prefisso for prefisso, _ in engine.CUMULATIVI.values())
+    for filename in batch_info['filenames']:
+        if filename.startswith(prefissi):
+            src = os.path.join(batch_info['temp_dir'], filename)
+            pubblica.pubblica(src, os.path.join(dest_path, filename))
+
+    # Generazione del file Elenco.txt (rimane uguale)
+    elenco_path = os.path.join(dest_path, "Elenco.txt")
+    with open(elenco_path, 'w', encoding='utf-8') as f:
+        f.write(f"ELENCO STAMPA - {batch_info['metadata']['facolta']} - {timestamp}\n")
+        f.write("-" * 80 + "\n")
+        for s in batch_info['metadata']['student_list']:
+            f.write(_riga_elenco(s))
+
+
+# --- SPOOL DI STAMPA ---
+def _tipi_presenti(batch_info):
+    # Tipo di cumulativo (engine.CUMULATIVI) -> suo file nella cartella del batch
+    tipi = {}
+    for tipo, (prefisso, _) in engine.CUMULATIVI.items():
+        cumulativo = next((f for f in batch_info['filenames'] if f.startswith(prefisso)), None)
+        if cumulativo:
+            tipi[tipo] = cumulativo
+    return tipi
+
+
+def unita_di_stampa(batch_info):
+    """Studenti con almeno un PDF, nell'ordine dei cumulativi.
+
+    [{'riga', 'files': {tipo: [file, ...]}, 'pagine': {tipo: n}, 'byte': {tipo: n}}]
+    per i soli tipi di cumulativo presenti nel batch. I file e le pagine di ogni
+    record vengono dal suo esito nel manifest, per indice: studenti omonimi restano
+    distinti e i PDF non vengono riletti.
+    """
+    letto = engine.leggi_manifest(batch_info['temp_dir'])
+    if letto is None:
+        raise ValueError(f"Manifest del batch {batch_info['original_folder_name']} assente o illeggibile")
+    esiti = letto[1]
+    tipi = _tipi_presenti(batch_info)
+    unita = []
+    for riga in range(len(batch_info['metadata']['student_list'])):
+        esito = esiti.get(riga)
+        if esito is None or not esito['files']:
+            continue
+        files = {tipo: [f for f in esito['files'] if f.startswith(engine.CUMULATIVI[tipo][1])] for tipo in tipi}
+        files = {tipo: fs for tipo, fs in files.items() if fs}
+        unita.append({'riga': riga, 'files': files,
+                      'pagine': {tipo: engine.pagine_record(esito, batch_info['temp_dir'], engine.CUMULATIVI[tipo][1])
+                                 for tipo in files},
+                      'byte': {tipo: sum(os.path.getsize(os.path.join(batch_info['temp_dir'], f)) for f in fs)
+                               for tipo, fs in files.items()}})
+    return unita
+
+
+def dividi_in_parti(unita, limiti):
+    """Gruppi consecutivi di studenti: nessun file di una parte supera i limiti.
+
+    Uno studente che da solo supera un limite forma una parte a sé. I byte sono
+    stimati dalla dimensione dei PDF per studente.
+    """
+    parti = []
+    corrente, totali = [], {}
+    for u in unita:
+        supera = corrente and any(
+            (limiti['pagine'] and totali.get(tipo, {}).get('pagine', 0) + u['pagine'][tipo] > limiti['pagine'])
+            or (limiti['byte'] and totali.get(tipo, {}).get('byte', 0) + u['byte'][tipo] > limiti['byte'])
+            for tipo in u['files'])
+        if supera:
+            parti.append(corrente)
+            corrente, totali = [], {}
+        corrente.append(u)
+        for tipo in u['files']:
+            t = totali.setdefault(tipo, {'pagine': 0, 'byte': 0})
+            t['pagine'] += u['pagine'][tipo]
+            t['byte'] += u['byte'][tipo]
+    if corrente:
+        parti.append(corrente)
+    return parti
+
+
+def _riempi_cartella_spool(batch_info, dest_path, timestamp, limiti):
+    from pypdf import PdfWriter
+    meta = batch_info['metadata']
+    studenti = meta['student_list']
+    parti = dividi_in_parti(unita_di_stampa(batch_info), limiti)
+    tipi = _tipi_presenti(batch_info)
+
+    descrizione = []
+    with metrics.MERGE_SECONDS.time(tipo='spool'):
+        for numero, parte in enumerate(parti, 1):
+            voce = {'parte': numero, 'files': {}, 'pagine': {}, 'byte': {},
+                    'righe': [u['riga'] + 1 for u in parte],
+                    'matricole': [studenti[u['riga']].get('MATRI', '') for u in parte]}
+            for tipo, cumulativo in tipi.items():
+                paths = [os.path.join(batch_info['temp_dir'], f) for u in parte for f in u['files'].get(tipo, ())]
+                if not paths:
+                    continue
+                nome = f"{os.path.splitext(cumulativo)[0]}_parte{numero:02d}.pdf"
+                writer = PdfWriter()
+                for path in paths:
+                    writer.append(path)
+                writer.write(os.path.join(dest_path, nome))
+                writer.close()
+                voce['files'][tipo] = nome
+                voce['pagine'][tipo] = sum(u['pagine'][tipo] for u in parte if tipo in u['files'])
+                voce['byte'][tipo] = os.path.getsize(os.path.join(dest_path, nome))
+            descrizione.append(voce)
+
+    with open(os.path.join(dest_path, SPOOL_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump({'batch': batch_info['original_folder_name'], 'facolta': meta['facolta'], 'creato': timestamp,
+                   'limiti': limiti, 'parti': descrizione}, f, ensure_ascii=False, indent=1)
+
+    # Elenco.txt diviso per parte; in fondo gli studenti senza PDF
+    in_stampa = set()
+    with open(os.path.join(dest_path, "Elenco.txt"), 'w', encoding='utf-8') as f:
+        f.write(f"ELENCO STAMPA - {meta['facolta']} - {timestamp} - {len(parti)} parti\n")
+        f.write("-" * 80 + "\n")
+        for voce in descrizione:
+            files = ', '.join(f"{nome} ({voce['pagine'][tipo]} pagine)" for tipo, nome in voce['files'].items())
+            f.write(f"\n=== PARTE {voce['parte']}/{len(parti)}: {len(voce['righe'])} studenti - {files}\n")
+            for riga in voce['righe']:
+                f.write(_riga_elenco(studenti[riga - 1]))
+                in_stampa.add(riga - 1)
+        esclusi = [s for i, s in enumerate(studenti) if i not in in_stampa]
+        if esclusi:
+            f.write("\n=== SENZA PDF (saltati o in errore)\n")
+            for s in esclusi:
+                f.write(_riga_elenco(s))
@@ -0,0 +1,149 @@
+# --- TABELLA DEGLI STUDENTI ---
+# Il file dati viene letto una volta in una TabellaStudenti: intestazioni comuni a
+# tutte le righe e una tupla di valori per studente, con i valori ripetuti (modulo,
+# corso, firme, date, luoghi) condivisi tra le righe. Render, anteprima, Elenco di
+# stampa e archivio leggono la stessa tabella; ogni riga è vista come Studente, un
+# Mapping in sola lettura (s['NOM_COG'], s.get('MATRI')) che non copia i valori.
+# In batch.json e nel manifest la tabella è salvata per colonne:
+# {"colonne": [...], "righe": [[...], ...]}.
+from collections.abc import Mapping, Sequence
+
+
+class Colonne:
+    """Intestazioni della tabella, condivise da tutte le righe."""
+    __slots__ = ('nomi', 'posizioni', 'minuscole')
+
+    def __init__(self, nomi):
+        self.nomi = tuple(nomi)
+        self.posizioni = {nome: i for i, nome in enumerate(self.nomi)}
+        # Chiavi del contesto dei template (engine.prepara_record)
+        self.minuscole = tuple(nome.lower() for nome in self.nomi)
+
+    def __reduce__(self):
+        return Colonne, (self.nomi,)
+
+
+class Studente(Mapping):
+    """Una riga della tabella, in sola lettura."""
+    __slots__ = ('colonne', 'valori')
+
+    def __init__(self, colonne, valori):
+        self.colonne = colonne
+        self.valori = valori
+
+    def __getitem__(self, nome):
+        return self.valori[self.colonne.posizioni[nome]]
+
+    def get(self, nome, default=None):
+        i = self.colonne.posizioni.get(nome)
+        return default if i is None else self.valori[i]
+
+    def __contains__(self, nome):
+        return nome in self.colonne.posizioni
+
+    def __iter__(self):
+        return iter(self.colonne.nomi)
+
+    def __len__(self):
+        return len(self.colonne.nomi)
+
+    def __reduce__(self):
+        # Il record viaggia da solo verso i processi di render
+        return Studente, (self.colonne, self.valori)
+
+    def __repr__(self):
+        return f"Studente({dict(self)!r})"
+
+    def contesto(self):
+        """Nuovo dict con le chiavi in minuscolo, da completare per i template."""
+        return dict(zip(self.colonne.minuscole, self.valori))
+
+    def con(self, correzioni):
+        """Copia della riga con alcuni campi sostituiti (correzione di un record)."""
+        valori = list(self.valori)
+        for nome, valore in correzioni.items():
+            valori[self.colonne.posizioni[nome]] = valore
+        return Studente(self.colonne, tuple(valori))
+
+
+def contesto(student):
+    """Contesto con chiavi minuscole per uno Studente o per un dict qualsiasi."""
+    if isinstance(student, Studente):
+        return student.contesto()
+    return {k.lower(): v for k, v in student.items()}
+
+
+def _testo(valore, nome, indice):
+    if valore is None:
+        return ''
+    if not isinstance(valore, str):
+        raise ValueError(f"Studente {indice + 1}, campo {nome}: atteso testo o null, "
+                         f"ricevuto {type(valore).__name__} ({valore!r})")
+    return valore.strip()
+
+
+class TabellaStudenti(Sequence):
+    """Righe del file dati: tabella[i] è uno Studente, tabella.colonna(nome) una colonna intera."""
+
+    def __init__(self, nomi_colonne=(), righe=()):
+        self.colonne = Colonne(nomi_colonne)
+        self.righe = [tuple(r) for r in righe]
+
+    @classmethod
+    def da_righe(cls, nomi_colonne, righe):
+        """Tabella dalle righe del file dati, condividendo i valori ripetuti."""
+        condivisi = {}
+        tabella = cls(nomi_colonne)
+        tabella.righe = [tuple(condivisi.setdefault(v, v) for v in riga) for riga in righe]
+        return tabella
+
+    @classmethod
+    def da_json(cls, dati):
+        """Da batch.json o dal manifest; accetta anche il vecchio formato (lista di dict)."""
+        if isinstance(dati, cls):
+            return dati
+        if isinstance(dati, dict):
+            return cls.da_righe(dati['colonne'], dati['righe'])
+        return cls.da_record(dati)
+
+    @classmethod
+    def da_record(cls, record):
+        """Da una lista di dict campo -> valore (API JSON): colonne nell'ordine di
+        prima comparsa, campi assenti o null vuoti, valori di testo come dal file dati.
+
+        ValueError per valori che non sono testo (numeri, liste, oggetti): 1.0 o
+        true diventerebbero "1.0" e "True" nel diploma.
+        """
+        nomi = list(dict.fromkeys(nome for s in record for nome in s))
+        return cls.da_righe(nomi, ([_testo(s.get(n), n, i) for n in nomi] for i, s in enumerate(record)))
+
+    def a_json(self):
+        return {'colonne': list(self.colonne.nomi), 'righe': [list(r) for r in self.righe]}
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [Studente(self.colonne, r) for r in self.righe[i]]
+        return Studente(self.colonne, self.righe[i])
+
+    def __setitem__(self, i, studente):
+        # Riga corretta: stessi campi, nell'ordine delle colonne
+        self.righe[i] = tuple(studente[nome] for nome in self.colonne.nomi)
+
+    def __len__(self):
+        return len(self.righe)
+
+    def __eq__(self, altra):
+        if not isinstance(altra, TabellaStudenti):
+            return NotImplemented
+        return self.colonne.nomi == altra.colonne.nomi and self.righe == altra.righe
+
+    def colonna(self, nome, default=''):
+        i = self.colonne.posizioni.get(nome)
+        return [default] * len(self.righe) if i is None else [r[i] for r in self.righe]
+
+
+def json_default(valore):
+    """Per json.dump: serializza le tabelle per colonne."""
+    if isinstance(valore, TabellaStudenti):
+        return valore.a_json()
+    raise TypeError(f"{type(valore).__name__} non serializzabile in JSON")
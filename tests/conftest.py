@@ -0,0 +1,32 @@
+# I moduli dell'applicazione stanno nella radice del repository
+import os
+import sys
+
+import pytest
+
+RADICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RADICE not in sys.path:
+    sys.path.insert(0, RADICE)
+
+
+# PDF di prova per merge, correzione e ritentativo: ogni pagina si riconosce dalla larghezza
+@pytest.fixture
+def crea_pdf():
+    from pypdf import PdfWriter
+
+    def crea(path, larghezze):
+        writer = PdfWriter()
+        for larghezza in larghezze:
+            writer.add_blank_page(larghezza, 100)
+        writer.write(str(path))
+        return str(path)
+    return crea
+
+
+@pytest.fixture
+def larghezze_pagine():
+    from pypdf import PdfReader
+
+    def leggi(path):
+        return [int(p.mediabox.width) for p in PdfReader(str(path)).pages]
+    return leggi
@@ -0,0 +1,36 @@
+# Controllo di ammissione dei batch e contatore dei rifiuti in /metrics
+import pytest
+
+import ammissione
+import metrics
+
+
+def _rifiuti(motivo):
+    return metrics.BATCH_RIFIUTATI._values.get((motivo,), 0)
+
+
+def test_entro_i_limiti(tmp_path):
+    ammissione.verifica(100, 3, str(tmp_path / 'batch'), max_batch=20, mb_per_record=1, quota_mb=500, uso_mb=10)
+    # 0 = nessun limite
+    ammissione.verifica(10 ** 6, 10 ** 3, str(tmp_path))
+
+
+@pytest.mark.parametrize('limiti, motivo', [
+    ({'max_batch': 2}, ammissione.MOTIVO_CODA),
+    ({'min_disco_mb': 10 ** 12}, ammissione.MOTIVO_DISCO),
+    ({'mb_per_record': 1, 'quota_mb': 100, 'uso_mb': 60}, ammissione.MOTIVO_QUOTA),
+])
+def test_rifiuto_contato_per_motivo(tmp_path, limiti, motivo):
+    prima = _rifiuti(motivo)
+    with pytest.raises(ammissione.Rifiutato) as e:
+        ammissione.verifica(50, 2, str(tmp_path), **limiti)
+    assert e.value.motivo == motivo and e.value.riprova_tra > 0
+    assert _rifiuti(motivo) == prima + 1
+
+
+def test_contatore_in_formato_prometheus():
+    righe = metrics.REGISTRY.render().splitlines()
+    assert '# TYPE generatore_batch_rifiutati_total counter' in righe
+    assert '# TYPE generatore_active_batches gauge' in righe
+    with pytest.raises(ValueError):
+        metrics.BATCH_RIFIUTATI.inc(-1, motivo=ammissione.MOTIVO_CODA)
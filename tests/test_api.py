@@ -0,0 +1,98 @@
+# API JSON dei batch: richieste non valide e batch inesistenti (nessun render)
+import uuid
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    import app
+    app.app.config.update(TESTING=True, BATCH_ROOT=str(tmp_path_factory.mktemp('batch')))
+    return app.app.test_client()
+
+
+def test_crea_batch_senza_dati(client):
+    risposta = client.post('/api/batch')
+    assert risposta.status_code == 400
+    assert 'data_file' in risposta.get_json()['errore']
+
+
+def test_crea_batch_json_non_valido(client):
+    for corpo in ({'facolta': 'ICI'}, {'facolta': 'ICI', 'studenti': ['MARIO ROSSI']}, [1, 2]):
+        risposta = client.post('/api/batch', json=corpo)
+        assert risposta.status_code == 400, corpo
+        assert "'studenti'" in risposta.get_json()['errore']
+
+
+def test_crea_batch_valori_non_testo(client):
+    studenti = [{'NOM_COG': 'MARIO ROSSI', 'MATRI': 1234567}]
+    risposta = client.post('/api/batch', json={'facolta': 'ICI', 'studenti': studenti})
+    assert risposta.status_code == 400
+    assert 'campo MATRI' in risposta.get_json()['errore']
+
+
+def test_crea_batch_facolta_non_valida(client):
+    risposta = client.post('/api/batch', json={'facolta': '../ICI', 'studenti': [{'NOM_COG': 'MARIO ROSSI'}]})
+    assert risposta.status_code == 400
+    dati = risposta.get_json()
+    assert 'ICI' in dati['facolta_valide'] and '../ICI' in dati['errore']
+
+
+def test_crea_batch_senza_studenti(client):
+    risposta = client.post('/api/batch', json={'facolta': 'ici', 'studenti': []})
+    assert risposta.status_code == 400
+    assert risposta.get_json() == {'errore': 'Nessuno studente nei dati.'}
+
+
+def test_batch_inesistente(client):
+    for batch_id in (str(uuid.uuid4()), 'non-un-uuid'):
+        for url in (f'/api/batch/{batch_id}', f'/api/batch/{batch_id}/files',
+                    f'/api/batch/{batch_id}/files/diploma.pdf'):
+            risposta = client.get(url)
+            assert risposta.status_code == 404, url
+            assert 'errore' in risposta.get_json()
+        for azione in ('archivia', 'stampa'):
+            assert client.post(f'/api/batch/{batch_id}/{azione}').status_code == 404
+
+
+def test_richiesta_troppo_grande(client, monkeypatch):
+    import app
+    monkeypatch.setitem(app.app.config, 'MAX_CONTENT_LENGTH', 1024 * 1024)
+    risposta = client.post('/api/batch', data=b'x' * (2 * 1024 * 1024), content_type='application/json')
+    assert risposta.status_code == 413
+    assert 'massimo 1 MB' in risposta.get_json()['errore']
+
+
+def test_batch_rifiutato_dall_ammissione(client, monkeypatch):
+    import app
+    monkeypatch.setitem(app.app.config, 'MIN_DISCO_LIBERO_MB', 10 ** 12)
+    risposta = client.post('/api/batch', json={'facolta': 'ICI',
+                                               'studenti': [{'NOM_COG': 'MARIO ROSSI', 'MODULO': 'forml1'}]})
+    assert risposta.status_code == 503
+    assert int(risposta.headers['Retry-After']) > 0
+    assert 'Spazio temporaneo insufficiente' in risposta.get_json()['errore']
+
+
+def test_preflight_prima_dell_ammissione(client, monkeypatch):
+    # Un batch che la verifica preliminare respinge non passa dall'ammissione (che può rimuovere batch)
+    import app
+
+    def ammetti_batch(n_record):
+        raise AssertionError('ammissione prima della verifica preliminare')
+
+    monkeypatch.setattr(app, 'ammetti_batch', ammetti_batch)
+    risposta = client.post('/api/batch', json={'facolta': 'ICI', 'studenti': [{'MATRI': '1'}]})
+    assert risposta.status_code == 422
+    assert risposta.get_json()['preflight']['errori'] == 1
+
+
+@pytest.mark.parametrize('debug, impostato, atteso', [
+    (False, None, False), (True, None, True), (False, True, True), (True, False, False)])
+def test_auto_reload_dei_template(client, monkeypatch, debug, impostato, atteso):
+    import app
+    import engine
+    monkeypatch.setattr(app.app, 'debug', debug)
+    monkeypatch.setitem(app.app.config, 'TEMPLATES_AUTO_RELOAD', impostato)
+    monkeypatch.setattr(engine, '_jinja_settings', dict(engine._jinja_settings))
+    app.configura_engine()
+    assert engine._jinja_settings['auto_reload'] is atteso
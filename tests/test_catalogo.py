@@ -0,0 +1,71 @@
+# Catalogo dell'archivio: voci dei diplomi archiviati, ricerca FTS e lettura dallo ZIP
+import zipfile
+from datetime import datetime
+
+import pytest
+
+import catalogo
+import engine
+from tabella import TabellaStudenti
+
+
+def _diploma(studente):
+    return engine.nomi_file_record({'nom_cog': studente['NOM_COG'].replace('|', '<br>')}, studente['MODULO'])[0]
+
+
+def _batch_info(*studenti, assenti=()):
+    tabella = TabellaStudenti.da_righe(list(studenti[0]), [list(s.values()) for s in studenti])
+    filenames = [_diploma(s) for s in tabella]
+    return {'metadata': {'facolta': 'ICI', 'student_list': tabella},
+            'filenames': [f for f in filenames if f not in assenti]}
+
+
+ROSSI = {'NOM_COG': 'MARIO|ROSSI', 'MATRI': '16828', 'PROTOCOL': '123/2026', 'NPERGAMENA': '7', 'MODULO': 'forml1'}
+BIANCHI = {'NOM_COG': 'ANNA BIANCHI', 'MATRI': '17001', 'PROTOCOL': '124/2026', 'NPERGAMENA': '8', 'MODULO': 'forml2'}
+
+
+def test_registra_e_cerca(tmp_path):
+    db = str(tmp_path / 'catalogo.sqlite')
+    assert catalogo.cerca(db, 'rossi') == []
+    batch_info = _batch_info(ROSSI, BIANCHI)
+    assert catalogo.registra_batch(db, batch_info, 'lotto.zip', 'lotto', now=datetime(2026, 10, 1, 9, 30)) == 2
+    # Stesso ZIP registrato di nuovo: nessuna voce duplicata
+    assert catalogo.registra_batch(db, batch_info, 'lotto.zip', 'lotto') == 0
+
+    voci = catalogo.cerca(db, 'ross')
+    assert [v['nome'] for v in voci] == ['MARIO ROSSI']
+    voce = voci[0]
+    assert (voce['matri'], voce['facolta'], voce['archiviato_il']) == ('16828', 'ICI', '2026-10-01 09:30')
+    assert voce['membro'] == 'lotto/' + _diploma(ROSSI)
+    # Tutte le parole, come prefissi; virgolette ignorate
+    assert [v['matri'] for v in catalogo.cerca(db, '124/2026 "anna')] == ['17001']
+    assert catalogo.cerca(db, 'anna rossi') == []
+    assert catalogo.cerca(db, '   ') == []
+    assert catalogo.documento(db, voce['id'])['nome'] == 'MARIO ROSSI'
+    assert catalogo.documento(db, 9999) is None
+
+
+def test_solo_i_diplomi_presenti_nello_zip(tmp_path):
+    batch_info = _batch_info(ROSSI, BIANCHI)
+    assente = batch_info['filenames'][1]
+    voci = catalogo.voci_batch(_batch_info(ROSSI, BIANCHI, assenti=(assente,)), 'lotto.zip', 'lotto', datetime.now())
+    assert [v['matri'] for v in voci] == ['16828']
+
+
+def test_importa_zip_e_leggi_pdf(tmp_path):
+    archivio = tmp_path / 'archivio'
+    archivio.mkdir()
+    zip_path = archivio / 'vecchio.zip'
+    with zipfile.ZipFile(zip_path, 'w') as zf:
+        zf.writestr('vecchio/diploma_LUCA_VERDI_forml3v7.pdf', b'%PDF-verdi')
+        zf.writestr('vecchio/camicia_LUCA_VERDI.pdf', b'%PDF-camicia')
+        zf.writestr('vecchio/log_creazione_diplomi.txt', b'')
+    db = str(tmp_path / 'catalogo.sqlite')
+    assert catalogo.importa_zip(db, str(zip_path), facolta='ICI') == 1
+    assert catalogo.importa_zip(db, str(zip_path), facolta='ICI') == 0
+
+    voce, = catalogo.cerca(db, 'verdi')
+    assert voce['nome'] == 'LUCA VERDI' and voce['matri'] == ''
+    assert catalogo.leggi_pdf(voce, [str(tmp_path / 'altro'), str(archivio)]) == b'%PDF-verdi'
+    with pytest.raises(FileNotFoundError):
+        catalogo.leggi_pdf(voce, [str(tmp_path / 'altro')])
@@ -0,0 +1,68 @@
+# Decodifica dei file dati: rilevazione della codifica, blocchi piccoli, ripiego a metà file
+import codecs
+import io
+
+import pytest
+
+from codifica import CODIFICA_RIPIEGO, ErroreCodifica, RigheDecodificate, rileva_codifica
+
+RIGHE = ['NOM_COG\tLUOGONAS', 'NICOLÒ FORLÌ\tFORLÌ', 'JOSÉ PEÑA\tCANTÙ']
+
+
+def _leggi(dati, blocco=7, codifica=None):
+    righe = RigheDecodificate(io.BytesIO(dati), codifica=codifica, blocco=blocco)
+    return list(righe), righe.codifica
+
+
+def test_rileva_codifica():
+    assert rileva_codifica(codecs.BOM_UTF8 + b'abc') == 'utf-8-sig'
+    assert rileva_codifica(codecs.BOM_UTF16_LE + b'a\x00') == 'utf-16'
+    assert rileva_codifica('àè'.encode('utf-8')) == 'utf-8'
+    # Carattere multibyte tagliato dalla fine del campione: resta UTF-8
+    assert rileva_codifica('aà'.encode('utf-8')[:-1]) == 'utf-8'
+    assert rileva_codifica('àè'.encode('cp1252')) == CODIFICA_RIPIEGO
+
+
+@pytest.mark.parametrize('codifica, attesa', [
+    ('utf-8', 'utf-8'), ('utf-8-sig', 'utf-8-sig'), ('utf-16', 'utf-16'), ('cp1252', CODIFICA_RIPIEGO)])
+@pytest.mark.parametrize('blocco', [1, 2, 3, 7, 64 * 1024])
+def test_codifiche_e_blocchi(codifica, attesa, blocco):
+    # Blocchi di pochi byte: caratteri multibyte e \r\n tagliati tra un blocco e l'altro
+    dati = '\r\n'.join(RIGHE).encode(codifica)
+    assert _leggi(dati, blocco) == (RIGHE, attesa)
+
+
+@pytest.mark.parametrize('separatore', ['\n', '\r\n', '\r'])
+def test_terminatori_di_riga(separatore):
+    dati = (separatore.join(RIGHE) + separatore).encode('utf-8')
+    assert _leggi(dati, blocco=5)[0] == RIGHE
+    # Riga vuota in mezzo: resta una riga vuota
+    assert _leggi(separatore.join(['a', '', 'b']).encode('utf-8'), blocco=1)[0] == ['a', '', 'b']
+
+
+def test_ripiego_a_meta_file():
+    # Inizio solo ASCII (rilevato UTF-8), poi un carattere Windows-1252
+    dati = ('MATRI\tNOM_COG\n' + '1\tMARIO ROSSI\n' * 20 + '2\tNICOLÒ\n').encode('cp1252')
+    righe, codifica = _leggi(dati, blocco=16)
+    assert codifica == CODIFICA_RIPIEGO
+    assert righe[-1] == '2\tNICOLÒ' and len(righe) == 22
+
+
+def test_byte_non_definiti_in_windows_1252():
+    assert _leggi(b'a\x81b\x9dc', codifica='cp1252')[0] == ['a\x81b\x9dc']
+
+
+@pytest.mark.parametrize('blocco', [1, 4, 16])
+def test_utf8_danneggiato_dopo_caratteri_accentati(blocco):
+    # La riga indicata è quella del byte non valido, qualunque sia la dimensione del blocco
+    dati = 'NICOLÒ\r\nFORLÌ\r\nMARIO '.encode('utf-8') + b'\xff rotto\n'
+    with pytest.raises(ErroreCodifica, match='alla riga 3'):
+        _leggi(dati, blocco=blocco)
+    # Blocco predefinito: il byte non valido a metà di un blocco successivo
+    dati = 'NICOLÒ\n'.encode('utf-8') * 20000 + b'MARIO \xff\n'
+    with pytest.raises(ErroreCodifica, match='alla riga 20001'):
+        list(RigheDecodificate(io.BytesIO(dati)))
+
+
+def test_file_vuoto():
+    assert _leggi(b'') == ([], 'utf-8')
@@ -0,0 +1,122 @@
+# Correzione e ritentativo: pagine sostituite nei PDF cumulativi senza rifare il merge.
+import os
+
+import pytest
+
+import engine
+from tabella import TabellaStudenti
+
+NOME_CARTELLA = '2026-01-01'
+TEMPI = {'jinja': 0.0, 'layout': 0.0, 'write': 0.0, 'cache_hit': True}
+
+
+def _esito(indice, files_pagine):
+    return {'indice': indice, 'nome': f'STUD {indice}', 'modulo': 'm', 'stato': 'OK', 'messaggio': '',
+            'files': list(files_pagine), 'pagine': dict(files_pagine),
+            'tempi': {'diploma': TEMPI, 'camicia': TEMPI}}
+
+
+def test_sostituisci_pagine(tmp_path, crea_pdf, larghezze_pagine):
+    combinato = crea_pdf(tmp_path / 'c.pdf', [11, 12, 13, 14, 15])
+    nuovo = crea_pdf(tmp_path / 'n.pdf', [90])
+    altro = crea_pdf(tmp_path / 'a.pdf', [91, 92])
+    engine.sostituisci_pagine(combinato, [(1, 2, [nuovo]), (4, 1, [altro])])
+    assert larghezze_pagine(combinato) == [11, 90, 14, 91, 92]
+    assert not os.path.exists(combinato + '.tmp')
+
+
+def _errore(indice, messaggio='boom'):
+    return {'indice': indice, 'nome': f'STUD {indice}', 'modulo': 'm', 'stato': 'ERRORE', 'messaggio': messaggio,
+            'files': [], 'tempi': {}}
+
+
+def _batch(crea_pdf, tmp_path, pagine=(1, 2, 1), falliti=()):
+    # Uno studente per elemento di pagine: diploma di tante pagine, camicia di 1 pagina
+    dest = tmp_path / 'batch'
+    dest.mkdir()
+    studenti = TabellaStudenti.da_record([{'NOM_COG': f'STUD {i}', 'MATRI': str(100 + i)} for i in range(len(pagine))])
+    engine.scrivi_manifest(str(dest), studenti, NOME_CARTELLA, facolta='ICI')
+    diplomi, camicie, esiti = [], [], []
+    for i, pagine_diploma in enumerate(pagine):
+        if i in falliti:
+            esiti.append(_errore(i))
+            engine.registra_esito(str(dest), esiti[-1])
+            continue
+        larghezze = [100 * (i + 1) + p for p in range(pagine_diploma)]
+        crea_pdf(dest / f'diploma_{i}.pdf', larghezze)
+        crea_pdf(dest / f'camicia_{i}.pdf', [500 + i])
+        diplomi += larghezze
+        camicie.append(500 + i)
+        esiti.append(_esito(i, {f'diploma_{i}.pdf': pagine_diploma, f'camicia_{i}.pdf': 1}))
+        engine.registra_esito(str(dest), esiti[-1])
+    cumulativi = [engine.nome_cumulativo('diplomi', NOME_CARTELLA), engine.nome_cumulativo('camicie', NOME_CARTELLA)]
+    crea_pdf(dest / cumulativi[0], diplomi)
+    crea_pdf(dest / cumulativi[1], camicie)
+    (dest / engine.LOG_FILENAME).write_text('')
+    batch_info = {'temp_dir': str(dest), 'original_folder_name': NOME_CARTELLA,
+                  'filenames': [f for e in esiti for f in e['files']] + cumulativi,
+                  'log_content': '', 'log_file_path': str(dest / engine.LOG_FILENAME),
+                  'errori': engine.errori_batch(esiti),
+                  'metadata': {'student_list': studenti, 'facolta': 'ICI'}}
+    return dest, batch_info, cumulativi
+
+
+def test_integra_esiti_usa_le_pagine_del_manifest(tmp_path, monkeypatch, crea_pdf, larghezze_pagine):
+    dest, batch_info, (diplomi, camicie) = _batch(crea_pdf, tmp_path)
+    nuovi = tmp_path / 'nuovi'
+    nuovi.mkdir()
+    crea_pdf(nuovi / 'diploma_1.pdf', [900])
+    crea_pdf(nuovi / 'camicia_1.pdf', [901])
+
+    # I PDF dei record già nel batch non vengono riletti per contarne le pagine
+    def conta_pagine(paths):
+        raise AssertionError(f"PDF riletti: {paths}")
+    monkeypatch.setattr(engine, 'conta_pagine', conta_pagine)
+
+    engine.integra_esiti(batch_info, {1: _esito(1, {'diploma_1.pdf': 1, 'camicia_1.pdf': 1})}, str(nuovi), ['nota'])
+    assert larghezze_pagine(dest / diplomi) == [100, 900, 300]
+    assert larghezze_pagine(dest / camicie) == [500, 901, 502]
+    assert larghezze_pagine(dest / 'diploma_1.pdf') == [900]
+    # Il nuovo conteggio è nel manifest per la correzione successiva
+    _, conclusi = engine.leggi_manifest(str(dest))
+    assert conclusi[1]['pagine'] == {'diploma_1.pdf': 1, 'camicia_1.pdf': 1}
+    assert batch_info['log_content'].endswith('nota')
+
+
+def test_integra_esiti_conta_le_pagine_dei_manifest_senza_conteggio(tmp_path, crea_pdf, larghezze_pagine):
+    dest, batch_info, (diplomi, _) = _batch(crea_pdf, tmp_path)
+    engine.registra_esito(str(dest), {**_esito(1, {}), 'files': ['diploma_1.pdf', 'camicia_1.pdf']})
+    nuovi = tmp_path / 'nuovi'
+    nuovi.mkdir()
+    crea_pdf(nuovi / 'diploma_2.pdf', [900])
+    crea_pdf(nuovi / 'camicia_2.pdf', [901])
+    engine.integra_esiti(batch_info, {2: _esito(2, {'diploma_2.pdf': 1, 'camicia_2.pdf': 1})}, str(nuovi), [])
+    assert larghezze_pagine(dest / diplomi) == [100, 200, 201, 900]
+
+
+def test_ritentativo_inserisce_i_record_riusciti(tmp_path, crea_pdf, larghezze_pagine):
+    dest, batch_info, (diplomi, camicie) = _batch(crea_pdf, tmp_path, pagine=(1, 2, 1, 1), falliti=(1, 3))
+    assert [e['indice'] for e in batch_info['errori']] == [1, 3]
+    nuovi = tmp_path / 'ritenta'
+    nuovi.mkdir()
+    crea_pdf(nuovi / 'diploma_1.pdf', [900, 901])
+    crea_pdf(nuovi / 'camicia_1.pdf', [902])
+    engine.concludi_ritentativo(batch_info, {1: _esito(1, {'diploma_1.pdf': 2, 'camicia_1.pdf': 1}),
+                                             3: _errore(3, 'ancora rotto')}, str(nuovi))
+    # Le pagine del record 1 entrano al loro posto, tra il record 0 e il 2
+    assert larghezze_pagine(dest / diplomi) == [100, 900, 901, 300]
+    assert larghezze_pagine(dest / camicie) == [500, 902, 502]
+    assert batch_info['filenames'][:6] == ['diploma_0.pdf', 'camicia_0.pdf', 'diploma_1.pdf', 'camicia_1.pdf',
+                                           'diploma_2.pdf', 'camicia_2.pdf']
+    assert [(e['indice'], e['messaggio']) for e in batch_info['errori']] == [(3, 'ancora rotto')]
+    assert 'STUD 3 (riga 4) ancora in ERRORE: ancora rotto' in batch_info['log_content']
+
+
+def test_trova_record():
+    studenti = TabellaStudenti.da_record([{'MATRI': '100'}, {'MATRI': '101'}, {'MATRI': '101'}])
+    assert engine.trova_record(studenti, matri='100') == 0
+    assert engine.trova_record(studenti, indice='1') == 1
+    for argomenti in ({'indice': 'abc'}, {'indice': '3'}, {'indice': None}, {'matri': '101'}, {'matri': '999'}):
+        with pytest.raises(ValueError) as errore:
+            engine.trova_record(studenti, **argomenti)
+        assert 'invalid literal' not in str(errore.value)
@@ -0,0 +1,75 @@
+# Deposito a contenuto indirizzato: blob condivisi tra batch, manifest, ZIP ricostruito, replica
+import os
+import zipfile
+
+import pytest
+
+import deposito
+
+
+def _file(cartella, nome, contenuto):
+    path = cartella / nome
+    path.write_bytes(contenuto)
+    return str(path)
+
+
+def test_deposita_riusa_i_blob(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    root = str(tmp_path / 'deposito')
+    diploma = _file(src, 'diploma.pdf', b'%PDF-diploma')
+    camicia = _file(src, 'camicia.pdf', b'%PDF-camicia')
+
+    conteggi = deposito.deposita_batch(root, 'lotto_1', [('lotto_1/diploma.pdf', diploma),
+                                                         ('lotto_1/camicia.pdf', camicia)])
+    assert conteggi == {'nuovi': 2, 'riusati': 0, 'byte_nuovi': 24}
+    # Riarchiviazione dopo una correzione: solo la camicia è nuova
+    camicia_corretta = _file(src, 'camicia2.pdf', b'%PDF-camicia-corretta')
+    conteggi = deposito.deposita_batch(root, 'lotto_2', [('lotto_2/diploma.pdf', diploma),
+                                                         ('lotto_2/camicia.pdf', camicia_corretta)])
+    assert conteggi == {'nuovi': 1, 'riusati': 1, 'byte_nuovi': 21}
+    assert sum(len(f) for _, _, f in os.walk(os.path.join(root, deposito.BLOB_DIR))) == 3
+    assert deposito.elenco_batch(root) == ['lotto_1', 'lotto_2']
+
+    manifest = deposito.leggi_manifest(root, 'lotto_2')
+    assert [v['nome'] for v in manifest['files']] == ['lotto_2/diploma.pdf', 'lotto_2/camicia.pdf']
+    assert deposito.leggi_membro(root, 'lotto_2', 'lotto_2/camicia.pdf') == b'%PDF-camicia-corretta'
+    with pytest.raises(KeyError):
+        deposito.leggi_membro(root, 'lotto_2', 'lotto_2/assente.pdf')
+    assert deposito.leggi_manifest(root, 'assente') is None
+    assert deposito.elenco_batch(str(tmp_path / 'vuoto')) == []
+
+
+def test_blob_indipendente_dal_file_di_origine(tmp_path):
+    root = str(tmp_path / 'deposito')
+    src = _file(tmp_path, 'diploma.pdf', b'%PDF-1')
+    deposito.deposita_batch(root, 'lotto', [('lotto/diploma.pdf', src)])
+    with open(src, 'wb') as f:
+        f.write(b'%PDF-modificato')
+    assert deposito.leggi_membro(root, 'lotto', 'lotto/diploma.pdf') == b'%PDF-1'
+
+
+def test_esporta_zip(tmp_path):
+    root = str(tmp_path / 'deposito')
+    membri = [('lotto/diploma.pdf', _file(tmp_path, 'd.pdf', b'%PDF-d')),
+              ('lotto/log_creazione_diplomi.txt', _file(tmp_path, 'log.txt', b'log'))]
+    deposito.deposita_batch(root, 'lotto', membri)
+    dest = str(tmp_path / 'lotto.zip')
+    assert deposito.esporta_zip(root, 'lotto', dest) == dest
+    with zipfile.ZipFile(dest) as zf:
+        assert zf.namelist() == ['lotto/diploma.pdf', 'lotto/log_creazione_diplomi.txt']
+        assert zf.read('lotto/diploma.pdf') == b'%PDF-d'
+    with pytest.raises(FileNotFoundError):
+        deposito.esporta_zip(root, 'assente', dest)
+
+
+def test_replica_solo_il_mancante(tmp_path):
+    root, copia = str(tmp_path / 'deposito'), str(tmp_path / 'copia')
+    comune = _file(tmp_path, 'comune.pdf', b'%PDF-comune')
+    deposito.deposita_batch(root, 'lotto_1', [('lotto_1/a.pdf', comune)])
+    assert deposito.replica(root, copia) == {'batch': 1, 'blob': 1, 'byte': 11}
+    deposito.deposita_batch(root, 'lotto_2', [('lotto_2/a.pdf', comune),
+                                              ('lotto_2/b.pdf', _file(tmp_path, 'b.pdf', b'%PDF-b'))])
+    assert deposito.replica(root, copia) == {'batch': 1, 'blob': 1, 'byte': 6}
+    assert deposito.replica(root, copia) == {'batch': 0, 'blob': 0, 'byte': 0}
+    assert deposito.leggi_membro(copia, 'lotto_2', 'lotto_2/b.pdf') == b'%PDF-b'
@@ -0,0 +1,38 @@
+# Tempo di importazione: app, engine e la riga di comando non devono caricare
+# weasyprint, pypdf e openpyxl (li importa solo chi renderizza, unisce o archivia).
+import json
+import os
+import subprocess
+import sys
+import time
+
+from conftest import RADICE
+
+PESANTI = ('weasyprint', 'pypdf', 'openpyxl')
+# Largo: su una macchina normale l'import richiede qualche decimo di secondo
+BUDGET_SECONDI = 5
+
+
+def _importa(modulo, cwd):
+    codice = (f"import json, sys; import {modulo}; "
+              f"print(json.dumps([m for m in {PESANTI!r} if m in sys.modules]))")
+    env = dict(os.environ, PYTHONPATH=RADICE)
+    inizio = time.perf_counter()
+    risultato = subprocess.run([sys.executable, '-c', codice], cwd=cwd, env=env,
+                               capture_output=True, text=True, timeout=60)
+    durata = time.perf_counter() - inizio
+    assert risultato.returncode == 0, risultato.stderr
+    return json.loads(risultato.stdout.strip().splitlines()[-1]), durata
+
+
+def test_import_app_senza_librerie_di_render(tmp_path):
+    caricati, durata = _importa('app', tmp_path)
+    assert caricati == []
+    assert durata < BUDGET_SECONDI
+
+
+def test_import_riga_di_comando_senza_librerie_di_render(tmp_path):
+    for modulo in ('engine', 'generatore', 'ingest'):
+        caricati, durata = _importa(modulo, tmp_path)
+        assert caricati == [], modulo
+        assert durata < BUDGET_SECONDI, modulo
@@ -0,0 +1,28 @@
+# Normalizzazione dei luoghi di nascita: indice offline, CSV ISTAT da configurazione, regole
+import luoghi
+
+
+def test_indice_predefinito_e_regole():
+    luoghi.configura(None)
+    assert luoghi.normalizza("FORLI'") == 'Forlì'
+    assert luoghi.normalizza("L'AQUILA") == "L'Aquila"
+    # Non nell'indice: regole su preposizioni e apostrofi
+    assert luoghi.normalizza('SAN GIOVANNI IN PERSICETO') == 'San Giovanni in Persiceto'
+    assert luoghi.normalizza('  ') == ''
+
+
+def test_indice_completo_da_configurazione(tmp_path):
+    csv_istat = tmp_path / 'comuni.csv'
+    csv_istat.write_text('Codice;Denominazione in italiano\n001;Sankt Ulrich/Ortisei\n002;Cantù\n',
+                         encoding='utf-8')
+    try:
+        luoghi.configura(str(csv_istat))
+        # Nomi bilingui: entrambe le grafie
+        assert {'sankt ulrich', 'ortisei'} <= luoghi.indice().keys()
+        assert luoghi.normalizza("CANTU'") == 'Cantù'
+        assert luoghi.normalizza("FORLI'") == 'Forlì'
+    finally:
+        luoghi.configura(None)
+    # Senza il CSV si torna alle regole (cache svuotata)
+    assert 'ortisei' not in luoghi.indice()
+    assert luoghi.normalizza("CANTU'") == "Cantu'"
@@ -0,0 +1,123 @@
+# Cartelle dei batch: stato dai file, spazio liberato in ordine LRU, pulizia all'avvio
+# e timer di pulizia che conta dall'ultimo accesso
+import os
+import time
+
+import pytest
+
+import engine
+import magazzino
+
+MB = 1024 * 1024
+
+
+def _batch(root, nome, stato, mb=1, accesso=1000):
+    path = root / nome
+    path.mkdir()
+    (path / 'diplomi.pdf').write_bytes(b'x' * (mb * MB))
+    if stato != magazzino.STATO_ORFANO:
+        (path / engine.MANIFEST_FILENAME).write_text('{}\n')
+    if stato in (magazzino.STATO_CONCLUSO, magazzino.STATO_ARCHIVIATO):
+        engine.scrivi_batch_info({'temp_dir': str(path), 'archived': stato == magazzino.STATO_ARCHIVIATO})
+    os.utime(path, (accesso, accesso))
+    return path
+
+
+def test_stato_dai_file(tmp_path):
+    for stato in (magazzino.STATO_IN_GENERAZIONE, magazzino.STATO_CONCLUSO, magazzino.STATO_ARCHIVIATO,
+                  magazzino.STATO_ORFANO):
+        assert magazzino.stato_batch(str(_batch(tmp_path, stato, stato))) == stato
+    elenco = {b['id']: b for b in magazzino.batch(str(tmp_path))}
+    assert elenco[magazzino.STATO_CONCLUSO]['byte'] >= MB
+    assert magazzino.batch(str(tmp_path / 'assente')) == []
+
+
+def test_libera_spazio_lru_prima_gli_archiviati(tmp_path):
+    _batch(tmp_path, 'vecchio', magazzino.STATO_CONCLUSO, accesso=1000)
+    _batch(tmp_path, 'recente', magazzino.STATO_CONCLUSO, accesso=3000)
+    _batch(tmp_path, 'archiviato', magazzino.STATO_ARCHIVIATO, accesso=5000)
+    _batch(tmp_path, 'in_corso', magazzino.STATO_IN_GENERAZIONE, accesso=1)
+    # Poco più di 4 MB occupati, quota 5 MB, ne servono 2.5: vanno liberati due batch
+    assert magazzino.libera_spazio(str(tmp_path), 2.5, quota_mb=5) == ['archiviato', 'vecchio']
+    assert sorted(os.listdir(tmp_path)) == ['in_corso', 'recente']
+    # Entro la quota: nessuna rimozione
+    assert magazzino.libera_spazio(str(tmp_path), 1, quota_mb=5) == []
+
+
+@pytest.mark.parametrize('prefisso', [magazzino.PREFISSO_RITENTATIVO, magazzino.PREFISSO_CORREZIONE])
+def test_batch_con_lavoro_in_corso_non_rimosso(tmp_path, prefisso):
+    root = tmp_path / 'root'
+    root.mkdir()
+    (_batch(root, 'occupato', magazzino.STATO_ARCHIVIATO, accesso=1000) / f'{prefisso}abc').mkdir()
+    _batch(root, 'libero', magazzino.STATO_CONCLUSO, accesso=2000)
+    assert magazzino.libera_spazio(str(root), 10, quota_mb=5) == ['libero']
+    assert os.path.isdir(root / 'occupato')
+    assert magazzino.libera_spazio(str(root), 10, quota_mb=5, escludi=('occupato',)) == []
+
+
+def test_spazza_all_avvio(tmp_path):
+    now = 100000
+    _batch(tmp_path, 'scaduto', magazzino.STATO_CONCLUSO, accesso=now - 7200)
+    _batch(tmp_path, 'valido', magazzino.STATO_ARCHIVIATO, accesso=now - 600)
+    _batch(tmp_path, 'orfano', magazzino.STATO_ORFANO, accesso=now - 2 * magazzino.ETA_MINIMA_ORFANI)
+    _batch(tmp_path, 'appena_creato', magazzino.STATO_ORFANO, accesso=now - 10)
+    _batch(tmp_path, 'interrotto', magazzino.STATO_IN_GENERAZIONE, accesso=0)
+    rimossi, da_programmare = magazzino.spazza(str(tmp_path), 3600, now=now)
+    assert sorted(rimossi) == ['orfano', 'scaduto']
+    assert da_programmare == [('valido', 3000)]
+    assert sorted(os.listdir(tmp_path)) == ['appena_creato', 'interrotto', 'valido']
+
+
+def test_stato_senza_leggere_batch_json(tmp_path):
+    path = _batch(tmp_path, 'archiviato', magazzino.STATO_ARCHIVIATO)
+    assert (path / engine.ARCHIVIATO_FILENAME).exists()
+    (path / engine.BATCH_INFO_FILENAME).write_text('non è JSON')
+    assert magazzino.stato_batch(str(path)) == magazzino.STATO_ARCHIVIATO
+
+
+def test_spazio_per_stato(tmp_path):
+    _batch(tmp_path, 'a', magazzino.STATO_CONCLUSO, mb=1)
+    _batch(tmp_path, 'b', magazzino.STATO_CONCLUSO, mb=2)
+    _batch(tmp_path, 'c', magazzino.STATO_IN_GENERAZIONE, mb=1)
+    spazio = magazzino.spazio_per_stato(magazzino.batch(str(tmp_path)))
+    assert spazio[magazzino.STATO_ARCHIVIATO] == spazio[magazzino.STATO_ORFANO] == 0
+    assert 3 * MB <= spazio[magazzino.STATO_CONCLUSO] < 3 * MB + 4096
+    assert MB <= spazio[magazzino.STATO_IN_GENERAZIONE] < MB + 4096
+
+
+def test_scadenza_dall_ultimo_accesso(tmp_path):
+    now = 100000
+    path = str(_batch(tmp_path, 'b', magazzino.STATO_CONCLUSO, accesso=now - 600))
+    assert magazzino.secondi_alla_scadenza(path, 3600, now=now) == 3000
+    assert magazzino.secondi_alla_scadenza(path, 3600, now=now + 3600) == 0
+    os.mkdir(os.path.join(path, f'{magazzino.PREFISSO_CORREZIONE}abc'))
+    os.utime(path, (now - 600, now - 600))
+    assert magazzino.secondi_alla_scadenza(path, 3600, now=now + 3600) == 3600
+
+
+@pytest.fixture
+def app_pulizia(tmp_path, monkeypatch):
+    import app
+    monkeypatch.setitem(app.app.config, 'BATCH_ROOT', str(tmp_path))
+    programmati = []
+    monkeypatch.setattr(app, 'programma_pulizia', lambda batch_id, secondi: programmati.append((batch_id, secondi)))
+    return app, programmati
+
+
+def test_pulizia_rimandata_dopo_un_accesso(tmp_path, app_pulizia):
+    app, programmati = app_pulizia
+    path = _batch(tmp_path, 'usato', magazzino.STATO_CONCLUSO, accesso=time.time() - 600)
+    app.cleanup_batch_data('usato')
+    assert path.is_dir()
+    [(batch_id, secondi)] = programmati
+    assert batch_id == 'usato' and app.CLEANUP_DELAY_SECONDS - 610 < secondi <= app.CLEANUP_DELAY_SECONDS - 600
+
+
+def test_pulizia_alla_scadenza(tmp_path, app_pulizia):
+    app, programmati = app_pulizia
+    scaduto = time.time() - app.CLEANUP_DELAY_SECONDS - 1
+    _batch(tmp_path, 'scaduto', magazzino.STATO_ARCHIVIATO, accesso=scaduto)
+    _batch(tmp_path, 'in_corso', magazzino.STATO_IN_GENERAZIONE, accesso=scaduto)
+    app.cleanup_batch_data('scaduto')
+    app.cleanup_batch_data('in_corso')
+    assert os.listdir(tmp_path) == ['in_corso'] and programmati == []
@@ -0,0 +1,58 @@
+# Checkpoint dei batch: esiti letti dal manifest e lock di generazione tra processi.
+import os
+import subprocess
+import sys
+
+import engine
+from conftest import RADICE
+from tabella import TabellaStudenti
+
+
+def _batch(tmp_path, n=3):
+    studenti = TabellaStudenti.da_record([{'NOM_COG': f'STUD {i}', 'MATRI': str(i)} for i in range(n)])
+    engine.scrivi_manifest(str(tmp_path), studenti, '2026-01-01', facolta='ICI')
+    return str(tmp_path)
+
+
+def test_leggi_manifest_conta_solo_i_record_riusciti(tmp_path):
+    dest = _batch(tmp_path)
+    (tmp_path / 'a.pdf').write_bytes(b'%PDF')
+    engine.registra_esito(dest, {'indice': 0, 'stato': 'OK', 'files': ['a.pdf']})
+    engine.registra_esito(dest, {'indice': 1, 'stato': 'ERRORE', 'files': []})
+    engine.registra_esito(dest, {'indice': 2, 'stato': 'OK', 'files': ['mancante.pdf']})
+    with open(os.path.join(dest, engine.MANIFEST_FILENAME), 'a', encoding='utf-8') as f:
+        f.write('{"indice": 1, "sta')  # ultima riga troncata dalla morte del processo
+    intestazione, conclusi = engine.leggi_manifest(dest)
+    assert list(conclusi) == [0]
+    assert len(intestazione['students_data']) == 3
+    assert intestazione['parametri'] == {'facolta': 'ICI'}
+
+
+def test_batch_interrotti(tmp_path):
+    interrotto = tmp_path / 'a'
+    concluso = tmp_path / 'b'
+    for d in (interrotto, concluso, tmp_path / 'senza_manifest'):
+        d.mkdir()
+    _batch(interrotto)
+    _batch(concluso)
+    (concluso / engine.BATCH_INFO_FILENAME).write_text('{}')
+    assert engine.batch_interrotti(str(tmp_path)) == [str(interrotto)]
+
+
+def _rivendica_in_altro_processo(dest):
+    codice = f"import engine; fd = engine.rivendica_batch({dest!r}); print(fd is not None)"
+    risultato = subprocess.run([sys.executable, '-c', codice], cwd=RADICE, capture_output=True, text=True,
+                               env=dict(os.environ, PYTHONPATH=RADICE), timeout=60)
+    assert risultato.returncode == 0, risultato.stderr
+    return risultato.stdout.strip() == 'True'
+
+
+def test_rivendicazione_esclusiva_tra_processi(tmp_path):
+    dest = _batch(tmp_path)
+    fd = engine.rivendica_batch(dest)
+    assert fd is not None
+    try:
+        assert not _rivendica_in_altro_processo(dest)
+    finally:
+        engine.rilascia_batch(fd)
+    assert _rivendica_in_altro_processo(dest)
@@ -0,0 +1,71 @@
+# PDF cumulativi: diplomi, camicie e intercalato (diploma e camicia di ogni studente) in una passata
+import pytest
+
+import engine
+
+NOME_CARTELLA = '2026-01-01'
+
+
+def _esiti(crea_pdf, dest, n, senza_camicia=()):
+    # Studente i: diploma di larghezza 100*(i+1), camicia di larghezza 100*(i+1)+50
+    esiti = []
+    for i in range(n):
+        files = [f'diploma_{i}.pdf']
+        crea_pdf(dest / files[0], [100 * (i + 1)])
+        if i not in senza_camicia:
+            files.append(f'camicia_{i}.pdf')
+            crea_pdf(dest / files[1], [100 * (i + 1) + 50])
+        esiti.append({'indice': i, 'files': files})
+    return esiti
+
+
+def test_modi_cumulativi():
+    try:
+        engine.configura_cumulativi('entrambi')
+        assert engine.MergeIncrementale('.', NOME_CARTELLA, []).tipi == ('diplomi', 'camicie', 'intercalato')
+        with pytest.raises(ValueError):
+            engine.configura_cumulativi('tutti')
+    finally:
+        engine.configura_cumulativi('separati')
+    assert engine.MergeIncrementale('.', NOME_CARTELLA, []).tipi == ('diplomi', 'camicie')
+
+
+def test_cumulativi_separati_e_intercalato(tmp_path, crea_pdf, larghezze_pagine):
+    esiti = _esiti(crea_pdf, tmp_path, 3, senza_camicia=(1,))
+    merge = engine.MergeIncrementale(str(tmp_path), NOME_CARTELLA, range(3),
+                                     tipi=engine.MODI_CUMULATIVI['entrambi'])
+    for esito in esiti:
+        merge.aggiungi(esito)
+    nomi = merge.concludi()
+    assert nomi == [engine.nome_cumulativo(tipo, NOME_CARTELLA) for tipo in ('diplomi', 'camicie', 'intercalato')]
+    diplomi, camicie, intercalato = (tmp_path / nome for nome in nomi)
+    assert larghezze_pagine(diplomi) == [100, 200, 300]
+    assert larghezze_pagine(camicie) == [150, 350]
+    assert larghezze_pagine(intercalato) == [100, 150, 200, 300, 350]
+
+
+def test_merge_con_esiti_fuori_ordine(tmp_path, crea_pdf, larghezze_pagine):
+    esiti = _esiti(crea_pdf, tmp_path, 4)
+    merge = engine.MergeIncrementale(str(tmp_path), NOME_CARTELLA, range(4))
+    # Il record 0 arriva per ultimo: fino ad allora nessuna pagina entra nei cumulativi
+    for i in (2, 1, 3):
+        merge.aggiungi(esiti[i])
+    assert not merge.completo
+    with pytest.raises(RuntimeError, match='manca il record 0'):
+        merge.concludi()
+    merge.aggiungi(esiti[0])
+    assert merge.completo
+    diplomi, camicie = (tmp_path / nome for nome in merge.concludi())
+    assert larghezze_pagine(diplomi) == [100, 200, 300, 400]
+    assert larghezze_pagine(camicie) == [150, 250, 350, 450]
+
+
+def test_merge_solo_dei_record_in_indici(tmp_path, crea_pdf, larghezze_pagine):
+    # Ritentativo: indici con buchi (i record falliti mancano) e nessun file per un record
+    esiti = _esiti(crea_pdf, tmp_path, 4)
+    esiti[3]['files'] = []
+    merge = engine.MergeIncrementale(str(tmp_path), NOME_CARTELLA, [3, 0, 2])
+    for i in (0, 2, 3):
+        merge.aggiungi(esiti[i])
+    diplomi, _ = (tmp_path / nome for nome in merge.concludi())
+    assert larghezze_pagine(diplomi) == [100, 300]
@@ -0,0 +1,62 @@
+# Metriche di rendering: i conteggi della cache degli asset viaggiano nell'esito
+# del record e vengono sommati nel processo padre.
+import engine
+import metrics
+
+
+def test_fetcher_conta_hit_e_miss_del_documento(tmp_path, monkeypatch):
+    (tmp_path / 'img').mkdir()
+    (tmp_path / 'img' / 'firma.png').write_bytes(b'firma')
+    monkeypatch.setattr(engine, 'STATIC_DIR', str(tmp_path))
+    monkeypatch.setattr(engine, '_asset_cache', {'img/logo.png': b'logo'})
+    engine._conteggio_asset.valori = conteggio = [0, 0]
+    try:
+        logo = engine.static_url_fetcher('http://localhost/static/img/logo.png')
+        engine.static_url_fetcher('http://localhost/static/img//logo.png')
+        firma = engine.static_url_fetcher('http://localhost/static/img/firma.png')
+        engine.static_url_fetcher('http://localhost/static/img/firma.png')
+    finally:
+        engine._conteggio_asset.valori = None
+    assert (logo['string'], firma['string']) == (b'logo', b'firma')
+    assert conteggio == [3, 1]
+
+
+def test_registra_metriche_somma_gli_asset_nel_padre(monkeypatch):
+    monkeypatch.setattr(metrics, 'RENDER_CACHE', metrics.CacheStats())
+    tempi = {'jinja': 0.0, 'layout': 0.0, 'write': 0.0, 'cache_hit': True, 'asset_hit': 5, 'asset_miss': 1}
+    esito = {'indice': 0, 'modulo': 'M', 'tempi': {'diploma': tempi, 'camicia': dict(tempi, cache_hit=False)}}
+    engine.registra_metriche(esito)
+    assert (metrics.RENDER_CACHE.hits, metrics.RENDER_CACHE.misses) == (11, 3)
+
+
+def test_registra_metriche_esiti_senza_conteggio_asset(monkeypatch):
+    monkeypatch.setattr(metrics, 'RENDER_CACHE', metrics.CacheStats())
+    tempi = {'jinja': 0.0, 'layout': 0.0, 'write': 0.0, 'cache_hit': True}
+    engine.registra_metriche({'indice': 0, 'modulo': 'M', 'tempi': {'diploma': tempi}})
+    assert (metrics.RENDER_CACHE.hits, metrics.RENDER_CACHE.misses) == (1, 0)
+
+
+def test_collector_una_volta_per_lettura():
+    registro = metrics.Registry()
+    spazio = registro.register(metrics.Gauge('spazio_bytes', 'Spazio per stato', ('stato',)))
+    letture = []
+
+    def raccogli():
+        letture.append(1)
+        spazio.set(10 * len(letture), stato='concluso')
+    registro.register_collector(raccogli)
+    assert 'spazio_bytes{stato="concluso"} 10' in registro.render()
+    assert 'spazio_bytes{stato="concluso"} 20' in registro.render()
+    assert len(letture) == 2
+
+
+def test_spazio_dei_batch_per_stato(tmp_path, monkeypatch):
+    import app
+    monkeypatch.setitem(app.app.config, 'BATCH_ROOT', str(tmp_path))
+    (tmp_path / 'b').mkdir()
+    (tmp_path / 'b' / engine.MANIFEST_FILENAME).write_text('{}\n')
+    testo = metrics.REGISTRY.render()
+    assert 'generatore_batch_disk_usage_bytes{stato="in_generazione"} 3' in testo
+    assert 'generatore_batch_disk_usage_bytes{stato="concluso"} 0' in testo
+    assert 'generatore_temp_disk_usage_bytes 3' in testo
+    assert 'batch="' not in testo
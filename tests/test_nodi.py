@@ -0,0 +1,109 @@
+# Render su più nodi: un nodo che risponde male va in pausa, i suoi record vengono ritentati
+import io
+import json
+import threading
+import zipfile
+from http.client import IncompleteRead
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import engine
+import nodi
+from tabella import TabellaStudenti
+
+
+def _risposta_valida(voci):
+    # Come nodi.zip_blocco: esiti.json più un PDF per voce
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        zf.writestr(nodi.ESITI_FILENAME, json.dumps([{'indice': v['indice'], 'stato': 'OK',
+                                                      'files': [f"diploma_{v['indice']}.pdf"]} for v in voci]))
+        for n, v in enumerate(voci):
+            zf.writestr(f"{n}/diploma_{v['indice']}.pdf", b'%PDF-' + str(v['indice']).encode())
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def nodo_finto(monkeypatch):
+    """Nodo HTTP che tronca le prime `troncate` risposte (Content-Length più lungo del corpo)."""
+    monkeypatch.setattr(nodi, 'PAUSA_NODO_GUASTO', 0)
+    stato = {'troncate': 0, 'richieste': 0}
+
+    class Gestore(BaseHTTPRequestHandler):
+        def do_POST(self):
+            voci = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['voci']
+            stato['richieste'] += 1
+            corpo = _risposta_valida(voci)
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            if stato['troncate'] > 0:
+                stato['troncate'] -= 1
+                self.wfile.write(corpo[:10])
+                self.close_connection = True
+                return
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Gestore)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}', stato
+    server.shutdown()
+    server.server_close()
+
+
+def _studente(i):
+    return TabellaStudenti.da_record([{'NOM_COG': f'STUD {i}'}])[0]
+
+
+def test_blocco_reso_dal_nodo(nodo_finto, tmp_path):
+    url, stato = nodo_finto
+    esecutore = nodi.EsecutoreRemoto([url], blocco=8, connessioni=1, timeout=10)
+    try:
+        futures = [esecutore.submit(engine.render_record, i, _studente(i), str(tmp_path)) for i in range(3)]
+        assert [f.result(timeout=10)['indice'] for f in futures] == [0, 1, 2]
+        assert sorted(p.name for p in tmp_path.iterdir()) == [f'diploma_{i}.pdf' for i in range(3)]
+        assert (tmp_path / 'diploma_2.pdf').read_bytes() == b'%PDF-2'
+        with pytest.raises(ValueError):
+            esecutore.submit(engine.prepara_record, 0, _studente(0), str(tmp_path))
+    finally:
+        esecutore.shutdown()
+
+
+def test_voce_da_json():
+    voce = nodi._voce_da_json({'indice': 4, 'studente': {'NOM_COG': 'MARIO ROSSI', 'MATRI': '7'}})
+    assert voce['indice'] == 4 and voce['profilo'] is False and voce['budget'] is None
+    assert dict(voce['studente']) == {'NOM_COG': 'MARIO ROSSI', 'MATRI': '7'}
+
+
+def test_risposta_troncata_ritentata(nodo_finto, tmp_path):
+    url, stato = nodo_finto
+    stato['troncate'] = 1
+    esecutore = nodi.EsecutoreRemoto([url], blocco=2, connessioni=1, timeout=10)
+    try:
+        futures = [esecutore.submit(engine.render_record, i, _studente(i), str(tmp_path)) for i in range(2)]
+        assert [f.result(timeout=10)['indice'] for f in futures] == [0, 1]
+        assert (tmp_path / 'diploma_1.pdf').read_bytes() == b'%PDF-1'
+        assert stato['richieste'] >= 2
+    finally:
+        esecutore.shutdown()
+
+
+def test_nodo_sempre_guasto_errore_e_thread_vivo(nodo_finto, tmp_path):
+    url, stato = nodo_finto
+    stato['troncate'] = 2
+    esecutore = nodi.EsecutoreRemoto([url], blocco=1, connessioni=1, timeout=10)
+    try:
+        # Un tentativo per nodo, poi il record va in errore con l'eccezione del nodo
+        future = esecutore.submit(engine.render_record, 0, _studente(0), str(tmp_path))
+        with pytest.raises(IncompleteRead):
+            future.result(timeout=10)
+        assert all(t.is_alive() for t in esecutore._threads)
+        # Il nodo torna a rispondere: lo stesso thread serve il record successivo
+        future = esecutore.submit(engine.render_record, 1, _studente(1), str(tmp_path))
+        assert future.result(timeout=10)['stato'] == 'OK'
+    finally:
+        esecutore.shutdown()
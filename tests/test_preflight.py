@@ -0,0 +1,97 @@
+# Verifica preliminare: ogni classe di errore e di avviso sulle righe giuste,
+# più il report testuale.
+import pytest
+
+import engine
+import preflight
+from tabella import TabellaStudenti
+
+
+@pytest.fixture
+def cartelle(tmp_path, monkeypatch):
+    templates = tmp_path / 'templates'
+    imglib = tmp_path / 'imglib'
+    templates.mkdir()
+    imglib.mkdir()
+    (templates / 'diploma_ok.html').write_text('')
+    (imglib / 'rettore.png').write_bytes(b'')
+    monkeypatch.setattr(engine, 'TEMPLATES_DIR', str(templates))
+    monkeypatch.setattr(engine, 'TEMPLATE_REGISTRY', {'ok': 'diploma_ok.html', 'senza': 'diploma_senza.html'})
+    monkeypatch.setattr(preflight, 'IMGLIB_DIR', str(imglib))
+    return tmp_path
+
+
+def _riga(**campi):
+    riga = {'NOM_COG': 'MARIO ROSSI', 'MODULO': 'ok', 'DATALAUR': '2025', 'PROTOCOL': '123/4', 'FIRMAR': 'rettore'}
+    riga.update(campi)
+    return riga
+
+
+def _verifica(*righe):
+    return preflight.verifica(TabellaStudenti.da_record(list(righe)))
+
+
+def _controlli(report):
+    return {(p['livello'], p['controllo']): p for p in report['problemi']}
+
+
+def test_batch_pulito(cartelle):
+    report = _verifica(_riga(), _riga(DATALAUR='15/07/2025'), _riga(FIRMAR='rettore.png'))
+    assert (report['record'], report['errori'], report['avvisi'], report['problemi']) == (3, 0, 0, [])
+
+
+def test_template_mancante(cartelle):
+    p = _controlli(_verifica(_riga(), _riga(MODULO='senza')))[('errore', 'template_mancante')]
+    assert (p['campo'], p['valore'], p['righe']) == ('MODULO', 'senza', [1])
+
+
+def test_immagine_mancante(cartelle):
+    p = _controlli(_verifica(_riga(FIRMAR='prorettore'), _riga(), _riga(FIRMAR='prorettore')))
+    p = p[('errore', 'immagine_mancante')]
+    assert (p['campo'], p['valore'], p['righe']) == ('FIRMAR', 'prorettore', [0, 2])
+    assert 'prorettore.png' in p['messaggio']
+
+
+def test_imglib_mancante(cartelle, monkeypatch):
+    monkeypatch.setattr(preflight, 'IMGLIB_DIR', str(cartelle / 'non_esiste'))
+    report = _verifica(_riga())
+    assert ('errore', 'imglib_mancante') in _controlli(report)
+    assert report['errori'] == 1
+
+
+def test_nome_vuoto(cartelle):
+    p = _controlli(_verifica(_riga(), _riga(NOM_COG='  ')))[('errore', 'nome_vuoto')]
+    assert p['righe'] == [1]
+
+
+def test_colonna_nome_mancante(cartelle):
+    riga = _riga()
+    del riga['NOM_COG']
+    assert ('errore', 'colonna_mancante') in _controlli(_verifica(riga))
+
+
+def test_avvisi(cartelle):
+    report = _verifica(_riga(MODULO='ignoto'), _riga(DATALAUR='31/02/2025'), _riga(DATALAUR='25'),
+                       _riga(PROTOCOL='1234'))
+    problemi = _controlli(report)
+    assert (report['errori'], report['avvisi']) == (0, 4)
+    assert problemi[('avviso', 'modulo_sconosciuto')]['righe'] == [0]
+    datalaur = sorted((p['valore'], p['righe']) for p in report['problemi'] if p['controllo'] == 'datalaur_malformata')
+    assert datalaur == [('25', [2]), ('31/02/2025', [1])]
+    assert problemi[('avviso', 'protocollo_senza_barra')]['righe'] == [3]
+
+
+def test_errori_prima_degli_avvisi(cartelle):
+    report = _verifica(_riga(MODULO='ignoto'), _riga(NOM_COG=''))
+    assert [p['livello'] for p in report['problemi']] == ['errore', 'avviso']
+
+
+def test_testo_report(cartelle):
+    studenti = TabellaStudenti.da_record([_riga(MODULO='senza', NOM_COG='ANNA BIANCHI')] +
+                                         [_riga(PROTOCOL='1')] * 12)
+    report = preflight.verifica(studenti)
+    righe = preflight.testo_report(report, studenti).split('\n')
+    assert righe[0].startswith('Verifica preliminare: 13 record, 1 errori, 1 avvisi (')
+    assert righe[1] == "ERRORE: Template 'diploma_senza.html' del modulo 'senza' non trovato - righe 1 (ANNA BIANCHI)"
+    assert righe[2] == ("AVVISO: PROTOCOL senza '/' (atteso numero/progressivo) - righe "
+                        "2, 3, 4, 5, 6, 7, 8, 9, 10, 11 ...")
@@ -0,0 +1,113 @@
+# Pubblicazione dei file: reflink, poi hard link, poi copia; il file compare nella
+# destinazione con un nome temporaneo nascosto e os.replace.
+import errno
+import os
+import shutil
+
+import pytest
+
+import archive
+import pubblica
+
+
+def _non_supportato(codice):
+    def funzione(src, tmp):
+        raise OSError(codice, os.strerror(codice))
+    return funzione
+
+
+@pytest.fixture
+def sorgente(tmp_path):
+    src = tmp_path / 'batch' / 'diplomi.pdf'
+    src.parent.mkdir()
+    src.write_bytes(b'%PDF-diplomi')
+    (tmp_path / 'dest').mkdir()
+    return src
+
+
+def _visibili(cartella):
+    return sorted(os.listdir(cartella))
+
+
+def test_reflink(sorgente, tmp_path, monkeypatch):
+    # Un clone copy-on-write è un file indipendente con lo stesso contenuto
+    monkeypatch.setattr(pubblica, '_reflink', shutil.copyfile)
+    dest = tmp_path / 'dest' / 'diplomi.pdf'
+    assert pubblica.pubblica(str(sorgente), str(dest)) == pubblica.MODO_REFLINK
+    assert dest.read_bytes() == b'%PDF-diplomi'
+    assert not os.path.samefile(sorgente, dest)
+
+
+def test_senza_reflink_hard_link(sorgente, tmp_path, monkeypatch):
+    monkeypatch.setattr(pubblica, '_reflink', _non_supportato(errno.EOPNOTSUPP))
+    dest = tmp_path / 'dest' / 'diplomi.pdf'
+    assert pubblica.pubblica(str(sorgente), str(dest)) == pubblica.MODO_HARDLINK
+    assert os.path.samefile(sorgente, dest)
+    assert _visibili(dest.parent) == ['diplomi.pdf']
+
+
+def test_senza_hard_link_copia(sorgente, tmp_path, monkeypatch):
+    monkeypatch.setattr(pubblica, '_reflink', _non_supportato(errno.EOPNOTSUPP))
+    monkeypatch.setattr(os, 'link', _non_supportato(errno.EXDEV))
+    dest = tmp_path / 'dest' / 'diplomi.pdf'
+    assert pubblica.pubblica(str(sorgente), str(dest)) == pubblica.MODO_COPIA
+    assert dest.read_bytes() == b'%PDF-diplomi' and not os.path.samefile(sorgente, dest)
+
+
+def test_hardlink_false_copia(sorgente, tmp_path, monkeypatch):
+    monkeypatch.setattr(pubblica, '_reflink', _non_supportato(errno.EXDEV))
+    dest = tmp_path / 'dest' / 'diplomi.pdf'
+    assert pubblica.pubblica(str(sorgente), str(dest), hardlink=False) == pubblica.MODO_COPIA
+    assert not os.path.samefile(sorgente, dest)
+
+
+def test_nome_temporaneo_e_replace(sorgente, tmp_path, monkeypatch):
+    dest = tmp_path / 'dest' / 'diplomi.pdf'
+    dest.write_bytes(b'vecchio')
+    sostituzioni = []
+    replace = os.replace
+
+    def osserva(tmp, finale):
+        sostituzioni.append((tmp, finale, open(tmp, 'rb').read()))
+        replace(tmp, finale)
+
+    monkeypatch.setattr(os, 'replace', osserva)
+    pubblica.pubblica(str(sorgente), str(dest))
+    [(tmp, finale, contenuto)] = sostituzioni
+    cartella, nome = os.path.split(tmp)
+    assert cartella == str(dest.parent) and nome.startswith('.diplomi.pdf.') and nome.endswith('.tmp')
+    assert (finale, contenuto) == (str(dest), b'%PDF-diplomi')
+    assert dest.read_bytes() == b'%PDF-diplomi' and _visibili(dest.parent) == ['diplomi.pdf']
+
+
+def test_errore_non_previsto_non_lascia_temporanei(sorgente, tmp_path, monkeypatch):
+    monkeypatch.setattr(pubblica, '_reflink', _non_supportato(errno.ENOSPC))
+    dest = tmp_path / 'dest' / 'diplomi.pdf'
+    with pytest.raises(OSError):
+        pubblica.pubblica(str(sorgente), str(dest))
+    assert _visibili(dest.parent) == []
+
+
+def test_nuova_cartella(tmp_path):
+    dest = tmp_path / 'Stampa_ICI'
+    with pubblica.nuova_cartella(str(dest)) as tmp_dir:
+        assert not dest.exists() and os.path.basename(tmp_dir).startswith('.Stampa_ICI.')
+        open(os.path.join(tmp_dir, 'Elenco.txt'), 'w').close()
+    assert _visibili(dest) == ['Elenco.txt'] and _visibili(tmp_path) == ['Stampa_ICI']
+
+
+def test_nuova_cartella_con_errore(tmp_path):
+    with pytest.raises(RuntimeError), pubblica.nuova_cartella(str(tmp_path / 'Stampa_ICI')):
+        raise RuntimeError('stampa interrotta')
+    assert _visibili(tmp_path) == []
+
+
+def test_archivi_senza_hard_link(sorgente, tmp_path, monkeypatch):
+    monkeypatch.setattr(pubblica, '_reflink', _non_supportato(errno.EOPNOTSUPP))
+    archivi = [tmp_path / 'Archivio_Locale', tmp_path / 'Archivio_Franco']
+    for cartella in archivi:
+        cartella.mkdir()
+    archive.copia_negli_archivi(str(sorgente), [str(c) for c in archivi])
+    for cartella in archivi:
+        copia = cartella / 'diplomi.pdf'
+        assert copia.read_bytes() == b'%PDF-diplomi' and not os.path.samefile(sorgente, copia)
@@ -0,0 +1,80 @@
+# Assegnazione degli slot: priorità, equità tra facoltà e ordine di arrivo (scheduler._scegli),
+# più l'avanzamento letto dal manifest da un worker che non ha il job.
+import engine
+import scheduler
+from tabella import TabellaStudenti
+
+
+def _scheduler():
+    return scheduler.RenderScheduler(4, soglia_piccoli=5, crea_pool=lambda slots, warmup: None)
+
+
+def _aggiungi(sched, batch_id, facolta, n, urgente=False):
+    studenti = TabellaStudenti.da_record([{'NOM_COG': f'STUD {i}'} for i in range(n)])
+    job = scheduler.Job(batch_id, facolta, studenti, '/nonusata', 'x', on_complete=None,
+                        urgente=urgente, concludi=lambda esiti: None)
+    job.sequenza = next(sched._sequenza)
+    job.classe = scheduler.classe_batch(urgente, job.totale, sched.soglia_piccoli)
+    sched._jobs[batch_id] = job
+    return job
+
+
+def _assegna(sched):
+    # La contabilità di _assegna, senza pool
+    job = sched._scegli()
+    job.prossimo += 1
+    job.in_volo += 1
+    sched._in_volo_facolta[job.facolta] = sched._in_volo_facolta.get(job.facolta, 0) + 1
+    sched._ultimo_servizio[job.facolta] = next(sched._turno)
+    return job.batch_id
+
+
+def test_classe_batch():
+    assert scheduler.classe_batch(True, 1000, 20) == scheduler.CLASSE_URGENTE
+    assert scheduler.classe_batch(False, 20, 20) == scheduler.CLASSE_PICCOLO
+    assert scheduler.classe_batch(False, 21, 20) == scheduler.CLASSE_NORMALE
+
+
+def test_urgenti_e_piccoli_prima_dei_normali():
+    sched = _scheduler()
+    _aggiungi(sched, 'grande', 'ICI', 50)
+    _aggiungi(sched, 'piccolo', 'GIUR', 3)
+    _aggiungi(sched, 'urgente', 'ECON', 50, urgente=True)
+    assert _assegna(sched) == 'urgente'
+    sched._jobs['urgente'].prossimo = len(sched._jobs['urgente'].da_fare)
+    assert _assegna(sched) == 'piccolo'
+
+
+def test_facolta_diverse_si_alternano():
+    sched = _scheduler()
+    _aggiungi(sched, 'ici', 'ICI', 50)
+    _aggiungi(sched, 'giur', 'GIUR', 50)
+    assert [_assegna(sched) for _ in range(4)] == ['ici', 'giur', 'ici', 'giur']
+
+
+def test_stessa_facolta_in_ordine_di_arrivo():
+    sched = _scheduler()
+    _aggiungi(sched, 'primo', 'ICI', 30)
+    _aggiungi(sched, 'secondo', 'ICI', 30)
+    assert {_assegna(sched) for _ in range(30)} == {'primo'}
+    assert _assegna(sched) == 'secondo'
+
+
+def test_posizione_in_coda():
+    sched = _scheduler()
+    _aggiungi(sched, 'primo', 'ICI', 30)
+    _aggiungi(sched, 'secondo', 'ICI', 30)
+    _aggiungi(sched, 'altra', 'GIUR', 30)
+    assert sched.stato('secondo')['posizione'] == 2
+    # Un'altra facoltà non aspetta i batch di ICI
+    assert sched.stato('altra')['posizione'] == 1
+
+
+def test_avanzamento_dal_manifest(tmp_path):
+    studenti = TabellaStudenti.da_record([{'NOM_COG': f'STUD {i}'} for i in range(4)])
+    engine.scrivi_manifest(str(tmp_path), studenti, 'x', facolta='ICI', urgente=True)
+    for indice, stato in ((0, 'OK'), (2, 'ERRORE'), (2, 'OK')):
+        engine.registra_esito(str(tmp_path), {'indice': indice, 'stato': stato, 'files': []})
+    parametri, totale, completati = engine.avanzamento_manifest(str(tmp_path))
+    assert (parametri['facolta'], parametri['urgente'], totale, completati) == ('ICI', True, 4, 2)
+    assert engine.avanzamento_manifest(str(tmp_path / 'assente')) is None
@@ -0,0 +1,98 @@
+# Spool di stampa: limiti per parte, unità di stampa dal manifest e divisione dei
+# cumulativi tra uno studente e l'altro
+import pytest
+
+import engine
+import stampa
+from tabella import TabellaStudenti
+
+
+def _unita(riga, pagine_diploma=1, pagine_camicia=1, kb=100, solo_diploma=False):
+    pagine = {'diplomi': pagine_diploma} if solo_diploma else {'diplomi': pagine_diploma, 'camicie': pagine_camicia}
+    return {'riga': riga, 'files': {tipo: [f'{tipo}_{riga}.pdf'] for tipo in pagine},
+            'pagine': pagine, 'byte': {tipo: kb * 1024 for tipo in pagine}}
+
+
+def _righe(parti):
+    return [[u['riga'] for u in parte] for parte in parti]
+
+
+def test_limiti_spool():
+    assert stampa.limiti_spool() is None
+    assert stampa.limiti_spool('0', '') is None
+    assert stampa.limiti_spool(500) == {'pagine': 500, 'byte': 0}
+    assert stampa.limiti_spool(0, 1.5) == {'pagine': 0, 'byte': 1572864}
+    assert stampa.limiti_spool(-3, 2) == {'pagine': 0, 'byte': 2 * 1024 * 1024}
+
+
+def test_parti_per_pagine():
+    unita = [_unita(i) for i in range(7)]
+    parti = stampa.dividi_in_parti(unita, {'pagine': 3, 'byte': 0})
+    assert _righe(parti) == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_limite_su_ogni_cumulativo():
+    # Le camicie di due pagine raggiungono il limite prima dei diplomi
+    unita = [_unita(i, pagine_camicia=2) for i in range(4)]
+    assert _righe(stampa.dividi_in_parti(unita, {'pagine': 4, 'byte': 0})) == [[0, 1], [2, 3]]
+
+
+def test_parti_per_byte_e_pagine():
+    unita = [_unita(0, kb=300), _unita(1, kb=300), _unita(2, kb=300), _unita(3)]
+    limiti = {'pagine': 10, 'byte': 700 * 1024}
+    assert _righe(stampa.dividi_in_parti(unita, limiti)) == [[0, 1], [2, 3]]
+
+
+def test_studente_oltre_il_limite_da_solo():
+    unita = [_unita(0), _unita(1, pagine_diploma=5), _unita(2)]
+    assert _righe(stampa.dividi_in_parti(unita, {'pagine': 2, 'byte': 0})) == [[0], [1], [2]]
+
+
+def test_studenti_senza_camicia():
+    # Conta solo il cumulativo in cui lo studente compare
+    unita = [_unita(0), _unita(1, solo_diploma=True), _unita(2, solo_diploma=True), _unita(3)]
+    parti = stampa.dividi_in_parti(unita, {'pagine': 3, 'byte': 0})
+    assert _righe(parti) == [[0, 1, 2], [3]]
+    assert stampa.dividi_in_parti([], {'pagine': 3, 'byte': 0}) == []
+
+
+def _batch_con_manifest(tmp_path, esiti):
+    studenti = TabellaStudenti.da_record([{'NOM_COG': 'MARIO ROSSI', 'MODULO': 'M'},
+                                          {'NOM_COG': 'MARIO ROSSI', 'MODULO': 'M'},
+                                          {'NOM_COG': 'ANNA BIANCHI', 'MODULO': 'M'}])
+    engine.scrivi_manifest(str(tmp_path), studenti, 'X')
+    for esito in esiti:
+        for f in esito['files']:
+            # Non sono PDF: le pagine devono venire dal manifest
+            (tmp_path / f).write_bytes(b'x' * 10)
+        engine.registra_esito(str(tmp_path), esito)
+    return {'temp_dir': str(tmp_path), 'original_folder_name': 'X',
+            'filenames': ['tutti_i_diplomi_X.pdf', 'diplomi_e_camicie_X.pdf'],
+            'metadata': {'student_list': studenti}}
+
+
+def _esito(indice, nome, pagine_diploma=2, stato='OK'):
+    files = [] if stato != 'OK' else [f'diploma_{nome}_M.pdf', f'camicia_{nome}.pdf']
+    pagine = dict(zip(files, (pagine_diploma, 1)))
+    return {'indice': indice, 'nome': nome, 'modulo': 'M', 'files': files, 'pagine': pagine,
+            'tempi': {}, 'stato': stato, 'messaggio': ''}
+
+
+def test_unita_dal_manifest_per_indice(tmp_path):
+    batch_info = _batch_con_manifest(tmp_path, [
+        _esito(2, 'ANNA_BIANCHI', pagine_diploma=3), _esito(0, 'MARIO_ROSSI'),
+        _esito(1, 'MARIO_ROSSI', stato='ERRORE')])
+    unita = stampa.unita_di_stampa(batch_info)
+    # L'omonimo in errore non riceve i PDF dell'altro MARIO ROSSI
+    assert [u['riga'] for u in unita] == [0, 2]
+    assert unita[1]['files'] == {'diplomi': ['diploma_ANNA_BIANCHI_M.pdf'],
+                                 'intercalato': ['diploma_ANNA_BIANCHI_M.pdf', 'camicia_ANNA_BIANCHI.pdf']}
+    assert unita[1]['pagine'] == {'diplomi': 3, 'intercalato': 4}
+    assert unita[1]['byte'] == {'diplomi': 10, 'intercalato': 20}
+
+
+def test_unita_senza_manifest(tmp_path):
+    batch_info = {'temp_dir': str(tmp_path), 'original_folder_name': 'X', 'filenames': [],
+                  'metadata': {'student_list': TabellaStudenti.da_record([{'NOM_COG': 'A'}])}}
+    with pytest.raises(ValueError):
+        stampa.unita_di_stampa(batch_info)
@@ -0,0 +1,101 @@
+# TabellaStudenti: righe come Mapping, valori condivisi, formato per colonne di batch.json
+import json
+import pickle
+
+import pytest
+
+from tabella import Studente, TabellaStudenti, contesto, json_default
+
+COLONNE = ('MATRI', 'NOM_COG', 'CORSOLAU')
+
+
+def _tabella():
+    return TabellaStudenti.da_righe(COLONNE, [['1', 'MARIO ROSSI', 'INGEGNERIA'],
+                                              ['2', 'ANNA BIANCHI', 'INGEGNERIA']])
+
+
+def test_riga_come_mapping():
+    s = _tabella()[1]
+    assert s['NOM_COG'] == 'ANNA BIANCHI'
+    assert s.get('MATRI') == '2' and s.get('ASSENTE', 'x') == 'x'
+    assert 'CORSOLAU' in s and 'ASSENTE' not in s
+    assert list(s) == list(COLONNE) and len(s) == 3
+    assert dict(s) == {'MATRI': '2', 'NOM_COG': 'ANNA BIANCHI', 'CORSOLAU': 'INGEGNERIA'}
+    with pytest.raises(KeyError):
+        s['ASSENTE']
+
+
+def test_valori_ripetuti_condivisi():
+    # Oggetti distinti con lo stesso testo, come dal lettore CSV
+    corso_1, corso_2 = ''.join(['INGE', 'GNERIA']), ''.join(['INGEGN', 'ERIA'])
+    assert corso_1 is not corso_2
+    tabella = TabellaStudenti.da_righe(COLONNE, [['1', 'A', corso_1], ['2', 'B', corso_2]])
+    assert tabella.righe[0][2] is tabella.righe[1][2]
+    # Le righe condividono anche le intestazioni
+    assert tabella[0].colonne is tabella[1].colonne
+
+
+def test_contesto_con_chiavi_minuscole():
+    s = _tabella()[0]
+    assert s.contesto() == {'matri': '1', 'nom_cog': 'MARIO ROSSI', 'corsolau': 'INGEGNERIA'}
+    assert contesto(s) == s.contesto()
+    assert contesto({'MATRI': '9'}) == {'matri': '9'}
+
+
+def test_correzione_di_una_riga():
+    tabella = _tabella()
+    corretto = tabella[0].con({'NOM_COG': 'MARIO VERDI'})
+    assert tabella[0]['NOM_COG'] == 'MARIO ROSSI'
+    tabella[0] = corretto
+    assert tabella.righe[0] == ('1', 'MARIO VERDI', 'INGEGNERIA')
+    with pytest.raises(KeyError):
+        tabella[0].con({'ASSENTE': 'x'})
+
+
+def test_slice_e_colonne():
+    tabella = _tabella()
+    assert [s['MATRI'] for s in tabella[0:2]] == ['1', '2']
+    assert tabella.colonna('NOM_COG') == ['MARIO ROSSI', 'ANNA BIANCHI']
+    assert tabella.colonna('ASSENTE', default='-') == ['-', '-']
+    assert len(TabellaStudenti()) == 0
+
+
+def test_json_per_colonne():
+    tabella = _tabella()
+    testo = json.dumps({'student_list': tabella}, default=json_default)
+    dati = json.loads(testo)['student_list']
+    assert dati == {'colonne': list(COLONNE),
+                    'righe': [['1', 'MARIO ROSSI', 'INGEGNERIA'], ['2', 'ANNA BIANCHI', 'INGEGNERIA']]}
+    assert TabellaStudenti.da_json(dati) == tabella
+    assert TabellaStudenti.da_json(tabella) is tabella
+    with pytest.raises(TypeError):
+        json.dumps({'x': object()}, default=json_default)
+
+
+def test_vecchio_formato():
+    # batch.json scritti prima della tabella: lista di dict
+    tabella = TabellaStudenti.da_json([{'MATRI': '1', 'NOM_COG': 'MARIO ROSSI'},
+                                       {'MATRI': '2', 'NOM_COG': 'ANNA BIANCHI'}])
+    assert tabella.colonne.nomi == ('MATRI', 'NOM_COG')
+    assert tabella.righe == [('1', 'MARIO ROSSI'), ('2', 'ANNA BIANCHI')]
+
+
+def test_record_api():
+    # Colonne in ordine di prima comparsa, campi assenti o null vuoti
+    tabella = TabellaStudenti.da_record([{'MATRI': '1', 'NOM_COG': ' MARIO ROSSI ', 'FIRMAD': None},
+                                         {'MATRI': '2', 'LUOGONAS': 'PISA'}])
+    assert tabella.colonne.nomi == ('MATRI', 'NOM_COG', 'FIRMAD', 'LUOGONAS')
+    assert tabella.righe == [('1', 'MARIO ROSSI', '', ''), ('2', '', '', 'PISA')]
+
+
+@pytest.mark.parametrize('valore', [1234567, 1.5, True, ['A'], {'a': 'b'}])
+def test_record_api_solo_testo(valore):
+    with pytest.raises(ValueError, match=r"Studente 2, campo MATRI"):
+        TabellaStudenti.da_record([{'MATRI': '1'}, {'MATRI': valore}])
+
+
+def test_riga_serializzabile_per_i_processi_di_render():
+    s = _tabella()[1]
+    copia = pickle.loads(pickle.dumps(s))
+    assert isinstance(copia, Studente) and dict(copia) == dict(s)
+    assert copia.colonne.posizioni == s.colonne.posizioni
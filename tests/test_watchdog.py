@@ -0,0 +1,128 @@
+# Watchdog dei record: un processo terminato dal watchdog addebita il tentativo solo
+# al record che ha lasciato il marcatore, e un segnale arrivato a record concluso
+# non lo trasforma in TIMEOUT.
+import json
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import engine
+import scheduler
+import watchdog_record
+from tabella import TabellaStudenti
+
+TEMPI = {'jinja': 0.0, 'layout': 0.0, 'write': 0.0, 'cache_hit': True}
+COSTO = {'secondi': 130.0, 'rss_mb': 12.0}
+
+
+def _marcatore(dest_dir, indice):
+    with open(watchdog_record.marcatore_path(str(dest_dir), indice), 'w', encoding='utf-8') as f:
+        json.dump({'motivo': 'budget di 120s superato', 'costo': COSTO}, f)
+
+
+def _studente(indice):
+    return {'NOM_COG': f'STUD {indice}'}
+
+
+def test_esito_interrotto_colpevole_e_innocenti(tmp_path):
+    _marcatore(tmp_path, 1)
+    marcatori = watchdog_record.marcatori_presenti((str(tmp_path), i) for i in range(3))
+    tentativi = {}
+    assert engine.esito_interrotto(0, _studente(0), str(tmp_path), 'rotto', tentativi, marcatori) is None
+    esito = engine.esito_interrotto(1, _studente(1), str(tmp_path), 'rotto', tentativi, marcatori)
+    assert esito['stato'] == 'TIMEOUT' and esito['costo'] == COSTO
+    assert engine.esito_interrotto(2, _studente(2), str(tmp_path), 'rotto', tentativi, marcatori) is None
+    assert tentativi == {}
+
+
+def test_esito_interrotto_senza_marcatori_conta_i_tentativi(tmp_path):
+    tentativi = {}
+    for _ in range(engine.MAX_TENTATIVI_RECORD - 1):
+        assert engine.esito_interrotto(0, _studente(0), str(tmp_path), 'rotto', tentativi, set()) is None
+    esito = engine.esito_interrotto(0, _studente(0), str(tmp_path), 'rotto', tentativi, set())
+    assert esito['stato'] == 'ERRORE' and 'rotto' in esito['messaggio']
+
+
+class _PoolRotto:
+    _broken = True
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def _job(sched, batch_id, dest_dir, n):
+    job = scheduler.Job(batch_id, 'ICI', TabellaStudenti.da_record([_studente(i) for i in range(n)]),
+                        str(dest_dir), 'x', on_complete=None, concludi=lambda esiti: None)
+    sched._jobs[batch_id] = job
+    return job
+
+
+def _in_volo(sched, pool, job, indice):
+    job.da_fare.remove(indice)
+    job.in_volo += 1
+    sched._in_volo += 1
+    sched._in_volo_facolta[job.facolta] = sched._in_volo_facolta.get(job.facolta, 0) + 1
+    sched._record_sul_pool.setdefault(pool, set()).add((job.dest_dir, indice))
+
+
+def _rotto():
+    future = Future()
+    future.set_exception(BrokenProcessPool('processo terminato'))
+    return future
+
+
+def test_pool_rotto_dal_watchdog_addebita_solo_il_colpevole(tmp_path):
+    sched = scheduler.RenderScheduler(2, crea_pool=lambda slots, warmup: _PoolRotto())
+    sched._pool = pool = _PoolRotto()
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    colpevole = _job(sched, 'a', tmp_path / 'a', 2)
+    innocente = _job(sched, 'b', tmp_path / 'b', 2)
+    _in_volo(sched, pool, colpevole, 0)
+    _in_volo(sched, pool, innocente, 0)
+    _marcatore(tmp_path / 'a', 0)
+    # L'innocente viene notificato per primo: il marcatore del colpevole c'è ancora
+    sched._record_concluso(innocente, 0, _rotto(), pool=pool)
+    sched._record_concluso(colpevole, 0, _rotto(), pool=pool)
+    assert innocente.da_fare == [1, 0] and innocente.tentativi == {} and innocente.completati == 0
+    assert colpevole.esiti[0]['stato'] == 'TIMEOUT' and colpevole.completati == 1
+    assert sched._in_volo == 0 and sched._pool is not pool
+
+
+def test_pool_rotto_senza_marcatore_conta_il_tentativo(tmp_path):
+    sched = scheduler.RenderScheduler(2, crea_pool=lambda slots, warmup: _PoolRotto())
+    sched._pool = pool = _PoolRotto()
+    job = _job(sched, 'a', tmp_path, 1)
+    _in_volo(sched, pool, job, 0)
+    sched._record_concluso(job, 0, _rotto(), pool=pool)
+    assert job.da_fare == [0] and job.tentativi == {0: 1}
+
+
+def test_consegna_a_pool_gia_rotto_non_conta_il_tentativo(tmp_path):
+    sched = scheduler.RenderScheduler(2, crea_pool=lambda slots, warmup: _PoolRotto())
+    sched._pool = pool = _PoolRotto()
+    job = _job(sched, 'a', tmp_path, 1)
+    _in_volo(sched, pool, job, 0)
+    sched._record_concluso(job, 0, None, BrokenProcessPool('rotto'), pool)
+    assert job.da_fare == [0] and job.tentativi == {}
+
+
+class _WatchdogInRitardo:
+    # Il SIGUSR1 del watchdog gestito mentre il contesto si chiude, a record scritto
+    def __init__(self, budget, dest_dir, indice):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        raise watchdog_record.BudgetSuperato('budget di 1s superato', COSTO)
+
+
+def test_segnale_a_record_concluso_non_e_timeout(tmp_path, monkeypatch):
+    monkeypatch.setattr(engine, 'prepara_record', lambda student, template=None: (
+        'diploma.html', 'M', {'nom_cog': 'MARIO ROSSI'}, {}))
+    monkeypatch.setattr(engine, 'render_documento', lambda *args: (dict(TEMPI), 1))
+    monkeypatch.setattr(watchdog_record, 'Watchdog', _WatchdogInRitardo)
+    esito = engine.render_record(0, {'NOM_COG': 'MARIO ROSSI'}, str(tmp_path), budget={'secondi': 1})
+    assert esito['stato'] == 'OK' and len(esito['files']) == 2
+
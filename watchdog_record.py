@@ -0,0 +1,163 @@
+# --- WATCHDOG DEI RECORD ---
+# Budget di tempo e di memoria per il render di un singolo record: una riga
+# patologica (corsolau enorme, PNG di firma corrotto) non deve bloccare il batch.
+#
+# Un thread di controllo misura durata e crescita della RSS del processo mentre
+# il record è in corso. Superato il budget invia SIGUSR1 al processo: il gestore,
+# eseguito nel thread principale, solleva BudgetSuperato e il record termina
+# come TIMEOUT. Se il thread principale è fermo dentro codice C (Pango) e non
+# risponde entro la tolleranza, nei processi di render il watchdog annota il
+# costo in un file accanto ai PDF e termina il processo: il pool viene ricreato
+# e il chiamante ricostruisce l'esito con esito_da_marcatore. Gli altri record
+# in corso nello stesso pool muoiono con lui: marcatori_presenti distingue il
+# record che ha causato la terminazione da quelli da rimettere in coda.
+import json
+import os
+import signal
+import threading
+import time
+
+SEGNALE = getattr(signal, 'SIGUSR1', None)
+MARCATORE_PREFIX = '.watchdog_record_'
+INTERVALLO_CONTROLLO = 0.05
+TOLLERANZA_MIN_SECONDI = 5.0
+
+# Solo nei processi del pool il watchdog può terminare il processo
+terminazione_consentita = False
+
+_corrente = None
+_gestore_installato = False
+
+
+class BudgetSuperato(Exception):
+    def __init__(self, motivo, costo):
+        super().__init__(f"{motivo} ({costo['secondi']:.2f}s, +{costo['rss_mb']:.0f} MB RSS)")
+        self.costo = costo
+
+
+def budget_record(secondi=None, rss_mb=None):
+    """Budget per record dalla configurazione; 0 o None disattivano il limite."""
+    budget = {}
+    if secondi:
+        budget['secondi'] = float(secondi)
+    if rss_mb:
+        budget['rss_mb'] = float(rss_mb)
+    return budget or None
+
+
+def rss_mb():
+    """RSS attuale del processo in MB (None dove /proc non è disponibile)."""
+    try:
+        with open('/proc/self/statm') as f:
+            pagine = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pagine * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def _gestore(signum, frame):
+    watchdog = _corrente
+    if watchdog is not None and watchdog.superato:
+        raise BudgetSuperato(watchdog.superato, watchdog.costo())
+
+
+def _installa_gestore():
+    global _gestore_installato
+    if SEGNALE is None or threading.current_thread() is not threading.main_thread():
+        return False
+    if not _gestore_installato:
+        # Resta installato per tutta la vita del processo: un segnale arrivato
+        # a record appena concluso viene ignorato invece di terminare il processo
+        signal.signal(SEGNALE, _gestore)
+        _gestore_installato = True
+    return True
+
+
+def marcatore_path(dest_dir, indice):
+    return os.path.join(dest_dir, f'{MARCATORE_PREFIX}{indice}.json')
+
+
+def marcatori_presenti(record):
+    """Marcatori lasciati dal watchdog tra i record (dest_dir, indice) in corso in un pool rotto.
+
+    Va letto una volta per pool, prima che esito_da_marcatore consumi il marcatore del colpevole.
+    """
+    return {path for path in (marcatore_path(dest_dir, indice) for dest_dir, indice in record)
+            if os.path.exists(path)}
+
+
+def esito_da_marcatore(dest_dir, indice):
+    """(motivo, costo) annotati da un watchdog che ha terminato il processo, altrimenti None."""
+    path = marcatore_path(dest_dir, indice)
+    try:
+        with open(path, encoding='utf-8') as f:
+            dati = json.load(f)
+        os.remove(path)
+    except (OSError, ValueError):
+        return None
+    return dati['motivo'], dati['costo']
+
+
+class Watchdog:
+    """Contesto che applica il budget al record in corso nel thread principale.
+
+    Fuori dal thread principale (es. consumatori della inbox con workers=1)
+    o senza SIGUSR1 il budget non può essere applicato e il contesto non fa nulla.
+    """
+
+    def __init__(self, budget, dest_dir, indice):
+        self.budget = budget or {}
+        self.dest_dir = dest_dir
+        self.indice = indice
+        self.superato = None
+        self._t0 = None
+        self._rss_iniziale = None
+        self._rss_picco = 0.0
+        self._fine = threading.Event()
+        self._thread = None
+
+    def costo(self):
+        return {'secondi': time.perf_counter() - self._t0, 'rss_mb': self._rss_picco}
+
+    def __enter__(self):
+        global _corrente
+        if not self.budget or not _installa_gestore():
+            return self
+        self._t0 = time.perf_counter()
+        self._rss_iniziale = rss_mb()
+        _corrente = self
+        self._thread = threading.Thread(target=self._controlla, name=f'watchdog-{self.indice}', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        global _corrente
+        if self._thread is not None:
+            # Prima di fermare il thread: da qui un SIGUSR1 in arrivo viene ignorato
+            _corrente = None
+            self._fine.set()
+            self._thread.join()
+        return False
+
+    def _controlla(self):
+        limite_s = self.budget.get('secondi')
+        limite_mb = self.budget.get('rss_mb') if self._rss_iniziale is not None else None
+        while not self._fine.wait(INTERVALLO_CONTROLLO):
+            if limite_mb is not None:
+                self._rss_picco = max(self._rss_picco, (rss_mb() or 0.0) - self._rss_iniziale)
+            if limite_s is not None and time.perf_counter() - self._t0 > limite_s:
+                self.superato = f"budget di {limite_s:g}s superato"
+            elif limite_mb is not None and self._rss_picco > limite_mb:
+                self.superato = f"budget di {limite_mb:g} MB superato"
+            if self.superato:
+                break
+        else:
+            return
+        os.kill(os.getpid(), SEGNALE)
+        tolleranza = max(TOLLERANZA_MIN_SECONDI, (limite_s or 0) * 0.25)
+        if self._fine.wait(tolleranza) or not terminazione_consentita:
+            return
+        # Il thread principale non risponde: si annota il costo e si termina il processo
+        with open(marcatore_path(self.dest_dir, self.indice), 'w', encoding='utf-8') as f:
+            json.dump({'motivo': self.superato, 'costo': self.costo()}, f)
+        os._exit(70)
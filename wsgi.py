@@ -0,0 +1,9 @@
+# --- PUNTO DI INGRESSO PER LA PRODUZIONE ---
+# Avvio: gunicorn -c gunicorn.conf.py
+# Con preload_app il modulo viene importato una sola volta nel master:
+# template compilati, font e immagini sono già in memoria quando i worker fanno fork.
+from app import app, preload
+
+# Niente auto-reload dei template: nessun controllo di mtime ad ogni render
+app.config['TEMPLATES_AUTO_RELOAD'] = False
+preload()